@@ -0,0 +1,6 @@
+"""Offline benchmarks for the plugin handlers.
+
+Run with ``python -m benchmarks`` from the repository root. Handlers are driven
+with synthetic events against a fake REST client and an in-memory mongomock store,
+and the throughput and latency of each handler are reported as JSON.
+"""
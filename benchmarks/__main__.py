@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+import typing
+
+from benchmarks.fakes import FakeBot, FakeGuild
+from benchmarks.scenarios import GUILD_ID, PLUGINS, SCENARIOS
+from benchmarks.store import AsyncDatabase
+from utils import rest, writebehind
+
+
+def percentile(samples: typing.List[float], fraction: float) -> float:
+    """Returns the nearest rank percentile of sorted samples.
+
+    Arguments:
+        samples: The samples sorted in ascending order.
+        fraction: The percentile as a fraction between 0 and 1.
+
+    Returns:
+        The sample at the percentile.
+    """
+    index = min(len(samples) - 1, max(0, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def get_commit() -> typing.Optional[str]:
+    """Returns the commit the benchmarks are run against, if known."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_scenario(name: str, arguments: argparse.Namespace) -> dict:
+    """Runs a scenario against a fresh store and reports its latency.
+
+    Arguments:
+        name: The name of the scenario.
+        arguments: The parsed command line arguments.
+
+    Returns:
+        The throughput and latency percentiles of the scenario.
+    """
+    bot = FakeBot(AsyncDatabase(arguments.db_latency), arguments.rest_latency)
+    guild = FakeGuild(GUILD_ID, bot.rest)
+    bot.rest.guilds[guild.id] = guild
+
+    # Plugins are bound directly to avoid building real lightbulb commands
+    for plugin in PLUGINS:
+        plugin._app = bot
+
+    rest.lookups.app = bot
+    writebehind.queue.database = bot.d.db_conn
+
+    scenario = SCENARIOS[name](bot, guild)
+    await scenario.setup(arguments.iterations)
+
+    latencies = []
+    semaphore = asyncio.Semaphore(arguments.concurrency)
+
+    async def invoke(iteration: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await scenario.run(iteration)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(invoke(i) for i in range(arguments.iterations)))
+    elapsed = time.perf_counter() - start
+
+    # Write queued operations before the next scenario
+    await writebehind.queue.flush()
+
+    latencies.sort()
+
+    return {
+        "iterations": arguments.iterations,
+        "throughput_per_s": round(arguments.iterations / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "rest_requests": bot.rest.requests,
+    }
+
+
+async def main(arguments: argparse.Namespace) -> dict:
+    """Runs every selected scenario.
+
+    Arguments:
+        arguments: The parsed command line arguments.
+
+    Returns:
+        The benchmark report.
+    """
+    results = {}
+
+    for name in arguments.scenarios or SCENARIOS:
+        results[name] = await run_scenario(name, arguments)
+
+    return {
+        "commit": get_commit(),
+        "settings": {
+            "iterations": arguments.iterations,
+            "concurrency": arguments.concurrency,
+            "rest_latency": arguments.rest_latency,
+            "db_latency": arguments.db_latency,
+        },
+        "results": results,
+    }
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmarks plugin handlers without discord or a database.",
+    )
+    parser.add_argument(
+        "scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument("-n", "--iterations", type=int, default=500)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--rest-latency", type=float, default=0.005)
+    parser.add_argument("--db-latency", type=float, default=0.001)
+    parser.add_argument("-o", "--output", help="File to write the JSON report to")
+
+    arguments = parser.parse_args()
+
+    for name in arguments.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    return arguments
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    report = json.dumps(asyncio.run(main(arguments)), indent=4)
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
@@ -0,0 +1,226 @@
+import asyncio
+import itertools
+import typing
+
+import hikari
+import lightbulb
+
+# Snowflakes starting above any ID used when seeding the store
+_snowflakes = itertools.count(1 << 40)
+
+
+def next_snowflake() -> hikari.Snowflake:
+    """Returns a new unique snowflake."""
+    return hikari.Snowflake(next(_snowflakes))
+
+
+class FakeUser:
+    """A user with the attributes read by the plugins."""
+
+    def __init__(self, user_id: int, username: str) -> None:
+        self.id = hikari.Snowflake(user_id)
+        self.username = username
+        self.discriminator = "0001"
+        self.avatar_url = None
+        self.default_avatar_url = None
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+class FakeMember(FakeUser):
+    """A guild member whose voice channel can be changed."""
+
+    def __init__(self, user_id: int, username: str, guild: "FakeGuild") -> None:
+        super().__init__(user_id, username)
+        self.guild_id = guild.id
+        self._guild = guild
+
+    async def edit(self, **kwargs) -> "FakeMember":
+        await self._guild.rest.call()
+        return self
+
+
+class FakeVoiceChannel:
+    """A guild voice channel that can be cloned, edited and deleted."""
+
+    def __init__(self, channel_id: int, name: str, guild: "FakeGuild") -> None:
+        self.id = hikari.Snowflake(channel_id)
+        self.name = name
+        self.guild_id = guild.id
+        self.position = 0
+        self.user_limit = 0
+        self.bitrate = 64000
+        self.video_quality_mode = hikari.VideoQualityMode.AUTO
+        self.permission_overwrites = {}
+        self.region = None
+        self.parent_id = None
+        self._guild = guild
+
+    def get_guild(self) -> "FakeGuild":
+        return self._guild
+
+    async def edit(self, **kwargs) -> "FakeVoiceChannel":
+        await self._guild.rest.call()
+        return self
+
+    async def delete(self) -> None:
+        await self._guild.rest.call()
+        self._guild.channels.pop(self.id, None)
+
+
+class FakeGuild:
+    """A guild holding voice channels."""
+
+    def __init__(self, guild_id: int, rest: "FakeRest") -> None:
+        self.id = hikari.Snowflake(guild_id)
+        self.rest = rest
+        self.channels: typing.Dict[hikari.Snowflake, FakeVoiceChannel] = {}
+
+    def add_voice_channel(self, channel_id: int, name: str) -> FakeVoiceChannel:
+        channel = FakeVoiceChannel(channel_id, name, self)
+        self.channels[channel.id] = channel
+        return channel
+
+    async def create_voice_channel(self, name: str, **kwargs) -> FakeVoiceChannel:
+        await self.rest.call()
+        return self.add_voice_channel(next_snowflake(), name)
+
+
+class FakeRest:
+    """A REST client which answers after a fixed simulated latency.
+
+    Arguments:
+        latency: The simulated round trip time of every request in seconds.
+    """
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.requests = 0
+        self.guilds: typing.Dict[hikari.Snowflake, FakeGuild] = {}
+
+    async def call(self) -> None:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    async def fetch_channel(self, channel_id: int) -> FakeVoiceChannel:
+        await self.call()
+
+        for guild in self.guilds.values():
+            if channel_id in guild.channels:
+                return guild.channels[channel_id]
+
+        raise hikari.NotFoundError(f"/channels/{channel_id}", {}, b"")
+
+    async def fetch_guild(self, guild_id: int) -> FakeGuild:
+        await self.call()
+
+        if guild_id not in self.guilds:
+            raise hikari.NotFoundError(f"/guilds/{guild_id}", {}, b"")
+
+        return self.guilds[guild_id]
+
+    async def fetch_user(self, user_id: int) -> FakeUser:
+        await self.call()
+        return FakeUser(user_id, f"user-{user_id}")
+
+
+class FakeCache:
+    """A gateway cache which is empty, so every lookup goes to REST."""
+
+    def get_guild(self, guild_id: int) -> None:
+        return None
+
+    def get_guild_channel(self, channel_id: int) -> None:
+        return None
+
+    def get_user(self, user_id: int) -> None:
+        return None
+
+    def get_member(self, guild_id: int, user_id: int) -> None:
+        return None
+
+    def get_voice_states_view_for_channel(
+        self, guild_id: int, channel_id: int
+    ) -> typing.Dict[hikari.Snowflake, typing.Any]:
+        return {}
+
+
+class FakeBot:
+    """A bot application exposing the attributes the plugins read.
+
+    Arguments:
+        database: The store to use as the database connection.
+        rest_latency: The simulated REST round trip time in seconds.
+    """
+
+    def __init__(self, database, rest_latency: float) -> None:
+        self.d = lightbulb.utils.DataStore()
+        self.d.db_conn = database
+        self.d.db_read_conn = database
+        self.rest = FakeRest(rest_latency)
+        self.cache = FakeCache()
+        self.shards = {}
+        self._me = FakeUser(1, "Campfire")
+
+    def get_me(self) -> FakeUser:
+        return self._me
+
+
+class FakeVoiceState:
+    """A member's voice state."""
+
+    def __init__(
+        self,
+        guild: FakeGuild,
+        member: FakeMember,
+        channel_id: typing.Optional[int],
+    ) -> None:
+        self.guild_id = guild.id
+        self.member = member
+        self.user_id = member.id
+        self.channel_id = hikari.Snowflake(channel_id) if channel_id else None
+
+
+class FakeVoiceStateUpdateEvent:
+    """A voice state update moving a member between channels."""
+
+    def __init__(
+        self,
+        state: FakeVoiceState,
+        old_state: typing.Optional[FakeVoiceState] = None,
+    ) -> None:
+        self.state = state
+        self.old_state = old_state
+        self.guild_id = state.guild_id
+
+
+class FakeContext:
+    """A command context with the given options.
+
+    Arguments:
+        bot: The bot application.
+        guild: The guild the command was used in.
+        author: The member who used the command.
+        **options: The options passed to the command.
+    """
+
+    def __init__(
+        self, bot: FakeBot, guild: FakeGuild, author: FakeMember, **options
+    ) -> None:
+        self.app = bot
+        self.bot = bot
+        self.author = author
+        self.member = author
+        self.guild_id = guild.id
+        self.options = lightbulb.utils.DataStore(options)
+        self.responses = 0
+        self._guild = guild
+
+    def get_guild(self) -> FakeGuild:
+        return self._guild
+
+    async def respond(self, *args, **kwargs) -> None:
+        self.responses += 1
+        await self.app.rest.call()
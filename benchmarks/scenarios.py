@@ -0,0 +1,198 @@
+import abc
+import random
+import typing
+
+from benchmarks.fakes import (
+    FakeBot,
+    FakeContext,
+    FakeGuild,
+    FakeMember,
+    FakeVoiceState,
+    FakeVoiceStateUpdateEvent,
+    next_snowflake,
+)
+from extensions import lobbies, reputation, tags
+
+GUILD_ID = 100
+TEMPLATE_ID = 200
+SEEDED_TAGS = 100
+SEEDED_MEMBERS = 50
+
+
+class Scenario(abc.ABC):
+    """A plugin handler driven with synthetic events or contexts.
+
+    Subclasses seed the store in setup and invoke the handler once per iteration.
+
+    Arguments:
+        bot: The fake bot application.
+        guild: The guild the handler runs in.
+    """
+
+    name = ""
+
+    def __init__(self, bot: FakeBot, guild: FakeGuild) -> None:
+        self.bot = bot
+        self.guild = guild
+
+    def member(self, member_id: int) -> FakeMember:
+        return FakeMember(member_id, f"member-{member_id}", self.guild)
+
+    async def setup(self, iterations: int) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def run(self, iteration: int) -> None:
+        """Invokes the handler once.
+
+        Arguments:
+            iteration: The number of the iteration, starting at 0.
+
+        Returns:
+            None.
+        """
+
+
+class JoinTemplate(Scenario):
+    """Members joining a lobby template channel."""
+
+    name = "lobbies.on_join_template"
+
+    async def setup(self, iterations: int) -> None:
+        self.guild.add_voice_channel(TEMPLATE_ID, "Template")
+        await self.bot.d.db_conn.lobby_channels.insert_one(
+            {"guild_id": self.guild.id, "templates": [TEMPLATE_ID]}
+        )
+
+    async def run(self, iteration: int) -> None:
+        state = FakeVoiceState(self.guild, self.member(iteration), TEMPLATE_ID)
+        await lobbies.on_join_template(FakeVoiceStateUpdateEvent(state))
+
+
+class LeaveClone(Scenario):
+    """The last member leaving a lobby clone channel."""
+
+    name = "lobbies.on_leave_clone"
+
+    async def setup(self, iterations: int) -> None:
+        self.clone_ids = []
+
+        for iteration in range(iterations):
+            clone = self.guild.add_voice_channel(next_snowflake(), "Clone")
+            self.clone_ids.append(clone.id)
+
+        await self.bot.d.db_conn.lobby_channels.insert_one(
+            {
+                "guild_id": self.guild.id,
+                "templates": [TEMPLATE_ID],
+                "clones": [
+                    {"clone_id": clone_id, "template_id": TEMPLATE_ID, "owner_id": 1}
+                    for clone_id in self.clone_ids
+                ],
+            }
+        )
+
+    async def run(self, iteration: int) -> None:
+        member = self.member(iteration)
+        old_state = FakeVoiceState(self.guild, member, self.clone_ids[iteration])
+        state = FakeVoiceState(self.guild, member, None)
+        await lobbies.on_leave_clone(FakeVoiceStateUpdateEvent(state, old_state))
+
+
+class ShowTag(Scenario):
+    """Members showing existing tags."""
+
+    name = "tags.show"
+
+    async def setup(self, iterations: int) -> None:
+        await self.bot.d.db_conn.tags.insert_one(
+            {
+                "guild_id": self.guild.id,
+                "tags": [
+                    {
+                        "name": f"tag-{index}",
+                        "content": "Lorem ipsum " * 20,
+                        "author_id": 1,
+                        "created_at": "2022-01-01T00:00:00+00:00",
+                        "modified_at": "2022-01-01T00:00:00+00:00",
+                        "uses": 0,
+                    }
+                    for index in range(SEEDED_TAGS)
+                ],
+            }
+        )
+
+    async def run(self, iteration: int) -> None:
+        context = FakeContext(
+            self.bot,
+            self.guild,
+            self.member(iteration),
+            name=f"tag-{random.randrange(SEEDED_TAGS)}",
+        )
+        await tags.show.callback(context)
+
+
+class CreateTag(Scenario):
+    """Members creating new tags."""
+
+    name = "tags.create"
+
+    async def run(self, iteration: int) -> None:
+        context = FakeContext(
+            self.bot,
+            self.guild,
+            self.member(iteration),
+            name=f"new-tag-{iteration}",
+            content="Lorem ipsum " * 20,
+        )
+        await tags.create.callback(context)
+
+
+class Upvote(Scenario):
+    """Members upvoting other members, staying within the vote rate limits."""
+
+    name = "reputation.upvote"
+
+    async def run(self, iteration: int) -> None:
+        voter = self.member(next_snowflake())
+        target = self.member(next_snowflake())
+        context = FakeContext(self.bot, self.guild, voter, member=target)
+        await reputation.upvote.callback(context)
+
+
+class Leaderboard(Scenario):
+    """Members viewing pages of the reputation leaderboard."""
+
+    name = "reputation.leaderboard"
+
+    async def setup(self, iterations: int) -> None:
+        await self.bot.d.db_conn.reputation_counters.insert_many(
+            [
+                {
+                    "member_id": member_id,
+                    "guild_id": None,
+                    "upvotes": member_id % 20,
+                    "downvotes": 0,
+                    "score": member_id % 20,
+                }
+                for member_id in range(1, SEEDED_MEMBERS * 100 + 1)
+            ]
+        )
+        await reputation.reconcile_leaderboard()
+
+    async def run(self, iteration: int) -> None:
+        context = FakeContext(
+            self.bot,
+            self.guild,
+            self.member(random.randrange(1, SEEDED_MEMBERS + 1)),
+            page=random.randrange(1, 11),
+        )
+        await reputation.leaderboard_command.callback(context)
+
+
+SCENARIOS: typing.Dict[str, typing.Type[Scenario]] = {
+    scenario.name: scenario
+    for scenario in (JoinTemplate, LeaveClone, ShowTag, CreateTag, Upvote, Leaderboard)
+}
+
+PLUGINS = (lobbies.plugin, reputation.plugin, tags.plugin)
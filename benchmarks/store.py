@@ -0,0 +1,218 @@
+import asyncio
+import functools
+import typing
+
+import mongomock
+
+from pymongo import UpdateMany, UpdateOne
+
+
+def apply_update_pipeline(
+    collection: mongomock.Collection,
+    filter: dict,
+    pipeline: typing.List[dict],
+    upsert: bool = False,
+    multi: bool = False,
+) -> mongomock.results.UpdateResult:
+    """Applies an update given as an aggregation pipeline to a mongomock collection.
+
+    mongomock only takes update documents, so each matched document is run through
+    the pipeline with an aggregation and replaced by the result.
+
+    Arguments:
+        collection: The mongomock collection.
+        filter: The filter selecting the documents to update.
+        pipeline: The update pipeline.
+        upsert: Whether to insert a document if none match.
+        multi: Whether to update every matched document instead of the first.
+
+    Returns:
+        The result of the update.
+    """
+    document_ids = [document["_id"] for document in collection.find(filter, {"_id": 1})]
+    document_ids = document_ids if multi else document_ids[:1]
+    result = {"n": len(document_ids), "nModified": len(document_ids)}
+
+    if not document_ids and upsert:
+        # Like the server, the upserted document starts from the filter's equalities
+        upserted_id = collection.insert_one(
+            {
+                key: value
+                for key, value in filter.items()
+                if not key.startswith("$") and not isinstance(value, dict)
+            }
+        ).inserted_id
+        document_ids = [upserted_id]
+        result = {"n": 1, "nModified": 0, "upserted": upserted_id}
+
+    for document_id in document_ids:
+        (document,) = collection.aggregate(
+            [{"$match": {"_id": document_id}}, *pipeline]
+        )
+        collection.replace_one({"_id": document_id}, document)
+
+    return mongomock.results.UpdateResult(result, True)
+
+
+class AsyncCursor:
+    """An asynchronous view over the results of a mongomock query.
+
+    Arguments:
+        results: The iterable of documents returned by mongomock.
+        latency: The simulated round trip time in seconds.
+    """
+
+    def __init__(self, results: typing.Iterable[dict], latency: float) -> None:
+        self._results = results
+        self._latency = latency
+        self._iterator: typing.Optional[typing.Iterator[dict]] = None
+
+    def __aiter__(self) -> "AsyncCursor":
+        return self
+
+    async def __anext__(self) -> dict:
+        if self._iterator is None:
+            await asyncio.sleep(self._latency)
+            self._iterator = iter(list(self._results))
+
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length: typing.Optional[int] = None) -> typing.List[dict]:
+        await asyncio.sleep(self._latency)
+        documents = list(self._results)
+
+        return documents[:length] if length is not None else documents
+
+    def sort(self, *args, **kwargs) -> "AsyncCursor":
+        self._results = self._results.sort(*args, **kwargs)
+        return self
+
+    def skip(self, count: int) -> "AsyncCursor":
+        self._results = self._results.skip(count)
+        return self
+
+    def limit(self, count: int) -> "AsyncCursor":
+        self._results = self._results.limit(count)
+        return self
+
+
+class AsyncCollection:
+    """Exposes a mongomock collection with the interface used from motor.
+
+    Like motor, operations are scheduled as soon as they are called and return a
+    future, so writes that are never awaited still happen. Updates given as
+    aggregation pipelines are applied by the store, as mongomock doesn't support
+    them.
+
+    Arguments:
+        collection: The mongomock collection.
+        latency: The simulated round trip time in seconds.
+    """
+
+    def __init__(self, collection: mongomock.Collection, latency: float) -> None:
+        self._collection = collection
+        self._latency = latency
+
+    async def _call(self, method: typing.Callable, *args, **kwargs) -> typing.Any:
+        await asyncio.sleep(self._latency)
+        return method(*args, **kwargs)
+
+    def _schedule(self, method: typing.Callable, *args, **kwargs) -> asyncio.Future:
+        return asyncio.ensure_future(self._call(method, *args, **kwargs))
+
+    def _update(
+        self,
+        filter: dict,
+        update: typing.Union[dict, typing.List[dict]],
+        upsert: bool = False,
+        multi: bool = False,
+        **kwargs,
+    ) -> mongomock.results.UpdateResult:
+        if isinstance(update, list):
+            return apply_update_pipeline(
+                self._collection, filter, update, upsert, multi
+            )
+
+        method = self._collection.update_many if multi else self._collection.update_one
+        return method(filter, update, upsert=upsert, **kwargs)
+
+    def _bulk_write(self, requests: list, **kwargs) -> typing.Any:
+        if not any(
+            isinstance(getattr(request, "_doc", None), list) for request in requests
+        ):
+            return self._collection.bulk_write(requests, **kwargs)
+
+        # Requests are applied one at a time so pipelines can be applied in order
+        for request in requests:
+            if isinstance(request, (UpdateOne, UpdateMany)):
+                self._update(
+                    request._filter,
+                    request._doc,
+                    request._upsert,
+                    isinstance(request, UpdateMany),
+                )
+            else:
+                self._collection.bulk_write([request])
+
+    def update_one(
+        self, filter: dict, update: typing.Any, upsert: bool = False, **kwargs
+    ) -> asyncio.Future:
+        return self._schedule(self._update, filter, update, upsert, **kwargs)
+
+    def update_many(
+        self, filter: dict, update: typing.Any, upsert: bool = False, **kwargs
+    ) -> asyncio.Future:
+        return self._schedule(self._update, filter, update, upsert, True, **kwargs)
+
+    def bulk_write(self, requests: list, **kwargs) -> asyncio.Future:
+        return self._schedule(self._bulk_write, list(requests), **kwargs)
+
+    def find(self, *args, **kwargs) -> AsyncCursor:
+        return AsyncCursor(self._collection.find(*args, **kwargs), self._latency)
+
+    def aggregate(self, pipeline: list, **kwargs) -> AsyncCursor:
+        return AsyncCursor(
+            self._collection.aggregate(pipeline, **kwargs), self._latency
+        )
+
+    def __getattr__(self, name: str) -> typing.Any:
+        method = getattr(self._collection, name)
+
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        def schedule(*args, **kwargs) -> asyncio.Future:
+            return self._schedule(method, *args, **kwargs)
+
+        return schedule
+
+
+class AsyncDatabase:
+    """Exposes a mongomock database with the interface used from motor.
+
+    Arguments:
+        latency: The simulated round trip time of every operation in seconds.
+    """
+
+    def __init__(self, latency: float) -> None:
+        self._database = mongomock.MongoClient()["campfire"]
+        self._latency = latency
+        self._collections: typing.Dict[str, AsyncCollection] = {}
+
+    def __getitem__(self, name: str) -> AsyncCollection:
+        if name not in self._collections:
+            self._collections[name] = AsyncCollection(
+                self._database[name], self._latency
+            )
+
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> AsyncCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        return self[name]
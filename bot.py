@@ -1,22 +1,106 @@
 import hikari
 import lightbulb
 import configparser
+import multiprocessing
+import time
+import typing
+
+from utils.gateway import get_gateway_profile
+from utils.sharding import get_worker_shards
+from utils.startup import import_extensions, load_extensions
 
 
 config = configparser.ConfigParser()
 config.read("config.ini")
 
+# Seconds discord requires between identifying each shard
+IDENTIFY_INTERVAL = 5
+
+
+def run_bot(
+    shard_ids: typing.Optional[typing.Set[int]] = None,
+    shard_count: typing.Optional[int] = None,
+    delay: float = 0,
+    worker: int = 0,
+    workers: int = 1,
+) -> None:
+    """Creates the bot and runs it until it is stopped.
+
+    Arguments:
+        shard_ids: The shards to run. Runs every shard if None.
+        shard_count: The total number of shards. Uses discord's recommendation if
+            None.
+        delay: The number of seconds to wait before connecting.
+        worker: The zero-indexed number of this worker process.
+        workers: The total number of worker processes.
+
+    Returns:
+        None.
+    """
+    time.sleep(delay)
+
+    extensions = import_extensions("extensions")
+    intents, cache_settings = get_gateway_profile(config, extensions.values())
 
-if __name__ == "__main__":
     bot = lightbulb.BotApp(
         token=config.get("BOT", "TOKEN"),
         prefix=lightbulb.when_mentioned_or(["campfire ", "camp "]),
+        intents=intents,
+        cache_settings=cache_settings,
     )
+    bot.d.worker = worker
+    bot.d.workers = workers
 
-    bot.load_extensions_from("./extensions")
+    load_extensions(bot, extensions)
     bot.run(
         activity=hikari.Activity(
             name="over your servers!", type=hikari.ActivityType.WATCHING
         ),
         status=hikari.Status.IDLE,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
     )
+
+
+def launch_workers(workers: int, shard_count: int) -> None:
+    """Runs the shards split across several worker processes.
+
+    Workers are started with a delay so that they identify their shards one after
+    another, as discord only allows one shard to identify at a time.
+
+    Arguments:
+        workers: The number of worker processes.
+        shard_count: The total number of shards.
+
+    Returns:
+        None.
+    """
+    processes = []
+    delay = 0
+
+    for worker in range(workers):
+        shard_ids = get_worker_shards(worker, workers, shard_count)
+        process = multiprocessing.Process(
+            target=run_bot,
+            args=(shard_ids, shard_count, delay, worker, workers),
+            name=f"campfire-worker-{worker}",
+        )
+        process.start()
+        processes.append(process)
+        delay += len(shard_ids) * IDENTIFY_INTERVAL
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    workers = config.getint("SHARDING", "WORKERS", fallback=1)
+    shard_count = config.getint("SHARDING", "SHARD_COUNT", fallback=0)
+
+    if workers > 1:
+        if shard_count < workers:
+            raise SystemExit("SHARD_COUNT must be at least WORKERS to run workers.")
+
+        launch_workers(workers, shard_count)
+    else:
+        run_bot(shard_count=shard_count or None)
@@ -1,6 +1,7 @@
 import lightbulb
 import typing
 
+from utils.metrics import instrument_plugin
 from utils.responses import info_response
 
 plugin = lightbulb.Plugin("About")
@@ -41,4 +42,5 @@ def load(bot: lightbulb.BotApp) -> None:
     Returns:
         None.
     """
+    instrument_plugin(plugin)
     bot.add_plugin(plugin)
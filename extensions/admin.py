@@ -1,43 +1,465 @@
+import asyncio
 import hikari
 import lightbulb
+import logging
 import typing
 
+from aiohttp import web
 from bot import config
+from utils import (
+    gateway,
+    invalidation,
+    lifecycle,
+    members,
+    metrics,
+    rest,
+    scheduler,
+    schema,
+    startup,
+    tracing,
+    writebehind,
+)
 from utils.exceptions import evaluate_exception
-from utils.responses import error_response
-from motor.motor_asyncio import AsyncIOMotorClient
+from utils.database import (
+    DATABASE_NAME,
+    PoolMonitor,
+    create_database_client,
+    get_read_database,
+)
+from utils.responses import create_info_embed, error_response
 
 
+logger = logging.getLogger(__name__)
+
 plugin = lightbulb.Plugin("Admin")
 
+INTENTS = hikari.Intents.NONE
+
+# Members joining, changing and leaving are only sent with the privileged members
+# intent, so the name index is only kept up to date when it is enabled
+MEMBER_EVENTS = config.getboolean("MEMBERS", "INDEX_EVENTS", fallback=False)
+
+if MEMBER_EVENTS:
+    INTENTS |= hikari.Intents.GUILD_MEMBERS
+
+
+async def provision_schema() -> None:
+    """Creates missing indexes and checks the plans of hot queries.
+
+    Creates every index declared by the loaded plugins that doesn't exist yet, then
+    explains each declared query. Queries answered by a collection scan are logged,
+    and the bot refuses to start if the config requires every query to be indexed.
+
+    Returns:
+        None.
+    """
+    database = plugin.bot.d.db_conn
+
+    for index_name in await schema.ensure_indexes(database):
+        logger.info("created index %s", index_name)
+
+    scans = await schema.verify_query_plans(database)
+
+    for collection, query in scans:
+        logger.warning("query %s on %s uses a collection scan", query, collection)
+
+    if scans and config.getboolean(
+        "DATABASE", "REQUIRE_INDEXED_QUERIES", fallback=False
+    ):
+        # Exceptions in event listeners are only logged, so exit outright instead
+        raise SystemExit("Refusing to start while hot queries use collection scans.")
+
+
+def get_checkpoint_path() -> str:
+    """Gets the file pending writes of this worker are checkpointed to.
+
+    Returns:
+        The path of the checkpoint file.
+    """
+    return config.get(
+        "LIFECYCLE", "CHECKPOINT_FILE", fallback=lifecycle.DEFAULT_CHECKPOINT_FILE
+    ).format(worker=plugin.bot.d.worker or 0)
+
 
 @plugin.listener(hikari.StartingEvent)
 async def open_database_connection(event: hikari.StartingEvent) -> None:
     """Create a database connection when the bot is starting.
 
+    The client pool and timeouts are configured from the config file. A second
+    handle which prefers secondaries is stored for read only queries. Once connected,
+    the indexes needed by the plugins are provisioned, writes checkpointed by the
+    previous run are replayed, the write-behind queue is started and the job
+    scheduler is configured.
+
     Arguments:
         event: The event that was fired.
 
     Returns:
         None.
     """
-    plugin.bot.d.db_client = AsyncIOMotorClient(config.get("BOT", "DATABASE_URI"))
-    plugin.bot.d.db_conn = plugin.bot.d.db_client["campfire"]
+    plugin.bot.d.db_pool_monitor = PoolMonitor()
+    plugin.bot.d.db_client = create_database_client(
+        config, [plugin.bot.d.db_pool_monitor, metrics.CommandMonitor()]
+    )
+    metrics.registry.register_collector(
+        "campfire_db_pool", plugin.bot.d.db_pool_monitor.snapshot
+    )
+    plugin.bot.d.db_conn = plugin.bot.d.db_client[DATABASE_NAME]
+    plugin.bot.d.db_read_conn = get_read_database(plugin.bot.d.db_client)
+    lifecycle.manager.database = plugin.bot.d.db_conn
+
+    await provision_schema()
+    await lifecycle.manager.replay(get_checkpoint_path())
+
+    queue = writebehind.queue
+    queue.database = plugin.bot.d.db_conn
+    queue.flush_interval = config.getfloat(
+        "WRITE_BEHIND", "FLUSH_INTERVAL", fallback=writebehind.DEFAULT_FLUSH_INTERVAL
+    )
+    queue.batch_size = config.getint(
+        "WRITE_BEHIND", "BATCH_SIZE", fallback=writebehind.DEFAULT_BATCH_SIZE
+    )
+    queue.max_depth = config.getint(
+        "WRITE_BEHIND", "MAX_DEPTH", fallback=writebehind.DEFAULT_MAX_DEPTH
+    )
+    metrics.registry.register_collector("campfire_writebehind", queue.snapshot)
+    queue.start()
+
+    jobs = scheduler.scheduler
+    jobs.database = plugin.bot.d.db_conn
+    jobs.worker = plugin.bot.d.worker or 0
+    jobs.lease_duration = config.getfloat(
+        "SCHEDULER", "LEASE_DURATION", fallback=scheduler.DEFAULT_LEASE_DURATION
+    )
+    jobs.poll_interval = config.getfloat(
+        "SCHEDULER", "POLL_INTERVAL", fallback=scheduler.DEFAULT_POLL_INTERVAL
+    )
+    plugin.bot.d.scheduler = jobs
 
 
 @plugin.listener(hikari.StoppingEvent)
 async def close_database_connection(event: hikari.StoppingEvent) -> None:
     """Close the database connection when the bot stops.
 
+    Outstanding handlers and writes are drained first, within the timeout set in
+    the [LIFECYCLE] section of the config file. Writes which couldn't be made in
+    time are checkpointed to be replayed on the next start.
+
     Arguments:
         event: The event that was fired.
 
     Returns:
         None.
     """
+    await lifecycle.manager.drain(
+        config.getfloat(
+            "LIFECYCLE", "DRAIN_TIMEOUT", fallback=lifecycle.DEFAULT_DRAIN_TIMEOUT
+        ),
+        get_checkpoint_path(),
+    )
     plugin.bot.d.db_client.close()
 
 
+@plugin.listener(hikari.StartedEvent)
+async def run_startup_jobs(event: hikari.StartedEvent) -> None:
+    """Runs the startup jobs of the plugins in the background.
+
+    The jobs start after the delay set in the [STARTUP] section of the config file,
+    so commands are served as soon as the bot connects.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    plugin.bot.d.startup_task = asyncio.create_task(
+        startup.jobs.run(
+            config.getfloat("STARTUP", "DELAY", fallback=startup.DEFAULT_DELAY)
+        ),
+        name="startup jobs",
+    )
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def cancel_startup_jobs(event: hikari.StoppingEvent) -> None:
+    """Cancels the startup jobs if they are still running when the bot stops.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    if plugin.bot.d.startup_task is not None:
+        plugin.bot.d.startup_task.cancel()
+
+
+@plugin.listener(hikari.StartedEvent)
+async def start_scheduler(event: hikari.StartedEvent) -> None:
+    """Starts running scheduled jobs once the bot has connected.
+
+    Jobs still running when the bot stops are awaited while draining.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    scheduler.scheduler.start()
+
+
+@plugin.listener(hikari.StartedEvent)
+async def start_invalidation_bus(event: hikari.StartedEvent) -> None:
+    """Starts delivering cache invalidations between worker processes.
+
+    The transport is chosen by the [INVALIDATION] section of the config file. By
+    default, nothing is started for a single worker, and multiple workers use change
+    streams if the database supports them or local sockets otherwise.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    mode = config.get("INVALIDATION", "TRANSPORT", fallback="auto").lower()
+    workers = plugin.bot.d.workers or 1
+
+    if mode == "none" or (mode == "auto" and workers == 1):
+        return
+
+    transport = invalidation.ChangeStreamTransport(plugin.bot.d.db_conn)
+
+    if mode == "socket" or (mode == "auto" and not await transport.check_supported()):
+        transport = invalidation.SocketTransport(
+            plugin.bot.d.worker or 0,
+            workers,
+            config.getint("INVALIDATION", "PORT", fallback=invalidation.DEFAULT_PORT),
+        )
+
+    await invalidation.bus.start(transport)
+    logger.info("delivering invalidations with %s", type(transport).__name__)
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def stop_invalidation_bus(event: hikari.StoppingEvent) -> None:
+    """Stops delivering cache invalidations when the bot stops.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    await invalidation.bus.stop()
+
+
+@plugin.listener(hikari.StartingEvent)
+async def start_metrics_server(event: hikari.StartingEvent) -> None:
+    """Serves the metrics in the prometheus text format over HTTP.
+
+    The server is only started if a port is set in the [METRICS] section of the
+    config file. It binds to localhost unless another host is configured.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    plugin.bot.d.metrics_runner = None
+    port = config.getint("METRICS", "PORT", fallback=0)
+
+    if not port:
+        return
+
+    async def serve_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            text=metrics.registry.render(),
+            content_type="text/plain",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", serve_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(
+        runner, config.get("METRICS", "HOST", fallback="127.0.0.1"), port
+    ).start()
+
+    plugin.bot.d.metrics_runner = runner
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def stop_metrics_server(event: hikari.StoppingEvent) -> None:
+    """Stops the metrics server when the bot stops.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    if plugin.bot.d.metrics_runner is not None:
+        await plugin.bot.d.metrics_runner.cleanup()
+
+
+@plugin.command
+@lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.command("metrics", "Displays bot performance metrics")
+@lightbulb.implements(lightbulb.SlashCommand, lightbulb.PrefixCommand)
+async def metrics_command(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Displays the slowest handlers and attaches every metric.
+
+    The command can only be used by the owners of the bot.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    summary = metrics.summarize_handlers()[:10]
+    lines = [
+        f"`{plugin_name}/{handler_name}` {count} calls, {average * 1000:.1f} ms avg"
+        for plugin_name, handler_name, count, average in summary
+    ]
+    metrics_embed = create_info_embed(
+        "Metrics",
+        "\n".join(lines) or "No commands or listeners have been invoked yet.",
+        context.app.get_me().avatar_url,
+    )
+    metrics_file = hikari.Bytes(metrics.registry.render(), "metrics.txt")
+
+    await context.respond(embed=metrics_embed, attachment=metrics_file)
+
+
+@plugin.listener(hikari.GuildAvailableEvent)
+async def index_guild_members(event: hikari.GuildAvailableEvent) -> None:
+    """Indexes the members sent with a guild by name.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    for member in event.members.values():
+        members.index.add(member)
+
+
+@plugin.listener(hikari.MemberChunkEvent)
+async def index_member_chunk(event: hikari.MemberChunkEvent) -> None:
+    """Indexes a chunk of requested guild members by name.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    for member in event.members.values():
+        members.index.add(member)
+
+
+async def index_member(
+    event: typing.Union[hikari.MemberCreateEvent, hikari.MemberUpdateEvent]
+) -> None:
+    """Indexes a member which joined or changed by name.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    members.index.add(event.member)
+
+
+async def unindex_member(event: hikari.MemberDeleteEvent) -> None:
+    """Removes a member which left from the name index.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    members.index.remove(event.guild_id, event.user_id)
+
+
+if MEMBER_EVENTS:
+    plugin.listener(hikari.MemberCreateEvent, index_member)
+    plugin.listener(hikari.MemberUpdateEvent, index_member)
+    plugin.listener(hikari.MemberDeleteEvent, unindex_member)
+
+
+@plugin.listener(hikari.GuildLeaveEvent)
+async def unindex_guild(event: hikari.GuildLeaveEvent) -> None:
+    """Removes the members of a guild the bot left from the name index.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    members.index.remove_guild(event.guild_id)
+
+
+def snapshot_cache() -> typing.Dict[str, float]:
+    """Returns the size of each component of the bot's cache.
+
+    Returns:
+        A dictionary of the number of entries and estimated bytes of each component.
+    """
+    snapshot = {}
+
+    for name, count, size in gateway.measure_cache(plugin.bot.cache):
+        snapshot[f"{name}_entries"] = count
+        snapshot[f"{name}_bytes"] = size
+
+    return snapshot
+
+
+@plugin.command
+@lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.command("cache", "Displays the memory used by the bot's cache")
+@lightbulb.implements(lightbulb.SlashCommand, lightbulb.PrefixCommand)
+async def cache_command(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Displays the number of entries and estimated memory of each cache component.
+
+    The command can only be used by the owners of the bot.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    report = gateway.measure_cache(context.app.cache)
+    lines = [
+        f"`{name}` {count} entries, {size / 1024:.1f} KiB"
+        for name, count, size in sorted(report, key=lambda entry: -entry[2])
+    ]
+    total = sum(size for _, _, size in report)
+    lines.append(f"**Total** {total / 1024:.1f} KiB")
+
+    await context.respond(
+        embed=create_info_embed(
+            "Cache", "\n".join(lines), context.app.get_me().avatar_url
+        )
+    )
+
+
 @plugin.listener(lightbulb.CommandErrorEvent)
 async def on_command_error(event: lightbulb.CommandErrorEvent) -> typing.Optional[bool]:
     """Handles bot command errors if they aren't handled by plugin/command handlers.
@@ -57,9 +479,34 @@ async def on_command_error(event: lightbulb.CommandErrorEvent) -> typing.Optiona
         await error_response(event.context, "You cannot use this command in DMs.")
         return True
 
+    elif evaluate_exception(exception, lightbulb.NotOwner):
+        await error_response(event.context, "You cannot use this command.")
+        return True
+
+    elif evaluate_exception(exception, lifecycle.ShuttingDown):
+        await error_response(
+            event.context, "The bot is restarting. Try again in a moment."
+        )
+        return True
+
     raise exception
 
 
+def accepting_commands(context: lightbulb.Context) -> bool:
+    """Refuses commands once the bot has started shutting down.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        True if the bot is accepting commands.
+    """
+    if not lifecycle.manager.accepting:
+        raise lifecycle.ShuttingDown("The bot is shutting down.")
+
+    return True
+
+
 def load(bot: lightbulb.BotApp) -> None:
     """Loads the 'Admin' plugin. Called when extension is loaded.
 
@@ -69,4 +516,27 @@ def load(bot: lightbulb.BotApp) -> None:
     Returns:
         None.
     """
+    tracing.configure(
+        config.getfloat("TRACING", "SAMPLE_RATE", fallback=tracing.DEFAULT_SAMPLE_RATE),
+        config.getfloat(
+            "TRACING", "SLOW_THRESHOLD", fallback=tracing.DEFAULT_SLOW_THRESHOLD
+        ),
+    )
+    metrics.install_rest_hooks()
+    rest.lookups.app = bot
+    rest.lookups.negative_ttl = config.getfloat(
+        "REST", "NEGATIVE_TTL", fallback=rest.DEFAULT_NEGATIVE_TTL
+    )
+    rest.lanes.background_reserve = config.getint(
+        "REST", "BACKGROUND_RESERVE", fallback=rest.DEFAULT_BACKGROUND_RESERVE
+    )
+    rest.lanes.background_max_delay = config.getfloat(
+        "REST", "BACKGROUND_MAX_DELAY", fallback=rest.DEFAULT_BACKGROUND_MAX_DELAY
+    )
+    rest.install_lanes()
+    members.install_member_converter()
+    metrics.registry.register_collector("campfire_rest_lanes", rest.lanes.snapshot)
+    metrics.registry.register_collector("campfire_cache", snapshot_cache)
+    metrics.instrument_plugin(plugin)
+    bot.check(accepting_commands)
     bot.add_plugin(plugin)
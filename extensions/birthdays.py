@@ -0,0 +1,541 @@
+import asyncio
+import calendar
+import hikari
+import lightbulb
+import logging
+import math
+import time
+import typing
+
+from bot import config
+from datetime import datetime, timedelta, timezone
+from utils import lifecycle, schema, startup
+from utils.cache import DEFAULT_TTL, GuildCache
+from utils.exceptions import evaluate_exception
+from utils.invalidation import bus, marker
+from utils.metrics import instrument_plugin
+from utils.responses import create_info_embed, info_response, error_response
+from utils.rest import lookups
+from utils.sharding import owns_guild
+from utils.timers import TimerHeap
+
+
+plugin = lightbulb.Plugin("Birthdays")
+logger = logging.getLogger(__name__)
+
+CACHE_COMPONENTS = hikari.api.CacheComponents.MEMBERS
+
+schema.register_index("birthdays", ["guild_id", "member_id"], unique=True)
+schema.register_index("birthdays", ["month", "day"])
+schema.register_index("birthday_settings", ["guild_id"], unique=True)
+schema.register_query("birthdays", {"month": 0, "day": 0})
+schema.register_query("birthdays", {"guild_id": 0, "member_id": 0})
+schema.register_query("birthday_settings", {"guild_id": 0})
+
+# Birthdays due within this many seconds are kept in memory
+LOOKAHEAD = 86400.0
+REFILL_INTERVAL = 3600.0
+RETRY_DELAY = 60.0
+
+# Local midnight falls between these many seconds before and after UTC midnight
+MAX_OFFSET_BEHIND = 12 * 3600
+MAX_OFFSET_AHEAD = 14 * 3600
+
+# Announcement channels of the guilds served by this process
+settings = GuildCache(
+    config.getfloat("CACHE", "TTL", fallback=DEFAULT_TTL),
+    lambda guild_id: owns_guild(plugin.bot, guild_id),
+)
+bus.subscribe("birthday_settings", settings.apply_invalidation)
+
+# Announcements due before the end of the loaded window, keyed by guild and member
+timers = TimerHeap()
+
+
+def get_candidate_dates(
+    start: float, end: float
+) -> typing.Dict[typing.Tuple[int, int], typing.List[float]]:
+    """Gets the dates whose local midnight falls within a window in some time zone.
+
+    Birthdays on the 29th of February are announced on the 28th outside of leap
+    years.
+
+    Arguments:
+        start: The UNIX time the window starts at.
+        end: The UNIX time the window ends at.
+
+    Returns:
+        The UTC midnight of each date, by month and day.
+    """
+    date = datetime.fromtimestamp(start - MAX_OFFSET_BEHIND, timezone.utc).date()
+    last = datetime.fromtimestamp(end + MAX_OFFSET_AHEAD, timezone.utc).date()
+    dates = {}
+
+    while date <= last:
+        midnight = calendar.timegm(date.timetuple())
+        dates.setdefault((date.month, date.day), []).append(midnight)
+
+        if (date.month, date.day) == (2, 28) and not calendar.isleap(date.year):
+            dates.setdefault((2, 29), []).append(midnight)
+
+        date += timedelta(days=1)
+
+    return dates
+
+
+def schedule_birthday(
+    document: dict,
+    dates: typing.Dict[typing.Tuple[int, int], typing.List[float]],
+    start: float,
+    end: float,
+) -> None:
+    """Schedules the announcement of a birthday if it is due within a window.
+
+    Arguments:
+        document: The birthday document.
+        dates: The UTC midnight of each date which may fall in the window.
+        start: The UNIX time the window starts at.
+        end: The UNIX time the window ends at.
+
+    Returns:
+        None.
+    """
+    offset = document.get("utc_offset", 0) * 60
+
+    for midnight in dates.get((document["month"], document["day"]), []):
+        when = midnight - offset
+
+        if start <= when < end:
+            timers.schedule(when, (document["guild_id"], document["member_id"]), None)
+
+
+async def load_birthdays(start: float, end: float) -> None:
+    """Schedules the announcements of every birthday due within a window.
+
+    Only the dates which can fall in the window in some time zone are read, using
+    the month and day index.
+
+    Arguments:
+        start: The UNIX time the window starts at.
+        end: The UNIX time the window ends at.
+
+    Returns:
+        None.
+    """
+    dates = get_candidate_dates(start, end)
+    query = {"$or": [{"month": month, "day": day} for month, day in dates]}
+
+    async for document in plugin.bot.d.db_conn.birthdays.find(query):
+        if owns_guild(plugin.bot, document["guild_id"]):
+            schedule_birthday(document, dates, start, end)
+
+
+async def get_birthday_channel(
+    guild_id: hikari.Snowflake,
+) -> typing.Optional[hikari.Snowflake]:
+    """Gets the channel birthdays are announced in.
+
+    Arguments:
+        guild_id: The ID of the guild.
+
+    Returns:
+        The ID of the channel, or None if birthdays aren't announced in the guild.
+    """
+    channel_id = settings.get(guild_id, "channel_id", None)
+
+    if channel_id is None:
+        document = await plugin.bot.d.db_conn.birthday_settings.find_one(
+            {"guild_id": guild_id}
+        )
+        channel_id = document.get("channel_id", 0) if document else 0
+        settings.set(guild_id, "channel_id", channel_id)
+
+    return channel_id or None
+
+
+async def announce_birthday(
+    guild_id: hikari.Snowflake, member_id: hikari.Snowflake
+) -> None:
+    """Announces the birthday of a member in the birthday channel of the guild.
+
+    Arguments:
+        guild_id: The ID of the guild.
+        member_id: The ID of the member.
+
+    Returns:
+        None.
+    """
+    channel_id = await get_birthday_channel(guild_id)
+
+    if channel_id is None or plugin.bot.cache.get_member(guild_id, member_id) is None:
+        return
+
+    birthday_embed = create_info_embed(
+        "Happy birthday!",
+        f"Today is <@{member_id}>'s birthday. Wish them a happy birthday!",
+        plugin.bot.get_me().avatar_url,
+    )
+
+    await plugin.bot.rest.create_message(channel_id, embed=birthday_embed)
+
+
+def wake_announcer() -> None:
+    """Wakes the announcer so it sees newly scheduled birthdays.
+
+    Returns:
+        None.
+    """
+    if plugin.bot.d.birthdays_wakeup is not None:
+        plugin.bot.d.birthdays_wakeup.set()
+
+
+async def run_announcer() -> None:
+    """Announces birthdays as they come due and keeps the loaded window full.
+
+    The window is extended by the time that has passed every hour, so only the
+    birthdays that newly fall in it are read.
+
+    Returns:
+        None.
+    """
+    wakeup = plugin.bot.d.birthdays_wakeup
+    refill_at = 0.0
+
+    while True:
+        now = time.time()
+
+        if now >= refill_at:
+            end = now + LOOKAHEAD
+
+            try:
+                await load_birthdays(plugin.bot.d.birthdays_loaded_until, end)
+                plugin.bot.d.birthdays_loaded_until = end
+                refill_at = now + REFILL_INTERVAL
+            except Exception:
+                logger.exception("failed to load birthdays")
+                refill_at = now + RETRY_DELAY
+
+        for (guild_id, member_id), _ in timers.pop_due(now):
+            lifecycle.manager.spawn(
+                announce_birthday(guild_id, member_id), name="announce birthday"
+            )
+
+        due = timers.next_due()
+        wait = min(refill_at, math.inf if due is None else due) - time.time()
+
+        wakeup.clear()
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), max(wait, 0))
+        except asyncio.TimeoutError:
+            pass
+
+
+@plugin.listener(hikari.StartedEvent)
+async def start_announcer(event: hikari.StartedEvent) -> None:
+    """Starts announcing birthdays.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    plugin.bot.d.birthdays_loaded_until = time.time()
+    plugin.bot.d.birthdays_wakeup = asyncio.Event()
+    plugin.bot.d.birthdays_task = asyncio.create_task(
+        run_announcer(), name="announce birthdays"
+    )
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def stop_announcer(event: hikari.StoppingEvent) -> None:
+    """Stops announcing birthdays when the bot stops.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    if plugin.bot.d.birthdays_task is not None:
+        plugin.bot.d.birthdays_task.cancel()
+
+
+async def set_birthday(
+    guild_id: hikari.Snowflake,
+    member_id: hikari.Snowflake,
+    month: int,
+    day: int,
+    utc_offset: int,
+) -> None:
+    """Stores the birthday of a member and schedules it if it is due soon.
+
+    Arguments:
+        guild_id: The ID of the guild.
+        member_id: The ID of the member.
+        month: The month of the birthday.
+        day: The day of the birthday.
+        utc_offset: The UTC offset of the member in minutes.
+
+    Returns:
+        None.
+    """
+    document = {
+        "guild_id": guild_id,
+        "member_id": member_id,
+        "month": month,
+        "day": day,
+        "utc_offset": utc_offset,
+    }
+
+    await plugin.bot.d.db_conn.birthdays.replace_one(
+        {"guild_id": guild_id, "member_id": member_id}, document, upsert=True
+    )
+
+    timers.cancel((guild_id, member_id))
+
+    if plugin.bot.d.birthdays_loaded_until is not None:
+        now = time.time()
+        end = plugin.bot.d.birthdays_loaded_until
+        schedule_birthday(document, get_candidate_dates(now, end), now, end)
+        wake_announcer()
+
+
+async def remove_birthday(
+    guild_id: hikari.Snowflake, member_id: hikari.Snowflake
+) -> bool:
+    """Removes the birthday of a member.
+
+    Arguments:
+        guild_id: The ID of the guild.
+        member_id: The ID of the member.
+
+    Returns:
+        True if the member had a birthday set, false if not.
+    """
+    result = await plugin.bot.d.db_conn.birthdays.delete_one(
+        {"guild_id": guild_id, "member_id": member_id}
+    )
+    timers.cancel((guild_id, member_id))
+
+    return result.deleted_count > 0
+
+
+@startup.jobs.register("Birthdays", startup.LOW)
+async def purge_guild_documents() -> None:
+    """Removes birthdays of any guild the bot is no longer a part of.
+
+    Only guilds served by this process are checked.
+
+    Returns:
+        None.
+    """
+    database = plugin.bot.d.db_conn
+
+    async for document in database.birthday_settings.find({}, {"guild_id": 1}):
+        guild_id = document["guild_id"]
+
+        if not owns_guild(plugin.bot, guild_id):
+            continue
+
+        try:
+            await lookups.fetch_guild(guild_id, "birthdays.purge_guild_documents")
+        except hikari.NotFoundError:
+            await database.birthday_settings.delete_one({"guild_id": guild_id})
+            await database.birthdays.delete_many({"guild_id": guild_id})
+            bus.publish("birthday_settings", guild_id)
+
+
+@plugin.listener(hikari.GuildLeaveEvent)
+async def delete_guild_documents(event: hikari.GuildLeaveEvent) -> None:
+    """Deletes the birthdays of a guild when the bot leaves it.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    db_filter = {"guild_id": event.guild_id}
+
+    await plugin.bot.d.db_conn.birthday_settings.delete_one(db_filter)
+    await plugin.bot.d.db_conn.birthdays.delete_many(db_filter)
+    bus.publish("birthday_settings", event.guild_id)
+
+
+@plugin.command
+@lightbulb.add_checks(lightbulb.guild_only)
+@lightbulb.command("birthday", "Base of birthday command group")
+@lightbulb.implements(lightbulb.SlashCommandGroup, lightbulb.PrefixCommandGroup)
+async def birthday(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Base of the birthday command group.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    pass
+
+
+@birthday.child
+@lightbulb.option(
+    "utc_offset",
+    "Your time zone as hours from UTC",
+    type=float,
+    required=False,
+    default=0,
+    min_value=-12,
+    max_value=14,
+)
+@lightbulb.option(
+    "day", "The day of your birthday", type=int, min_value=1, max_value=31
+)
+@lightbulb.option(
+    "month", "The month of your birthday", type=int, min_value=1, max_value=12
+)
+@lightbulb.command("set", "Sets your birthday", inherit_checks=True)
+@lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+async def set(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Sets the birthday of the author in the guild.
+
+    Called when a user uses /birthday set <month> <day> [utc_offset]
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    month = context.options.month
+    day = context.options.day
+    utc_offset = context.options.utc_offset
+
+    # Check if the date exists in a leap year
+    try:
+        birthday_date = datetime(2000, month, day)
+    except ValueError:
+        await error_response(context, "That date doesn't exist.")
+        return
+
+    if not -12 <= utc_offset <= 14:
+        await error_response(context, "The UTC offset must be between -12 and 14.")
+        return
+
+    await set_birthday(
+        context.guild_id, context.author.id, month, day, round(utc_offset * 60)
+    )
+    await info_response(
+        context,
+        "Birthday set",
+        f"Your birthday has been set to {birthday_date.strftime('%B')} {day}.",
+    )
+
+
+@birthday.child
+@lightbulb.command("remove", "Removes your birthday", inherit_checks=True)
+@lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+async def remove(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Removes the birthday of the author in the guild.
+
+    Called when a user uses /birthday remove
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    if not await remove_birthday(context.guild_id, context.author.id):
+        await error_response(context, "You haven't set your birthday.")
+        return
+
+    await info_response(context, "Birthday removed", "Your birthday has been removed.")
+
+
+@birthday.child
+@lightbulb.add_checks(
+    lightbulb.has_guild_permissions(hikari.Permissions.MANAGE_GUILD),
+    lightbulb.guild_only,
+)
+@lightbulb.option(
+    "channel",
+    "The channel to announce birthdays in",
+    type=hikari.TextableGuildChannel,
+)
+@lightbulb.command("channel", "Sets the channel birthdays are announced in")
+@lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+async def channel(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Sets the channel birthdays are announced in.
+
+    The command can only be used by guild members with the manage server permission.
+
+    Called when a user uses /birthday channel <channel>
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    announcement_channel = context.options.channel
+
+    await plugin.bot.d.db_conn.birthday_settings.update_one(
+        {"guild_id": context.guild_id},
+        {"$set": {"channel_id": announcement_channel.id, **marker()}},
+        upsert=True,
+    )
+    bus.publish("birthday_settings", context.guild_id)
+
+    await info_response(
+        context,
+        "Channel set",
+        f"Birthdays will be announced in <#{announcement_channel.id}>.",
+    )
+
+
+@birthday.set_error_handler()
+async def birthday_errors(event: lightbulb.CommandErrorEvent) -> bool:
+    """Handles errors for the birthday command and its various subcommands.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        True if the exception can be handled, false if not.
+    """
+    exception = event.exception
+
+    if evaluate_exception(exception, lightbulb.OnlyInGuild):
+        return False
+
+    elif evaluate_exception(exception, lightbulb.MissingRequiredPermission):
+        await error_response(
+            event.context, "You don't have permission to use that command."
+        )
+        return True
+
+    return False
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    """Loads the 'Birthdays' plugin. Called when extension is loaded.
+
+    Arguments:
+        bot: The bot application to add the plugin to.
+
+    Returns:
+        None.
+    """
+    instrument_plugin(plugin)
+    bot.add_plugin(plugin)
@@ -1,15 +1,78 @@
 import hikari
 import lightbulb
+import math
+import time
 import typing
 
+from bot import config
+from utils import lifecycle, schema, startup, writebehind
+from utils.cache import DEFAULT_TTL, GuildCache
 from utils.channels import clone_channel
 from utils.exceptions import evaluate_exception
-from utils.responses import info_response, error_response
+from utils.invalidation import bus, marker
+from utils.metrics import instrument_plugin
+from utils.responses import create_info_embed, info_response, error_response
+from utils.rest import lookups
+from utils.sessions import SessionTracker, get_duration_string
+from utils.sharding import owns_guild
 
-CHOICES = ["rename", "lock", "unlock", "kick", "ban", "unban"]
+CHOICES = ["rename", "lock", "unlock", "kick", "ban", "unban", "transfer"]
+
+USAGE_REPORT_SIZE = 5
+
+DEFAULT_NAME_PATTERN = "{owner}'s Lobby"
+OVERWRITE_PRESETS = ["template", "open", "locked"]
+
+# The highest voice channel bitrate in kbps of each server boost level
+MAX_BITRATES = {
+    hikari.GuildPremiumTier.NONE: 96,
+    hikari.GuildPremiumTier.TIER_1: 128,
+    hikari.GuildPremiumTier.TIER_2: 256,
+    hikari.GuildPremiumTier.TIER_3: 384,
+}
 
 plugin = lightbulb.Plugin("Lobbies")
 
+INTENTS = hikari.Intents.GUILD_VOICE_STATES
+CACHE_COMPONENTS = (
+    hikari.api.CacheComponents.VOICE_STATES | hikari.api.CacheComponents.MEMBERS
+)
+
+schema.register_index("lobby_channels", ["guild_id"])
+schema.register_index("lobby_channels", ["templates"])
+schema.register_index("lobby_channels", ["clones.clone_id"])
+schema.register_index("lobby_disabled_commands", ["guild_id"])
+schema.register_query("lobby_channels", {"guild_id": 0})
+schema.register_query("lobby_channels", {"templates": 0})
+schema.register_query("lobby_channels", {"clones.clone_id": 0})
+schema.register_query("lobby_disabled_commands", {"guild_id": 0})
+schema.register_index("lobby_member_time", ["guild_id", "member_id"], unique=True)
+schema.register_index("lobby_member_time", ["guild_id", ("seconds", -1)])
+schema.register_index("lobby_template_time", ["guild_id", "template_id"], unique=True)
+schema.register_query("lobby_member_time", {"guild_id": 0, "member_id": 0})
+schema.register_query("lobby_template_time", {"guild_id": 0})
+
+# Lobby channel documents and disabled commands of the guilds served by this process
+registry = GuildCache(
+    config.getfloat("CACHE", "TTL", fallback=DEFAULT_TTL),
+    lambda guild_id: owns_guild(plugin.bot, guild_id),
+)
+settings = GuildCache(
+    config.getfloat("CACHE", "TTL", fallback=DEFAULT_TTL),
+    lambda guild_id: owns_guild(plugin.bot, guild_id),
+)
+bus.subscribe("lobby_channels", registry.apply_invalidation)
+bus.subscribe("lobby_disabled_commands", settings.apply_invalidation)
+
+# Members in a clone channel of the guilds served by this process, keyed by guild and
+# member, along with the template of the clone they are in
+lobby_sessions = SessionTracker()
+session_templates: typing.Dict[typing.Tuple[int, int], int] = {}
+
+# Members in each clone channel of the guilds served by this process, by clone ID,
+# along with the monotonic time they joined, to pick the next owner from
+lobby_members: typing.Dict[int, typing.Dict[int, float]] = {}
+
 
 async def create_template(
     channel_name: str, channel_guild: hikari.GatewayGuild
@@ -31,9 +94,10 @@ async def create_template(
 
     await plugin.bot.d.db_conn.lobby_channels.update_one(
         {"guild_id": channel_guild.id},
-        {"$push": {"templates": template_channel.id}},
+        {"$push": {"templates": template_channel.id}, "$set": marker()},
         upsert=True,
     )
+    bus.publish("lobby_channels", channel_guild.id)
 
     return template_channel
 
@@ -45,7 +109,9 @@ async def create_clone(
 
     Clones a template voice channel and pushes its channel ID into the guild document
     clones list if it exists. Otherwise, create a new guild document with the clones
-    list containing a document containing info about the clone channel.
+    list containing a document containing info about the clone channel. The write is
+    queued so the member can be moved without waiting for it. The settings of the
+    template are read from the cached lobby channels document.
 
     Arguments:
         template_channel: The template channel to clone.
@@ -54,95 +120,390 @@ async def create_clone(
     Returns:
         The created clone channel.
     """
+    document = await get_lobby_document(template_channel.guild_id)
+    template_config = get_template_config(document, template_channel.id)
     channel_clone = await clone_channel(
-        template_channel, name=f"{owner.username}'s Lobby"
+        template_channel,
+        **resolve_clone_settings(template_channel, template_config, owner),
     )
 
-    await plugin.bot.d.db_conn.lobby_channels.update_one(
-        {"guild_id": channel_clone.guild_id},
+    await writebehind.queue.submit(
+        "lobby_channels",
         {
-            "$push": {
-                "clones": {
-                    "clone_id": channel_clone.id,
-                    "template_id": template_channel.id,
-                    "owner_id": owner.id,
-                }
+            "update_one": {
+                "filter": {"guild_id": channel_clone.guild_id},
+                "update": {
+                    "$push": {
+                        "clones": {
+                            "clone_id": channel_clone.id,
+                            "template_id": template_channel.id,
+                            "owner_id": owner.id,
+                        }
+                    },
+                    "$set": marker(),
+                },
+                "upsert": True,
             }
         },
-        upsert=True,
     )
+    bus.publish("lobby_channels", channel_clone.guild_id)
 
     return channel_clone
 
 
+def get_template_config(document: dict, template_id: hikari.Snowflake) -> dict:
+    """Gets the settings of a template from the lobby channels document of its guild.
+
+    Arguments:
+        document: The lobby channels document of the guild.
+        template_id: The ID of the template channel.
+
+    Returns:
+        The settings of the template, or an empty dictionary if it has none.
+    """
+    return document.get("template_configs", {}).get(str(template_id), {})
+
+
+def resolve_clone_settings(
+    template_channel: hikari.GuildVoiceChannel,
+    template_config: dict,
+    owner: hikari.Member,
+) -> dict:
+    """Resolves the settings a clone of a template is created with.
+
+    Settings which aren't configured for the template are copied from the template
+    channel when it is cloned.
+
+    Arguments:
+        template_channel: The template channel.
+        template_config: The settings of the template.
+        owner: The owner of the clone.
+
+    Returns:
+        The keyword arguments to clone the template channel with.
+    """
+    pattern = template_config.get("name", DEFAULT_NAME_PATTERN)
+    clone_settings = {"name": pattern.replace("{owner}", owner.username)[:100]}
+
+    if "user_limit" in template_config:
+        clone_settings["user_limit"] = template_config["user_limit"]
+
+    if "bitrate" in template_config:
+        clone_settings["bitrate"] = template_config["bitrate"] * 1000
+
+    if "category" in template_config:
+        clone_settings["category"] = template_config["category"]
+
+    preset = template_config.get("overwrites", "template")
+
+    if preset == "open":
+        clone_settings["permission_overwrites"] = []
+    elif preset == "locked":
+        everyone_id = template_channel.guild_id
+        overwrites = template_channel.permission_overwrites
+        everyone = overwrites.get(everyone_id)
+        allow = everyone.allow if everyone else hikari.Permissions.NONE
+        deny = everyone.deny if everyone else hikari.Permissions.NONE
+
+        # Only the owner can join until the lobby is unlocked
+        clone_settings["permission_overwrites"] = [
+            *(
+                overwrite
+                for overwrite in overwrites.values()
+                if overwrite.id not in (everyone_id, owner.id)
+            ),
+            hikari.PermissionOverwrite(
+                id=everyone_id,
+                type=hikari.PermissionOverwriteType.ROLE,
+                allow=allow & ~hikari.Permissions.CONNECT,
+                deny=deny | hikari.Permissions.CONNECT,
+            ),
+            hikari.PermissionOverwrite(
+                id=owner.id,
+                type=hikari.PermissionOverwriteType.MEMBER,
+                allow=hikari.Permissions.CONNECT,
+            ),
+        ]
+
+    return clone_settings
+
+
+async def configure_template(
+    guild_id: hikari.Snowflake, template_id: hikari.Snowflake, changes: dict
+) -> None:
+    """Changes settings of a template.
+
+    The settings are stored in the lobby channels document of the guild, so they are
+    cached with it and creating a clone needs no extra reads.
+
+    Arguments:
+        guild_id: The ID of the guild the template is in.
+        template_id: The ID of the template channel.
+        changes: The settings to change, by name.
+
+    Returns:
+        None.
+    """
+    fields = {
+        f"template_configs.{template_id}.{name}": value
+        for name, value in changes.items()
+    }
+
+    await plugin.bot.d.db_conn.lobby_channels.update_one(
+        {"guild_id": guild_id}, {"$set": {**fields, **marker()}}
+    )
+    bus.publish("lobby_channels", guild_id)
+
+
+async def reset_template(
+    guild_id: hikari.Snowflake, template_id: hikari.Snowflake
+) -> None:
+    """Removes every setting of a template, so clones copy the template channel.
+
+    Arguments:
+        guild_id: The ID of the guild the template is in.
+        template_id: The ID of the template channel.
+
+    Returns:
+        None.
+    """
+    await plugin.bot.d.db_conn.lobby_channels.update_one(
+        {"guild_id": guild_id},
+        {"$unset": {f"template_configs.{template_id}": ""}, "$set": marker()},
+    )
+    bus.publish("lobby_channels", guild_id)
+
+
+async def get_lobby_document(guild_id: hikari.Snowflake) -> dict:
+    """Gets the lobby channels document of a guild.
+
+    Returns the cached document if there is one. Otherwise, flush any queued writes
+    to the lobby channels, then query the database for the document and cache it.
+
+    Arguments:
+        guild_id: The ID of the guild.
+
+    Returns:
+        The document of the guild, or an empty document if it has no lobbies.
+    """
+    document = registry.get(guild_id, "document", None)
+
+    if document is None:
+        if writebehind.queue.has_pending("lobby_channels"):
+            await writebehind.queue.flush("lobby_channels")
+
+        document = await plugin.bot.d.db_conn.lobby_channels.find_one(
+            {"guild_id": guild_id}
+        )
+        document = document or {}
+        registry.set(guild_id, "document", document)
+
+    return document
+
+
 async def get_clone_document(
-    channel_id: hikari.Snowflake,
+    channel_id: hikari.Snowflake, guild_id: hikari.Snowflake
 ) -> typing.Optional[dict]:
     """Gets the clone channel document from the database.
 
-    Uses an aggregate to find documents containing the channel id (should be a single
-    document), unwinding clones and then matching to the unwound document with the
-    channel id (should also be a single document). Limits the result to a single
-    document just incase.
+    Finds the clone with the channel id in the lobby channels document of the guild
+    and returns the guild document with the clones field replaced by that clone.
 
     Arguments:
         channel_id: The ID of the channel to get.
+        guild_id: The ID of the guild the channel is in.
 
     Returns:
         The document of the channel if it exists otherwise None.
     """
-    cursor = plugin.bot.d.db_conn.lobby_channels.aggregate(
-        [
-            {"$match": {"clones.clone_id": channel_id}},
-            {"$unwind": "$clones"},
-            {"$match": {"clones.clone_id": channel_id}},
-            {"$limit": 1},
-        ]
-    )
-    documents = await cursor.to_list(length=1)
+    document = await get_lobby_document(guild_id)
 
-    if documents != []:
-        return documents[0]
+    for clone in document.get("clones", []):
+        if clone["clone_id"] == channel_id:
+            return {**document, "clones": clone}
 
     return None
 
 
-async def valid_template(channel_id: hikari.Snowflake) -> bool:
+async def valid_template(
+    channel_id: hikari.Snowflake, guild_id: hikari.Snowflake
+) -> bool:
     """Determines if the channel is a valid template channel.
 
-    Checks if there is a document that contains the channel id in its array of
-    templates.
+    Checks if the lobby channels document of the guild contains the channel id in
+    its array of templates.
 
     Arguments:
-        channel: The ID of the channel to check.
+        channel_id: The ID of the channel to check.
+        guild_id: The ID of the guild the channel is in.
 
     Returns:
         True if the channel is a template, false if not.
     """
-    document = await plugin.bot.d.db_conn.lobby_channels.find_one(
-        {"templates": channel_id}
-    )
+    document = await get_lobby_document(guild_id)
 
-    return document is not None
+    return channel_id in document.get("templates", [])
 
 
-async def valid_clone(channel_id: hikari.Snowflake) -> bool:
+async def valid_clone(channel_id: hikari.Snowflake, guild_id: hikari.Snowflake) -> bool:
     """Determines if the channel is a valid clone channel.
 
-    Checks if there is a document that contains the channel id in its array of clone
-    documents.
+    Checks if the lobby channels document of the guild contains the channel id in
+    its array of clone documents.
 
     Arguments:
-        channel: The clone channel.
+        channel_id: The ID of the channel to check.
+        guild_id: The ID of the guild the channel is in.
 
     Returns:
         True if the channel is a clone, false if not.
     """
-    document = await plugin.bot.d.db_conn.lobby_channels.find_one(
-        {"clones.clone_id": channel_id}
+    return await get_clone_document(channel_id, guild_id) is not None
+
+
+async def move_owner_overwrite(
+    clone_id: hikari.Snowflake,
+    previous_owner_id: hikari.Snowflake,
+    owner_id: hikari.Snowflake,
+) -> None:
+    """Moves the permission to join a clone channel from its old owner to the new one.
+
+    Clones made from templates with the locked preset let only their owner join.
+    The overwrite is only moved if the old owner has one allowing them to join.
+
+    Arguments:
+        clone_id: The ID of the clone channel.
+        previous_owner_id: The ID of the old owner.
+        owner_id: The ID of the new owner.
+
+    Returns:
+        None.
+    """
+    clone = await lookups.fetch_channel(clone_id, "lobbies.move_owner_overwrite")
+    overwrites = dict(clone.permission_overwrites)
+    previous = overwrites.pop(previous_owner_id, None)
+
+    if previous is None or hikari.Permissions.CONNECT not in previous.allow:
+        return
+
+    current = overwrites.get(owner_id)
+    allow = current.allow if current else hikari.Permissions.NONE
+    deny = current.deny if current else hikari.Permissions.NONE
+
+    overwrites[owner_id] = hikari.PermissionOverwrite(
+        id=owner_id,
+        type=hikari.PermissionOverwriteType.MEMBER,
+        allow=allow | hikari.Permissions.CONNECT,
+        deny=deny & ~hikari.Permissions.CONNECT,
     )
 
-    return document is not None
+    # Keep any other permissions the old owner was given
+    previous_allow = previous.allow & ~hikari.Permissions.CONNECT
+
+    if previous_allow or previous.deny:
+        overwrites[previous_owner_id] = hikari.PermissionOverwrite(
+            id=previous_owner_id,
+            type=hikari.PermissionOverwriteType.MEMBER,
+            allow=previous_allow,
+            deny=previous.deny,
+        )
+
+    await clone.edit(permission_overwrites=list(overwrites.values()))
+
+
+async def transfer_ownership(
+    guild_id: hikari.Snowflake,
+    clone_id: hikari.Snowflake,
+    previous_owner_id: hikari.Snowflake,
+    owner_id: hikari.Snowflake,
+) -> None:
+    """Makes a member the owner of a clone channel.
+
+    Only the owner of the clone is changed, with a positional update of the clone in
+    the lobby channels document. The write is queued like the write creating the
+    clone, and reads of the document flush it first. The old owner's permission to
+    join the clone is moved to the new owner.
+
+    Arguments:
+        guild_id: The ID of the guild the clone is in.
+        clone_id: The ID of the clone channel.
+        previous_owner_id: The ID of the old owner.
+        owner_id: The ID of the new owner.
+
+    Returns:
+        None.
+    """
+    await writebehind.queue.submit(
+        "lobby_channels",
+        {
+            "update_one": {
+                "filter": {"guild_id": guild_id, "clones.clone_id": clone_id},
+                "update": {"$set": {"clones.$.owner_id": owner_id, **marker()}},
+            }
+        },
+    )
+    bus.publish("lobby_channels", guild_id)
+    await move_owner_overwrite(clone_id, previous_owner_id, owner_id)
+
+
+def get_successor(
+    clone_id: hikari.Snowflake, voice_states: typing.Mapping[int, hikari.VoiceState]
+) -> typing.Optional[int]:
+    """Picks the member who has been in a clone channel the longest.
+
+    Arguments:
+        clone_id: The ID of the clone channel.
+        voice_states: The voice states of the members in the clone, by member ID.
+
+    Returns:
+        The ID of the member, or None if there are no members other than bots.
+    """
+    joined = lobby_members.get(clone_id, {})
+
+    return min(
+        (
+            member_id
+            for member_id, voice_state in voice_states.items()
+            if not voice_state.member.is_bot
+        ),
+        key=lambda member_id: joined.get(member_id, math.inf),
+        default=None,
+    )
+
+
+async def hand_off_ownership(
+    guild_id: hikari.Snowflake, clone_id: hikari.Snowflake
+) -> None:
+    """Passes ownership of a clone channel on if its owner isn't in it.
+
+    The member who has been in the clone the longest becomes the owner, so the lobby
+    stays usable instead of being left without an owner until it empties.
+
+    Arguments:
+        guild_id: The ID of the guild the clone is in.
+        clone_id: The ID of the clone channel.
+
+    Returns:
+        None.
+    """
+    document = await get_clone_document(clone_id, guild_id)
+
+    if document is None:
+        return
+
+    voice_states = plugin.bot.cache.get_voice_states_view_for_channel(
+        guild_id, clone_id
+    )
+
+    if document["clones"]["owner_id"] in voice_states:
+        return
+
+    successor = get_successor(clone_id, voice_states)
+
+    if successor is not None:
+        await transfer_ownership(
+            guild_id, clone_id, document["clones"]["owner_id"], successor
+        )
 
 
 async def enable_command(command_name: str, guild: hikari.GatewayGuild) -> None:
@@ -159,8 +520,10 @@ async def enable_command(command_name: str, guild: hikari.GatewayGuild) -> None:
         None.
     """
     await plugin.bot.d.db_conn.lobby_disabled_commands.update_one(
-        {"guild_id": guild.id}, {"$pull": {"disabled_commands": command_name}}
+        {"guild_id": guild.id},
+        {"$pull": {"disabled_commands": command_name}, "$set": marker()},
     )
+    bus.publish("lobby_disabled_commands", guild.id)
 
 
 async def disable_command(command_name: str, guild: hikari.GatewayGuild) -> None:
@@ -177,16 +540,17 @@ async def disable_command(command_name: str, guild: hikari.GatewayGuild) -> None
     """
     await plugin.bot.d.db_conn.lobby_disabled_commands.update_one(
         {"guild_id": guild.id},
-        {"$push": {"disabled_commands": command_name}},
+        {"$push": {"disabled_commands": command_name}, "$set": marker()},
         upsert=True,
     )
+    bus.publish("lobby_disabled_commands", guild.id)
 
 
 async def command_is_disabled(command_name: str, guild: hikari.GatewayGuild) -> bool:
     """Checks if a command is disabled in a guild.
 
     Checks if a command is disabled in a guild by checking if it is in the guilds list
-    of disabled commands.
+    of disabled commands. The list is cached after it is first read.
 
     Arguments:
         command_name: The name of the command.
@@ -195,11 +559,18 @@ async def command_is_disabled(command_name: str, guild: hikari.GatewayGuild) ->
     Returns:
         True if the command is disabled otherwise false.
     """
-    document = await plugin.bot.d.db_conn.lobby_disabled_commands.find_one(
-        {"guild_id": guild.id, "disabled_commands": command_name}
-    )
+    disabled_commands = settings.get(guild.id, "disabled_commands", None)
+
+    if disabled_commands is None:
+        document = await plugin.bot.d.db_conn.lobby_disabled_commands.find_one(
+            {"guild_id": guild.id}
+        )
+        disabled_commands = set(
+            document.get("disabled_commands", []) if document else []
+        )
+        settings.set(guild.id, "disabled_commands", disabled_commands)
 
-    return document is not None
+    return command_name in disabled_commands
 
 
 async def lock_lobby(lobby: hikari.GuildVoiceChannel) -> None:
@@ -422,16 +793,13 @@ def member_is_banned(lobby: hikari.GuildVoiceChannel, member: hikari.Member) ->
     return False
 
 
-@plugin.listener(hikari.StartedEvent)
-async def clear_database(event: hikari.StartedEvent) -> None:
+@startup.jobs.register("Lobbies", startup.NORMAL)
+async def clear_database() -> None:
     """Clears any channels from the database that dont exist anymore.
 
     Tries to fetch all channels in the templates array and clone documents array of the
     lobby_channels database. If the channel cannot be fetched, delete its entry from
-    its correct spot in the database.
-
-    Arguments:
-        event: The event that was fired.
+    its correct spot in the database. Only guilds served by this process are checked.
 
     Returns:
         None.
@@ -439,6 +807,9 @@ async def clear_database(event: hikari.StartedEvent) -> None:
     channel_cursor = plugin.bot.d.db_conn.lobby_channels
 
     async for document in channel_cursor.find({}):
+        if not owns_guild(plugin.bot, document["guild_id"]):
+            continue
+
         template_ids = document.get("templates", [])
         clone_documents = document.get("clones", [])
         clone_ids = [clone["clone_id"] for clone in clone_documents]
@@ -448,13 +819,13 @@ async def clear_database(event: hikari.StartedEvent) -> None:
 
         for id in template_ids:
             try:
-                await plugin.bot.rest.fetch_channel(id)
+                await lookups.fetch_channel(id, "lobbies.clear_database")
             except:
                 delete_templates.append(id)
 
         for id in clone_ids:
             try:
-                await plugin.bot.rest.fetch_channel(id)
+                await lookups.fetch_channel(id, "lobbies.clear_database")
             except:
                 delete_clones.append(id)
 
@@ -465,20 +836,21 @@ async def clear_database(event: hikari.StartedEvent) -> None:
         )
         await channel_cursor.update_many(
             {"guild_id": guild_id},
-            {"$pull": {"clones": {"clone_id": {"$in": delete_clones}}}},
+            {
+                "$pull": {"clones": {"clone_id": {"$in": delete_clones}}},
+                "$set": marker(),
+            },
         )
+        bus.publish("lobby_channels", guild_id)
 
 
-@plugin.listener(hikari.StartedEvent)
-async def purge_guild_documents(event: hikari.StartedEvent) -> None:
+@startup.jobs.register("Lobbies", startup.LOW)
+async def purge_guild_documents() -> None:
     """Removes data of any guild the bot is no longer a part of.
 
     Tries to fetch all the guilds with data in the lobby_channels and
     lobby_disabled_commands databases. If the guild cannot be fetched, delete the
-    document from the database.
-
-    Arguments:
-        event: The event that was fired.
+    document from the database. Only guilds served by this process are checked.
 
     Returns:
         None.
@@ -486,21 +858,29 @@ async def purge_guild_documents(event: hikari.StartedEvent) -> None:
     channel_cursor = plugin.bot.d.db_conn.lobby_channels
     disabled_command_cursor = plugin.bot.d.db_conn.lobby_disabled_commands
 
-    async for document in channel_cursor.find({}):
+    async for document in channel_cursor.find({}, {"guild_id": 1}):
         guild_id = document["guild_id"]
 
+        if not owns_guild(plugin.bot, guild_id):
+            continue
+
         try:
-            await plugin.bot.rest.fetch_guild(guild_id)
+            await lookups.fetch_guild(guild_id, "lobbies.purge_guild_documents")
         except:
             await channel_cursor.delete_one({"guild_id": guild_id})
+            bus.publish("lobby_channels", guild_id)
 
-    async for document in disabled_command_cursor.find({}):
+    async for document in disabled_command_cursor.find({}, {"guild_id": 1}):
         guild_id = document["guild_id"]
 
+        if not owns_guild(plugin.bot, guild_id):
+            continue
+
         try:
-            await plugin.bot.rest.fetch_guild(guild_id)
+            await lookups.fetch_guild(guild_id, "lobbies.purge_guild_documents")
         except:
             await disabled_command_cursor.delete_one({"guild_id": guild_id})
+            bus.publish("lobby_disabled_commands", guild_id)
 
 
 @plugin.listener(hikari.GuildLeaveEvent)
@@ -517,12 +897,47 @@ async def delete_guild_document(event: hikari.GuildLeaveEvent) -> None:
 
     await plugin.bot.d.db_conn.lobby_channels.delete_one(db_filter)
     await plugin.bot.d.db_conn.lobby_disabled_commands.delete_one(db_filter)
+    await plugin.bot.d.db_conn.lobby_member_time.delete_many(db_filter)
+    await plugin.bot.d.db_conn.lobby_template_time.delete_many(db_filter)
+    bus.publish("lobby_channels", event.guild_id)
+    bus.publish("lobby_disabled_commands", event.guild_id)
+
+
+async def unset_template_category(
+    guild_id: hikari.Snowflake, category_id: hikari.Snowflake
+) -> None:
+    """Removes a category from the settings of every template using it.
+
+    Arguments:
+        guild_id: The ID of the guild the category was in.
+        category_id: The ID of the category.
+
+    Returns:
+        None.
+    """
+    document = await get_lobby_document(guild_id)
+    fields = {
+        f"template_configs.{template_id}.category": ""
+        for template_id, template_config in document.get("template_configs", {}).items()
+        if template_config.get("category") == category_id
+    }
+
+    if not fields:
+        return
+
+    await plugin.bot.d.db_conn.lobby_channels.update_one(
+        {"guild_id": guild_id}, {"$unset": fields, "$set": marker()}
+    )
+    bus.publish("lobby_channels", guild_id)
 
 
 @plugin.listener(hikari.GuildChannelDeleteEvent)
 async def on_channel_delete(event: hikari.GuildChannelDeleteEvent) -> None:
     """Deletes template/clone channels from collections if manually deleted.
 
+    Deleted categories are removed from the settings of templates creating clones in
+    them, so the clones are created in the template's category instead.
+
     Arguments:
         event: The event that was fired.
 
@@ -531,17 +946,185 @@ async def on_channel_delete(event: hikari.GuildChannelDeleteEvent) -> None:
     """
     channel = event.channel
 
+    if isinstance(channel, hikari.GuildCategory):
+        await unset_template_category(channel.guild_id, channel.id)
+        return
+
     if not isinstance(channel, hikari.GuildVoiceChannel):
         return
 
     await plugin.bot.d.db_conn.lobby_channels.update_many(
         {"guild_id": channel.guild_id},
-        {"$pull": {"templates": channel.id}},
+        {
+            "$pull": {"templates": channel.id},
+            "$unset": {f"template_configs.{channel.id}": ""},
+        },
     )
     await plugin.bot.d.db_conn.lobby_channels.update_many(
         {"guild_id": channel.guild_id},
-        {"$pull": {"clones": {"clone_id": channel.id}}},
+        {"$pull": {"clones": {"clone_id": channel.id}}, "$set": marker()},
     )
+    bus.publish("lobby_channels", channel.guild_id)
+    lobby_members.pop(channel.id, None)
+
+
+async def record_lobby_time(
+    guild_id: hikari.Snowflake,
+    member_id: hikari.Snowflake,
+    template_id: hikari.Snowflake,
+    seconds: float,
+    sessions: int,
+) -> None:
+    """Queues the writes adding time spent in a lobby to the member and template.
+
+    Arguments:
+        guild_id: The ID of the guild the lobby is in.
+        member_id: The ID of the member who was in the lobby.
+        template_id: The ID of the template the lobby was cloned from.
+        seconds: The number of seconds spent in the lobby.
+        sessions: The number of sessions to count, 0 if the session is ongoing.
+
+    Returns:
+        None.
+    """
+    increments = {"seconds": seconds, "sessions": sessions}
+
+    await writebehind.queue.submit(
+        "lobby_member_time",
+        {
+            "update_one": {
+                "filter": {"guild_id": guild_id, "member_id": member_id},
+                "update": {"$inc": increments},
+                "upsert": True,
+            }
+        },
+    )
+    await writebehind.queue.submit(
+        "lobby_template_time",
+        {
+            "update_one": {
+                "filter": {"guild_id": guild_id, "template_id": template_id},
+                "update": {"$inc": increments},
+                "upsert": True,
+            }
+        },
+    )
+
+
+async def end_lobby_session(key: typing.Tuple[int, int]) -> None:
+    """Ends the lobby session of a member and records the time spent in it.
+
+    Arguments:
+        key: The guild ID and member ID of the session.
+
+    Returns:
+        None.
+    """
+    template_id = session_templates.pop(key, None)
+    seconds = lobby_sessions.end(key)
+
+    if template_id is not None:
+        await record_lobby_time(*key, template_id, seconds, 1)
+
+
+async def flush_lobby_sessions() -> None:
+    """Records the time spent in every ongoing lobby session so far.
+
+    Returns:
+        None.
+    """
+    for key, seconds in lobby_sessions.collect().items():
+        await record_lobby_time(*key, session_templates[key], seconds, 0)
+
+
+lifecycle.manager.on_drain(flush_lobby_sessions)
+
+
+@plugin.listener(hikari.GuildAvailableEvent)
+async def recover_lobby_sessions(event: hikari.GuildAvailableEvent) -> None:
+    """Starts sessions for members who are already in a clone channel of a guild.
+
+    Sessions of members who left while the bot was disconnected are dropped without
+    being recorded, as the time they left is unknown. Clones whose owner left while
+    the bot was disconnected are handed off to a member still in them.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    voice_states = plugin.bot.cache.get_voice_states_view_for_guild(event.guild_id)
+    document = await get_lobby_document(event.guild_id)
+    clones = {
+        clone["clone_id"]: clone["template_id"] for clone in document.get("clones", [])
+    }
+
+    for key in [key for key in lobby_sessions if key[0] == event.guild_id]:
+        voice_state = voice_states.get(key[1])
+
+        if voice_state is None or voice_state.channel_id not in clones:
+            lobby_sessions.end(key)
+            session_templates.pop(key, None)
+
+    for member_id, voice_state in voice_states.items():
+        if voice_state.channel_id in clones:
+            key = (event.guild_id, member_id)
+            lobby_sessions.start(key)
+            session_templates.setdefault(key, clones[voice_state.channel_id])
+
+    # Members who were already in a clone are treated as joining it now, and owners
+    # may have left while the bot was disconnected
+    now = time.monotonic()
+
+    for clone_id in clones:
+        joined = lobby_members.get(clone_id, {})
+        lobby_members[clone_id] = {
+            member_id: joined.get(member_id, now)
+            for member_id, voice_state in voice_states.items()
+            if voice_state.channel_id == clone_id
+        }
+
+        if lobby_members[clone_id]:
+            await hand_off_ownership(event.guild_id, clone_id)
+
+
+@plugin.listener(hikari.VoiceStateUpdateEvent)
+async def track_lobby_time(event: hikari.VoiceStateUpdateEvent) -> None:
+    """Starts and ends the lobby sessions of members moving between channels.
+
+    The members in each clone are tracked in the order they joined, to pick the next
+    owner from when the owner leaves.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    voice_state = event.state
+    channel_id = voice_state.channel_id
+    prev_channel_id = event.old_state.channel_id if event.old_state else None
+
+    if channel_id == prev_channel_id:
+        return
+
+    key = (voice_state.guild_id, voice_state.user_id)
+    prev_members = lobby_members.get(prev_channel_id, {})
+    prev_members.pop(voice_state.user_id, None)
+
+    if key in lobby_sessions:
+        await end_lobby_session(key)
+
+    if channel_id is None:
+        return
+
+    clone = await get_clone_document(channel_id, voice_state.guild_id)
+
+    if clone is not None:
+        lobby_sessions.start(key)
+        session_templates[key] = clone["clones"]["template_id"]
+        lobby_members.setdefault(channel_id, {})[voice_state.user_id] = time.monotonic()
 
 
 @plugin.listener(hikari.VoiceStateUpdateEvent)
@@ -563,11 +1146,13 @@ async def on_join_template(event: hikari.VoiceStateUpdateEvent) -> None:
     if voice_state is None or channel_id is None:
         return
 
-    if not await valid_template(channel_id):
+    if not await valid_template(channel_id, voice_state.guild_id):
         return
 
     member = voice_state.member
-    template_channel = await plugin.bot.rest.fetch_channel(channel_id)
+    template_channel = await lookups.fetch_channel(
+        channel_id, "lobbies.on_join_template"
+    )
     clone_channel = await create_clone(template_channel, member)
 
     await event.state.member.edit(voice_channel=clone_channel)
@@ -578,7 +1163,8 @@ async def on_leave_clone(event: hikari.VoiceStateUpdateEvent) -> None:
     """Deletes the clone channel if there is nobody left in it.
 
     If a clone channel is left by a member, checks if the channel has no members left
-    in it and deletes the channel if so.
+    in it and deletes the channel if so. Otherwise, if the member was the owner,
+    ownership is handed off to the member who has been in the clone the longest.
 
     Arguments:
         event: The event that was fired.
@@ -596,7 +1182,7 @@ async def on_leave_clone(event: hikari.VoiceStateUpdateEvent) -> None:
     if prev_state_channel_id is None:
         return
 
-    if not await valid_clone(prev_state_channel_id):
+    if not await valid_clone(prev_state_channel_id, prev_state.guild_id):
         return
 
     clone_guild = prev_state.guild_id
@@ -607,8 +1193,13 @@ async def on_leave_clone(event: hikari.VoiceStateUpdateEvent) -> None:
     )
 
     if list(voice_states.values()) == []:
-        clone_channel = await plugin.bot.rest.fetch_channel(clone_channel_id)
+        clone_channel = await lookups.fetch_channel(
+            clone_channel_id, "lobbies.on_leave_clone"
+        )
         await clone_channel.delete()
+        lobby_members.pop(clone_channel_id, None)
+    else:
+        await hand_off_ownership(clone_guild, clone_channel_id)
 
 
 @plugin.command
@@ -752,13 +1343,13 @@ async def rename(
 
     # Check if the command author is not a lobby channel
     if author_voice_state is None or not await valid_clone(
-        author_voice_state.channel_id
+        author_voice_state.channel_id, guild.id
     ):
         await error_response(context, "You are not in a lobby.")
         return
 
     author_channel_id = author_voice_state.channel_id
-    document = await get_clone_document(author_channel_id)
+    document = await get_clone_document(author_channel_id, guild.id)
 
     # Check if the command author is not the owner of the lobby they are in
     if document["clones"]["owner_id"] != author_member.id:
@@ -815,13 +1406,13 @@ async def lock(
 
     # Check if the command author is not a lobby channel
     if author_voice_state is None or not await valid_clone(
-        author_voice_state.channel_id
+        author_voice_state.channel_id, guild.id
     ):
         await error_response(context, "You are not in a lobby.")
         return
 
     author_channel_id = author_voice_state.channel_id
-    document = await get_clone_document(author_channel_id)
+    document = await get_clone_document(author_channel_id, guild.id)
 
     # Check if the command author is not the owner of the lobby they are in
     if document["clones"]["owner_id"] != author_member.id:
@@ -866,13 +1457,13 @@ async def unlock(
 
     # Check if the command author is not a lobby channel
     if author_voice_state is None or not await valid_clone(
-        author_voice_state.channel_id
+        author_voice_state.channel_id, guild.id
     ):
         await error_response(context, "You are not in a lobby.")
         return
 
     author_channel_id = author_voice_state.channel_id
-    document = await get_clone_document(author_channel_id)
+    document = await get_clone_document(author_channel_id, guild.id)
 
     # Check if the command author is not the owner of the lobby they are in
     if document["clones"]["owner_id"] != author_member.id:
@@ -918,13 +1509,13 @@ async def kick(
 
     # Check if the command author is not a lobby channel
     if author_voice_state is None or not await valid_clone(
-        author_voice_state.channel_id
+        author_voice_state.channel_id, guild.id
     ):
         await error_response(context, "You are not in a lobby.")
         return
 
     author_channel_id = author_voice_state.channel_id
-    document = await get_clone_document(author_channel_id)
+    document = await get_clone_document(author_channel_id, guild.id)
 
     # Check if the command author is not the owner of the lobby they are in
     if document["clones"]["owner_id"] != author_member.id:
@@ -975,13 +1566,13 @@ async def ban(
 
     # Check if the command author is not a lobby channel
     if author_voice_state is None or not await valid_clone(
-        author_voice_state.channel_id
+        author_voice_state.channel_id, guild.id
     ):
         await error_response(context, "You are not in a lobby.")
         return
 
     author_channel_id = author_voice_state.channel_id
-    document = await get_clone_document(author_channel_id)
+    document = await get_clone_document(author_channel_id, guild.id)
 
     # Check if the command author is not the owner of the lobby they are in
     if document["clones"]["owner_id"] != author_member.id:
@@ -1039,13 +1630,13 @@ async def unban(
 
     # Check if the command author is not a lobby channel
     if author_voice_state is None or not await valid_clone(
-        author_voice_state.channel_id
+        author_voice_state.channel_id, guild.id
     ):
         await error_response(context, "You are not in a lobby.")
         return
 
     author_channel_id = author_voice_state.channel_id
-    document = await get_clone_document(author_channel_id)
+    document = await get_clone_document(author_channel_id, guild.id)
 
     # Check if the command author is not the owner of the lobby they are in
     if document["clones"]["owner_id"] != author_member.id:
@@ -1068,6 +1659,282 @@ async def unban(
     )
 
 
+@lobby.child
+@lightbulb.add_checks(lightbulb.guild_only)
+@lightbulb.option("member", "The member to make the owner", type=hikari.Member)
+@lightbulb.command("transfer", "Makes another member the owner of the lobby")
+@lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+async def transfer(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Makes another member in the lobby its owner.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    guild = context.get_guild()
+
+    # Check if the command is disabled in the guild
+    if await command_is_disabled("transfer", guild):
+        await error_response(context, "Sorry. This command has been disabled.")
+        return
+
+    author_member = context.member
+    author_voice_state = guild.get_voice_state(author_member)
+
+    # Check if the command author is not a lobby channel
+    if author_voice_state is None or not await valid_clone(
+        author_voice_state.channel_id, guild.id
+    ):
+        await error_response(context, "You are not in a lobby.")
+        return
+
+    author_channel_id = author_voice_state.channel_id
+    document = await get_clone_document(author_channel_id, guild.id)
+
+    # Check if the command author is not the owner of the lobby they are in
+    if document["clones"]["owner_id"] != author_member.id:
+        await error_response(context, "You are not the owner of this lobby.")
+        return
+
+    target_member = context.options.member
+    target_voice_state = guild.get_voice_state(target_member)
+
+    # Check if the target is not in the lobby
+    if target_voice_state is None or author_channel_id != target_voice_state.channel_id:
+        await error_response(context, "That member is not in the lobby.")
+        return
+
+    # Check if the target is the command author or a bot
+    if target_member.id == author_member.id or target_member.is_bot:
+        await error_response(context, "That member can't be made the owner.")
+        return
+
+    await transfer_ownership(
+        guild.id, author_channel_id, author_member.id, target_member.id
+    )
+    await info_response(
+        context,
+        "Ownership transferred",
+        f"`{target_member.username}` is now the owner of the lobby.",
+    )
+
+
+async def get_usage_report(
+    guild_id: hikari.Snowflake,
+) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
+    """Gets the templates and members with the most time spent in lobbies.
+
+    Arguments:
+        guild_id: The ID of the guild.
+
+    Returns:
+        The time documents of the top templates and the top members.
+    """
+    for collection in ("lobby_member_time", "lobby_template_time"):
+        if writebehind.queue.has_pending(collection):
+            await writebehind.queue.flush(collection)
+
+    database = plugin.bot.d.db_read_conn
+    templates = await (
+        database.lobby_template_time.find({"guild_id": guild_id})
+        .sort("seconds", -1)
+        .to_list(length=USAGE_REPORT_SIZE)
+    )
+    members = await (
+        database.lobby_member_time.find({"guild_id": guild_id})
+        .sort("seconds", -1)
+        .to_list(length=USAGE_REPORT_SIZE)
+    )
+
+    return templates, members
+
+
+@lobby.child
+@lightbulb.add_checks(
+    lightbulb.has_guild_permissions(hikari.Permissions.MANAGE_CHANNELS),
+    lightbulb.guild_only,
+)
+@lightbulb.command("usage", "Shows which lobbies are used the most")
+@lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+async def usage(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Shows the lobby templates and members with the most time spent in lobbies.
+
+    Time spent in lobbies that are still in use is counted once they are left.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    templates, members = await get_usage_report(context.guild_id)
+
+    if not templates:
+        await error_response(context, "No lobbies have been used yet.")
+        return
+
+    template_lines = [
+        f"<#{document['template_id']}> `{get_duration_string(document['seconds'])}` "
+        f"over {document['sessions']} sessions"
+        for document in templates
+    ]
+    member_lines = [
+        f"<@{document['member_id']}> `{get_duration_string(document['seconds'])}`"
+        for document in members
+    ]
+
+    usage_embed = create_info_embed(
+        "Lobby usage",
+        "Here are the lobbies and members with the most time spent in lobbies",
+        context.app.get_me().avatar_url,
+    )
+
+    usage_embed.add_field("Lobbies", "\n".join(template_lines))
+    usage_embed.add_field("Members", "\n".join(member_lines))
+
+    await context.respond(embed=usage_embed)
+
+
+def get_template_config_string(template_config: dict) -> str:
+    """Formats the settings of a template to show to users.
+
+    Arguments:
+        template_config: The settings of the template.
+
+    Returns:
+        The formatted settings, one per line.
+    """
+    user_limit = template_config.get("user_limit")
+    bitrate = template_config.get("bitrate")
+    category = template_config.get("category")
+
+    if user_limit is not None:
+        user_limit = user_limit or "No limit"
+
+    lines = [
+        f"Name: `{template_config.get('name', DEFAULT_NAME_PATTERN)}`",
+        f"User limit: {user_limit or 'Copied'}",
+        f"Bitrate: {f'{bitrate} kbps' if bitrate else 'Copied'}",
+        f"Category: {f'<#{category}>' if category else 'Copied'}",
+        f"Permissions: {template_config.get('overwrites', 'template').capitalize()}",
+    ]
+
+    return "\n".join(lines)
+
+
+@lobby.child
+@lightbulb.add_checks(
+    lightbulb.has_guild_permissions(hikari.Permissions.MANAGE_CHANNELS),
+    lightbulb.guild_only,
+)
+@lightbulb.option(
+    "reset",
+    "Whether to remove every setting and copy the template channel instead",
+    type=bool,
+    default=False,
+)
+@lightbulb.option(
+    "overwrites",
+    "The permissions of lobbies, copied from the template, open or locked",
+    choices=OVERWRITE_PRESETS,
+    required=False,
+)
+@lightbulb.option(
+    "category",
+    "The category lobbies are created in",
+    type=hikari.GuildCategory,
+    required=False,
+)
+@lightbulb.option(
+    "bitrate",
+    "The bitrate of lobbies in kbps",
+    type=int,
+    min_value=8,
+    max_value=384,
+    required=False,
+)
+@lightbulb.option(
+    "user_limit",
+    "The maximum number of members in lobbies, 0 for no limit",
+    type=int,
+    min_value=0,
+    max_value=99,
+    required=False,
+)
+@lightbulb.option(
+    "name",
+    "The name of lobbies, where {owner} is replaced with the owner's name",
+    required=False,
+)
+@lightbulb.option(
+    "template", "The lobby template to configure", type=hikari.GuildVoiceChannel
+)
+@lightbulb.command("configure", "Changes the settings of lobbies made from a template")
+@lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+async def configure(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Changes the settings lobbies made from a template are created with.
+
+    Settings which aren't given are left as they are, and settings which were never
+    given are copied from the template channel.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    guild = context.get_guild()
+    template = context.options.template
+
+    # Check if the channel is not a lobby template
+    if not await valid_template(template.id, guild.id):
+        await error_response(context, "That channel is not a lobby template.")
+        return
+
+    if context.options.reset:
+        await reset_template(guild.id, template.id)
+        await info_response(
+            context,
+            "Template reset",
+            f"Lobbies made from <#{template.id}> will copy the template channel.",
+        )
+        return
+
+    changes = {
+        name: context.options[name]
+        for name in ("name", "user_limit", "bitrate", "overwrites")
+        if context.options[name] is not None
+    }
+
+    if context.options.category is not None:
+        changes["category"] = context.options.category.id
+
+    # Check if the bitrate is higher than the server boost level allows
+    if changes.get("bitrate", 0) > MAX_BITRATES.get(guild.premium_tier, 384):
+        await error_response(
+            context, "That bitrate is higher than this server's boost level allows."
+        )
+        return
+
+    if changes:
+        await configure_template(guild.id, template.id, changes)
+
+    document = await get_lobby_document(guild.id)
+    await info_response(
+        context,
+        "Template configured",
+        get_template_config_string(get_template_config(document, template.id)),
+    )
+
+
 @lobby.set_error_handler()
 async def channel_errors(event: lightbulb.CommandErrorEvent) -> bool:
     """Handles errors for the lobby command and its various subcommands.
@@ -1108,4 +1975,5 @@ def load(bot: lightbulb.BotApp) -> None:
     Returns:
         None.
     """
+    instrument_plugin(plugin)
     bot.add_plugin(plugin)
@@ -1,78 +1,287 @@
 import hikari
 import lightbulb
+import re
+import time
 import typing
 
-from utils.responses import create_info_embed
+from bot import config
+from hikari.messages import ButtonStyle
+from lightbulb.utils.nav import (
+    ComponentButton as Button,
+    ButtonNavigator,
+    prev_page,
+    next_page,
+)
+from utils.decay import decay, get_reputation_decay_rate
+from utils.metrics import instrument_plugin
+from utils import writebehind
+from utils.responses import create_info_embed, error_response
+from utils.rest import lookups
+from utils.sessions import get_duration_string
 
 
 plugin = lightbulb.Plugin("Profile")
 
+CACHE_COMPONENTS = hikari.api.CacheComponents.MEMBERS
+
+DECAY_RATE = get_reputation_decay_rate(config)
+
+MAX_PROFILES = 25
+MEMBER_ID_PATTERN = re.compile(r"\d{15,20}")
 
-async def get_reputation(member_id: hikari.Snowflake) -> tuple:
-    """Gets a members reputation from the database.
 
-    Tries to pull the members reputation document from the database. If there is a
-    document, return the members reputation. Otherwise, return 0.
+async def get_reputations(
+    member_ids: typing.Sequence[hikari.Snowflake], guild_id: hikari.Snowflake
+) -> typing.Dict[hikari.Snowflake, typing.Tuple[tuple, tuple]]:
+    """Gets the reputation of several members in a guild and globally.
+
+    Reads the guild and global reputation counters of every member in a single
+    query. Counters that don't exist are treated as 0. The stored decayed scores are
+    decayed from their last update to now. Votes which are still queued to be
+    written are included.
 
     Arguments:
-        member_id: The ID of the member whos member to get.
+        member_ids: The IDs of the members whos reputation to get.
+        guild_id: The ID of the guild to get the reputation in.
 
     Returns:
-        The members reputation.
+        The upvotes, downvotes and decayed score in the guild and globally of each
+        member, by member ID.
     """
-    document = await plugin.bot.d.db_conn.reputations.find_one({"member_id": member_id})
+    now = time.time()
+    counters = {
+        member_id: {guild_id: (0, 0, 0.0), None: (0, 0, 0.0)}
+        for member_id in member_ids
+    }
+
+    async for document in plugin.bot.d.db_read_conn.reputation_counters.find(
+        {"member_id": {"$in": list(counters)}, "guild_id": {"$in": [guild_id, None]}}
+    ):
+        score = decay(
+            document.get("decayed", document["score"]),
+            document.get("decayed_at", now),
+            now,
+            DECAY_RATE,
+        )
+        counters[document["member_id"]][document["guild_id"]] = (
+            document["upvotes"],
+            document["downvotes"],
+            score,
+        )
+
+    # Queued votes are added to the stored counters instead of flushing the queue,
+    # so viewing profiles doesn't wait for a write
+    for _, operations in writebehind.queue.pending("reputation_counters"):
+        for operation in operations:
+            update = operation["update_one"]
+            member_counters = counters.get(update["filter"]["member_id"], {})
+            counter_guild_id = update["filter"]["guild_id"]
+
+            if counter_guild_id not in member_counters:
+                continue
+
+            # Each field of the update pipeline adds its increment to the stored value
+            fields = update["update"][0]["$set"]
+            upvotes, downvotes, score = member_counters[counter_guild_id]
+            member_counters[counter_guild_id] = (
+                upvotes + fields["upvotes"]["$add"][1],
+                downvotes + fields["downvotes"]["$add"][1],
+                score
+                + decay(
+                    fields["score"]["$add"][1], fields["decayed_at"], now, DECAY_RATE
+                ),
+            )
+
+    return {
+        member_id: (member_counters[guild_id], member_counters[None])
+        for member_id, member_counters in counters.items()
+    }
 
-    if document is None:
-        return (0, 0)
-    else:
-        upvotes = len(document.get("upvotes", []))
-        downvotes = len(document.get("downvotes", []))
-        return (upvotes, downvotes)
 
+async def get_reputation(
+    member_id: hikari.Snowflake, guild_id: hikari.Snowflake
+) -> typing.Tuple[tuple, tuple]:
+    """Gets a members reputation in a guild and globally from the database.
+
+    Arguments:
+        member_id: The ID of the member whos reputation to get.
+        guild_id: The ID of the guild to get the reputation in.
+
+    Returns:
+        The members upvotes, downvotes and decayed score in the guild and globally.
+    """
+    reputations = await get_reputations([member_id], guild_id)
+
+    return reputations[member_id]
 
-def get_reputation_string(upvotes: int, downvotes: int) -> str:
-    """Takes upvotes and downvotes to return reputation as a formatted string.
+
+async def get_lobby_times(
+    member_ids: typing.Sequence[hikari.Snowflake], guild_id: hikari.Snowflake
+) -> typing.Dict[hikari.Snowflake, float]:
+    """Gets the time several members have spent in lobbies in a guild.
+
+    Time which is still queued to be written is included.
 
     Arguments:
-        upvotes: The number of upvotes.
-        downvotes: The number of downvotes.
+        member_ids: The IDs of the members.
+        guild_id: The ID of the guild.
+
+    Returns:
+        The number of seconds each member spent in lobbies, by member ID.
+    """
+    lobby_times = {member_id: 0.0 for member_id in member_ids}
+
+    async for document in plugin.bot.d.db_conn.lobby_member_time.find(
+        {"guild_id": guild_id, "member_id": {"$in": list(lobby_times)}},
+        {"_id": 0, "member_id": 1, "seconds": 1},
+    ):
+        lobby_times[document["member_id"]] = document["seconds"]
+
+    # Queued time is added to the stored totals instead of flushing the queue, so
+    # viewing profiles doesn't break up the batches of writes
+    for _, operations in writebehind.queue.pending("lobby_member_time"):
+        for operation in operations:
+            update = operation["update_one"]
+            member_id = update["filter"]["member_id"]
+
+            if update["filter"]["guild_id"] == guild_id and member_id in lobby_times:
+                lobby_times[member_id] += update["update"]["$inc"]["seconds"]
+
+    return lobby_times
+
+
+def get_reputation_string(score: float) -> str:
+    """Takes a decayed reputation score to return it as a formatted string.
+
+    Arguments:
+        score: The decayed score.
 
     Returns:
         The formatted string.
     """
-    reputation = upvotes - downvotes
+    reputation = round(score, 1)
 
     if reputation > 0:
-        reputation = "+" + str(reputation)
+        reputation = f"+{reputation:g}"
     elif reputation < 0:
-        reputation = str(reputation)
+        reputation = f"{reputation:g}"
     else:
         reputation = "-"
 
     return reputation
 
 
-async def extract_member_details(member: hikari.Member) -> dict:
-    """Pull all data about a member from the database.
+def build_member_details(
+    member: hikari.Member, reputation: typing.Tuple[tuple, tuple], lobby_time: float
+) -> dict:
+    """Combines a members details with their reputation and lobby time.
 
     Arguments:
         member: The member to get the information of.
+        reputation: The members reputation in the guild and globally.
+        lobby_time: The number of seconds the member spent in lobbies.
 
     Returns:
         A dictionary of the members information.
     """
-    upvotes, downvotes = await get_reputation(member.id)
+    guild_votes, global_votes = reputation
     data = {
         "name": f"{member.username}#{member.discriminator}",
         "joined": member.joined_at.strftime("%b %d, %Y"),
         "created": member.created_at.strftime("%b %d, %Y"),
-        "upvotes": upvotes,
-        "downvotes": downvotes,
+        "guild_upvotes": guild_votes[0],
+        "guild_downvotes": guild_votes[1],
+        "guild_score": guild_votes[2],
+        "upvotes": global_votes[0],
+        "downvotes": global_votes[1],
+        "score": global_votes[2],
+        "lobby_time": get_duration_string(lobby_time),
     }
 
     return data
 
 
+async def extract_member_details(member: hikari.Member) -> dict:
+    """Pull all data about a member from the database.
+
+    Arguments:
+        member: The member to get the information of.
+
+    Returns:
+        A dictionary of the members information.
+    """
+    reputation = await get_reputation(member.id, member.guild_id)
+    lobby_times = await get_lobby_times([member.id], member.guild_id)
+
+    return build_member_details(member, reputation, lobby_times[member.id])
+
+
+def create_profile_embed(member: hikari.Member, member_data: dict) -> hikari.Embed:
+    """Creates the profile embed of a member.
+
+    Arguments:
+        member: The member the profile is of.
+        member_data: The details of the member.
+
+    Returns:
+        The profile embed.
+    """
+    guild_reputation = get_reputation_string(member_data["guild_score"])
+    reputation = get_reputation_string(member_data["score"])
+
+    profile_embed = create_info_embed(
+        f"{member_data['name']}'s Profile",
+        f"Here are some details about `{member_data['name']}`",
+        plugin.app.get_me().avatar_url,
+    )
+
+    profile_embed.set_thumbnail(member.avatar_url or member.default_avatar_url)
+    profile_embed.add_field("User ID", member.id, inline=True)
+    profile_embed.add_field("Joined at", member_data["joined"], inline=True)
+    profile_embed.add_field("Created at", member_data["created"], inline=True)
+    profile_embed.add_field("Server Reputation", guild_reputation, inline=True)
+    profile_embed.add_field("Global Reputation", reputation, inline=True)
+    profile_embed.add_field("Server Upvotes", member_data["guild_upvotes"], inline=True)
+    profile_embed.add_field(
+        "Server Downvotes", member_data["guild_downvotes"], inline=True
+    )
+    profile_embed.add_field("Total Upvotes", member_data["upvotes"], inline=True)
+    profile_embed.add_field("Total Downvotes", member_data["downvotes"], inline=True)
+    profile_embed.add_field("Time in Lobbies", member_data["lobby_time"], inline=True)
+
+    return profile_embed
+
+
+async def resolve_members(
+    guild_id: hikari.Snowflake, member_ids: typing.Iterable[int]
+) -> typing.List[hikari.Member]:
+    """Resolves member IDs to members of a guild.
+
+    Members are taken from the cache, and only members missing from it are fetched.
+    IDs of users who aren't in the guild are skipped.
+
+    Arguments:
+        guild_id: The ID of the guild the members are in.
+        member_ids: The IDs of the members.
+
+    Returns:
+        The members, in the order of their IDs.
+    """
+    members = []
+
+    for member_id in member_ids:
+        try:
+            member = await lookups.fetch_member(
+                guild_id, member_id, "profile.resolve_members"
+            )
+        except hikari.NotFoundError:
+            continue
+
+        members.append(member)
+
+    return members
+
+
 @plugin.command
 @lightbulb.add_checks(lightbulb.guild_only)
 @lightbulb.option(
@@ -96,25 +305,72 @@ async def profile(
     """
     target = context.options.member or context.member
     target_data = await extract_member_details(target)
-    target_reputation = get_reputation_string(
-        target_data["upvotes"], target_data["downvotes"]
-    )
 
-    profile_embed = create_info_embed(
-        f"{target_data['name']}'s Profile",
-        f"Here are some details about `{target_data['name']}`",
-        context.app.get_me().avatar_url,
+    await context.respond(embed=create_profile_embed(target, target_data))
+
+
+@plugin.command
+@lightbulb.add_checks(lightbulb.guild_only)
+@lightbulb.option(
+    "members",
+    "Mentions or IDs of the members to see the profiles of",
+    modifier=lightbulb.OptionModifier.CONSUME_REST,
+)
+@lightbulb.command("profiles", "Displays information about several members")
+@lightbulb.implements(lightbulb.SlashCommand, lightbulb.PrefixCommand)
+async def profiles(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Displays the profiles of several members in the guild, one per page.
+
+    The reputation and lobby time of every member are each read in a single query.
+
+    Called when a user uses /profiles <members>
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    member_ids = list(
+        dict.fromkeys(
+            int(member_id)
+            for member_id in MEMBER_ID_PATTERN.findall(context.options.members)
+        )
     )
 
-    profile_embed.set_thumbnail(target.avatar_url or target.default_avatar_url)
-    profile_embed.add_field("User ID", target.id, inline=True)
-    profile_embed.add_field("Joined at", target_data["joined"], inline=True)
-    profile_embed.add_field("Created at", target_data["created"], inline=True)
-    profile_embed.add_field("Global Reputation", target_reputation, inline=True)
-    profile_embed.add_field("Total Upvotes", target_data["upvotes"], inline=True)
-    profile_embed.add_field("Total Downvotes", target_data["downvotes"], inline=True)
+    if len(member_ids) > MAX_PROFILES:
+        await error_response(
+            context, f"You can only view up to {MAX_PROFILES} profiles at once."
+        )
+        return
+
+    members = await resolve_members(context.guild_id, member_ids)
+
+    if not members:
+        await error_response(context, "None of those members are in this server.")
+        return
+
+    member_ids = [member.id for member in members]
+    reputations = await get_reputations(member_ids, context.guild_id)
+    lobby_times = await get_lobby_times(member_ids, context.guild_id)
+    pages = []
+
+    for index, member in enumerate(members, start=1):
+        member_data = build_member_details(
+            member, reputations[member.id], lobby_times[member.id]
+        )
+        profile_embed = create_profile_embed(member, member_data)
+        profile_embed.set_footer(f"Profile {index} of {len(members)}")
+        pages.append(profile_embed)
+
+    buttons = [
+        Button("Previous", False, ButtonStyle.PRIMARY, "previous", prev_page),
+        Button("Next", False, ButtonStyle.PRIMARY, "next", next_page),
+    ]
 
-    await context.respond(embed=profile_embed)
+    await ButtonNavigator(pages, buttons=buttons).run(context)
 
 
 def load(bot: lightbulb.BotApp) -> None:
@@ -126,4 +382,5 @@ def load(bot: lightbulb.BotApp) -> None:
     Returns:
         None.
     """
+    instrument_plugin(plugin)
     bot.add_plugin(plugin)
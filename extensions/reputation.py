@@ -1,92 +1,451 @@
 import hikari
 import lightbulb
+import logging
+import math
+import time
 import typing
 
-from utils.responses import info_response, error_response
+from bot import config
+from pymongo import UpdateOne
+from utils import metrics, schema, startup, writebehind
+from utils.decay import build_decay_expression, get_reputation_decay_rate
+from utils.metrics import instrument_plugin
+from utils.ranking import Ranking
+from utils.ratelimit import BurstDetector, SlidingWindowLimiter
+from utils.scheduler import scheduler
+from utils.responses import create_info_embed, info_response, error_response
+
+
+logger = logging.getLogger(__name__)
 
 
 plugin = lightbulb.Plugin("Reputation")
 
+schema.register_index(
+    "reputation_votes", ["target_id", "guild_id", "voter_id"], unique=True
+)
+schema.register_index("reputation_counters", ["member_id", "guild_id"], unique=True)
+schema.register_index("reputation_counters", ["guild_id", ("score", -1)])
+schema.register_query(
+    "reputation_votes", {"target_id": 0, "guild_id": 0, "voter_id": 0}
+)
+schema.register_query("reputation_counters", {"member_id": 0, "guild_id": 0})
+schema.register_query("reputation_counters", {"guild_id": 0})
+
+UPVOTE = 1
+DOWNVOTE = -1
+
+LEADERBOARD_PAGE_SIZE = 10
+DEFAULT_RECONCILE_INTERVAL = 600.0
+DEFAULT_RENORMALIZE_INTERVAL = 86400.0
+
+DECAY_RATE = get_reputation_decay_rate(config)
+
+DEFAULT_VOTER_LIMIT = 5
+DEFAULT_VOTER_WINDOW = 60.0
+DEFAULT_TARGET_LIMIT = 15
+DEFAULT_TARGET_WINDOW = 60.0
+DEFAULT_BURST_THRESHOLD = 8
+DEFAULT_BURST_WINDOW = 10.0
+DEFAULT_BURST_COOLDOWN = 300.0
+
+# Every member with votes, ordered by global score
+leaderboard = Ranking()
+
+# Votes cast by each member and received by each member, keyed by guild
+voter_limiter = SlidingWindowLimiter(
+    config.getint("VOTING", "VOTER_LIMIT", fallback=DEFAULT_VOTER_LIMIT),
+    config.getfloat("VOTING", "VOTER_WINDOW", fallback=DEFAULT_VOTER_WINDOW),
+)
+target_limiter = SlidingWindowLimiter(
+    config.getint("VOTING", "TARGET_LIMIT", fallback=DEFAULT_TARGET_LIMIT),
+    config.getfloat("VOTING", "TARGET_WINDOW", fallback=DEFAULT_TARGET_WINDOW),
+)
+burst_detector = BurstDetector(
+    config.getint("VOTING", "BURST_THRESHOLD", fallback=DEFAULT_BURST_THRESHOLD),
+    config.getfloat("VOTING", "BURST_WINDOW", fallback=DEFAULT_BURST_WINDOW),
+    config.getfloat("VOTING", "BURST_COOLDOWN", fallback=DEFAULT_BURST_COOLDOWN),
+)
+
+votes_rejected = metrics.registry.counter(
+    "campfire_votes_rejected_total",
+    "Votes refused by the rate limits before reaching the database.",
+    ("reason",),
+)
+vote_bursts = metrics.registry.counter(
+    "campfire_vote_bursts_total", "Bursts of votes detected against one member."
+)
+
+
+def check_vote_limits(
+    voter_id: hikari.Snowflake, target_id: hikari.Snowflake, guild_id: hikari.Snowflake
+) -> typing.Optional[str]:
+    """Checks a vote against the rate limits and records it if it is allowed.
+
+    A vote is refused if its target is cooling down after a burst of votes, or if
+    the voter has cast or the target has received too many votes recently. Votes
+    which complete a burst against their target are allowed, but the target then
+    refuses votes until the cooldown ends.
+
+    Arguments:
+        voter_id: The ID of the voting user.
+        target_id: The ID of the user being voted for.
+        guild_id: The ID of the guild the vote was cast in.
+
+    Returns:
+        The reason the vote was refused, or None if it is allowed.
+    """
+    now = time.monotonic()
+    voter_key = (guild_id, voter_id)
+    target_key = (guild_id, target_id)
+
+    cooldown = burst_detector.flagged_for(target_key, now)
+
+    if cooldown:
+        votes_rejected.inc(reason="burst")
+        return (
+            "That member is receiving too many votes. "
+            f"Try again in {math.ceil(cooldown)} seconds."
+        )
+
+    wait = voter_limiter.retry_after(voter_key, now)
+
+    if wait:
+        votes_rejected.inc(reason="voter")
+        return f"You are voting too quickly. Try again in {math.ceil(wait)} seconds."
+
+    wait = target_limiter.retry_after(target_key, now)
+
+    if wait:
+        votes_rejected.inc(reason="target")
+        return (
+            "That member has received too many votes recently. "
+            f"Try again in {math.ceil(wait)} seconds."
+        )
+
+    voter_limiter.hit(voter_key, now)
+    target_limiter.hit(target_key, now)
 
-async def get_upvotes(target_id: hikari.Snowflake) -> list:
-    """Gets a list of IDs for users who have upvoted the target.
+    if burst_detector.hit(target_key, now):
+        vote_bursts.inc()
+        logger.warning(
+            "burst of votes against member %s in guild %s", target_id, guild_id
+        )
+
+    return None
+
+
+def get_counter_increments(previous: int, value: int) -> dict:
+    """Gets how a member's counters change when a vote is replaced.
 
     Arguments:
-        target_id: The ID of the user to get the upvotes of.
+        previous: The vote the voter had cast before, or 0 if none.
+        value: The new vote.
 
     Returns:
-        The list of member IDs that upvoted the target.
+        The increments of the upvotes, downvotes and score counters.
     """
-    document = await plugin.bot.d.db_conn.reputations.find_one({"member_id": target_id})
+    return {
+        "upvotes": (value == UPVOTE) - (previous == UPVOTE),
+        "downvotes": (value == DOWNVOTE) - (previous == DOWNVOTE),
+        "score": value - previous,
+    }
 
-    return document.get("upvotes", []) if document is not None else []
 
+def build_decayed_score(now: float) -> dict:
+    """Builds an expression for the decayed score of a counter at the given time.
 
-async def get_downvotes(target_id: hikari.Snowflake) -> list:
-    """Gets a list of IDs for users who have downvoted the target.
+    Counters from before scores decayed start from their plain score.
 
     Arguments:
-        target_id: The ID of the user to get the downvotes of.
+        now: The current UNIX time.
 
     Returns:
-        The list of member IDs that downvoted the target.
+        The aggregation expression.
     """
-    document = await plugin.bot.d.db_conn.reputations.find_one({"member_id": target_id})
+    return build_decay_expression(
+        "decayed", "decayed_at", now, DECAY_RATE, {"$ifNull": ["$score", 0]}
+    )
 
-    return document.get("downvotes", []) if document is not None else []
 
+def build_counter_update(increments: dict, now: float) -> typing.List[dict]:
+    """Builds the update pipeline applying a vote to a member's counters.
 
-async def upvote_member(
-    voter_id: hikari.Snowflake, target_id: hikari.Snowflake
-) -> None:
-    """Updates the database to show that the voter has upvoted the target.
+    The vote counts and score are incremented. The decayed score is decayed from its
+    last update to now before the score increment is added, so it costs the same as
+    a plain increment and never requires reading the votes.
+
+    Arguments:
+        increments: The increments of the upvotes, downvotes and score counters.
+        now: The current UNIX time.
+
+    Returns:
+        The update pipeline.
+    """
+    return [
+        {
+            "$set": {
+                **{
+                    field: {"$add": [{"$ifNull": [f"${field}", 0]}, amount]}
+                    for field, amount in increments.items()
+                },
+                "decayed": {"$add": [build_decayed_score(now), increments["score"]]},
+                "decayed_at": now,
+            }
+        }
+    ]
+
+
+async def cast_vote(
+    voter_id: hikari.Snowflake,
+    target_id: hikari.Snowflake,
+    guild_id: hikari.Snowflake,
+    value: int,
+) -> bool:
+    """Records a vote for a member in a guild.
+
+    The vote replaces any vote the voter cast for the target in the guild before.
+    The previous vote is read and replaced atomically, and the difference is added
+    to the counters of the target in the guild and globally, along with their time
+    decayed scores. The counter updates are queued and made in the background, and
+    the leaderboard is updated straight away.
+
+    A vote cast before reputation was scoped by guild is replaced by the voter's
+    first vote for the target in any guild, so it isn't counted globally twice.
+
+    Arguments:
+        voter_id: The ID of the voting user.
+        target_id: The ID of the user being voted for.
+        guild_id: The ID of the guild the vote was cast in.
+        value: Either UPVOTE or DOWNVOTE.
+
+    Returns:
+        True if the vote was recorded, false if the voter had already cast it.
+    """
+    previous = await plugin.bot.d.db_conn.reputation_votes.find_one_and_update(
+        {"target_id": target_id, "guild_id": guild_id, "voter_id": voter_id},
+        {"$set": {"value": value}},
+        upsert=True,
+    )
+    previous_value = previous["value"] if previous is not None else 0
+
+    if previous_value == value:
+        return False
+
+    global_previous_value = previous_value
+
+    if previous is None:
+        legacy = await plugin.bot.d.db_conn.reputation_votes.find_one_and_delete(
+            {"target_id": target_id, "guild_id": None, "voter_id": voter_id}
+        )
+
+        if legacy is not None:
+            global_previous_value = legacy["value"]
+
+    now = time.time()
+    increments = get_counter_increments(previous_value, value)
+    global_increments = get_counter_increments(global_previous_value, value)
+
+    for counter_guild_id, counter_increments in (
+        (guild_id, increments),
+        (None, global_increments),
+    ):
+        await writebehind.queue.submit(
+            "reputation_counters",
+            {
+                "update_one": {
+                    "filter": {"member_id": target_id, "guild_id": counter_guild_id},
+                    "update": build_counter_update(counter_increments, now),
+                    "upsert": True,
+                }
+            },
+        )
+
+    leaderboard.update(
+        target_id, (leaderboard.score(target_id) or 0) + global_increments["score"]
+    )
 
-    Pulls the voter ID from the array of IDs for users who have downvoted the target
-    and pushes it to the array of users who have upvoted.
+    return True
+
+
+async def count_global_votes(target_id: hikari.Snowflake) -> dict:
+    """Counts the votes for a member across every guild from the vote log.
 
     Arguments:
-        voter_id: The ID of the voting users.
-        target_id: The ID of the user getting upvoted.
+        target_id: The ID of the member.
+
+    Returns:
+        The upvotes, downvotes and score of the member.
+    """
+    votes = plugin.bot.d.db_conn.reputation_votes
+    upvotes = await votes.count_documents({"target_id": target_id, "value": UPVOTE})
+    downvotes = await votes.count_documents({"target_id": target_id, "value": DOWNVOTE})
+
+    return {"upvotes": upvotes, "downvotes": downvotes, "score": upvotes - downvotes}
+
+
+@startup.jobs.register("Reputation", startup.HIGH)
+async def migrate_reputations() -> None:
+    """Moves votes from the old per member documents into the vote log.
+
+    Votes cast before reputation was scoped by guild have no guild, so they only
+    count towards global reputation until the voter votes for the member in a guild,
+    which replaces them. The global counters of each migrated member are recounted
+    from the log, so the migration can be rerun if it is interrupted.
+
+    Returns:
+        None.
+    """
+    database = plugin.bot.d.db_conn
+
+    async for document in database.reputations.find({}):
+        target_id = document["member_id"]
+        requests = [
+            UpdateOne(
+                {"target_id": target_id, "guild_id": None, "voter_id": voter_id},
+                {"$setOnInsert": {"value": value}},
+                upsert=True,
+            )
+            for field, value in (("upvotes", UPVOTE), ("downvotes", DOWNVOTE))
+            for voter_id in document.get(field, [])
+        ]
+
+        if requests:
+            await database.reputation_votes.bulk_write(requests, ordered=False)
+
+        if writebehind.queue.has_pending("reputation_counters"):
+            await writebehind.queue.flush("reputation_counters")
+
+        await database.reputation_counters.update_one(
+            {"member_id": target_id, "guild_id": None},
+            {"$set": await count_global_votes(target_id)},
+            upsert=True,
+        )
+        await database.reputations.delete_one({"_id": document["_id"]})
+
+
+async def reconcile_leaderboard() -> None:
+    """Rebuilds the leaderboard from the global counters in the database.
+
+    Queued counter updates are written first so they aren't lost from the
+    leaderboard.
 
     Returns:
         None.
     """
-    plugin.bot.d.db_conn.reputations.update_one(
-        {"member_id": target_id},
-        {"$pull": {"downvotes": voter_id}},
+    counters = plugin.bot.d.db_conn.reputation_counters
+
+    if writebehind.queue.has_pending("reputation_counters"):
+        await writebehind.queue.flush("reputation_counters")
+
+    cursor = counters.find(
+        {"guild_id": None}, {"_id": 0, "member_id": 1, "score": 1}
+    ).sort("score", -1)
+    leaderboard.load(
+        [(document["member_id"], document["score"]) async for document in cursor]
     )
 
-    plugin.bot.d.db_conn.reputations.update_one(
-        {"member_id": target_id},
-        {"$push": {"upvotes": voter_id}},
-        upsert=True,
+
+@scheduler.handler("Reputation", "reputation.reconcile_leaderboard")
+async def run_leaderboard_reconcile(payload: typing.Any) -> None:
+    """Rebuilds the leaderboard of this worker. Run as a scheduled job.
+
+    Arguments:
+        payload: Unused.
+
+    Returns:
+        None.
+    """
+    await reconcile_leaderboard()
+
+
+@startup.jobs.register("Reputation", startup.HIGH)
+async def load_leaderboard() -> None:
+    """Loads the leaderboard and schedules reconciling it periodically.
+
+    The leaderboard of each worker is only updated by the votes it handles, so each
+    worker rebuilds its own leaderboard from the database at the interval set in the
+    [LEADERBOARD] section of the config file.
+
+    Returns:
+        None.
+    """
+    await reconcile_leaderboard()
+
+    interval = config.getfloat(
+        "LEADERBOARD", "RECONCILE_INTERVAL", fallback=DEFAULT_RECONCILE_INTERVAL
+    )
+    worker = plugin.bot.d.worker or 0
+
+    await scheduler.schedule(
+        "reputation.reconcile_leaderboard",
+        interval,
+        key=f"worker-{worker}",
+        interval=interval,
+        jitter=interval * 0.1,
+        worker=worker,
     )
 
 
-async def downvote_member(
-    voter_id: hikari.Snowflake, target_id: hikari.Snowflake
-) -> None:
-    """Updates the database to show that the voter has downvoted the target.
+async def renormalize_decayed_scores() -> None:
+    """Decays every stored decayed score that hasn't been updated recently to now.
+
+    Decayed scores are only decayed when a vote updates them, so stored values of
+    members who haven't been voted for in a while are stale. Bringing them up to date
+    keeps the stored values comparable, and gives counters from before scores
+    decayed their first decayed score.
 
-    Pulls the voter ID from the array of IDs for users who have upvoted the target and
-    pushes it to the array of users who have downvoted.
+    Returns:
+        None.
+    """
+    now = time.time()
+    interval = config.getfloat(
+        "REPUTATION", "RENORMALIZE_INTERVAL", fallback=DEFAULT_RENORMALIZE_INTERVAL
+    )
+
+    if writebehind.queue.has_pending("reputation_counters"):
+        await writebehind.queue.flush("reputation_counters")
+
+    await plugin.bot.d.db_conn.reputation_counters.update_many(
+        {
+            "$or": [
+                {"decayed_at": {"$lt": now - interval}},
+                {"decayed_at": {"$exists": False}},
+            ]
+        },
+        [{"$set": {"decayed": build_decayed_score(now), "decayed_at": now}}],
+    )
+
+
+@scheduler.handler("Reputation", "reputation.renormalize")
+async def run_renormalize(payload: typing.Any) -> None:
+    """Renormalizes decayed scores. Run as a scheduled job.
 
     Arguments:
-        voter_id: The ID of the voting user.
-        target_id: The ID of the user getting downvoted.
+        payload: Unused.
 
     Returns:
         None.
     """
-    plugin.bot.d.db_conn.reputations.update_one(
-        {"member_id": target_id},
-        {"$pull": {"upvotes": voter_id}},
+    await renormalize_decayed_scores()
+
+
+@startup.jobs.register("Reputation", startup.LOW)
+async def schedule_renormalizing() -> None:
+    """Schedules renormalizing decayed scores at the configured interval.
+
+    The job is shared by every worker. The interval is set in the [REPUTATION]
+    section of the config file.
+
+    Returns:
+        None.
+    """
+    interval = config.getfloat(
+        "REPUTATION", "RENORMALIZE_INTERVAL", fallback=DEFAULT_RENORMALIZE_INTERVAL
     )
 
-    plugin.bot.d.db_conn.reputations.update_one(
-        {"member_id": target_id},
-        {"$push": {"downvotes": voter_id}},
-        upsert=True,
+    await scheduler.schedule(
+        "reputation.renormalize", key="renormalize", interval=interval
     )
 
 
@@ -114,12 +473,18 @@ async def upvote(
         await error_response(context, "You cannot vote for yourself.")
         return
 
-    # Check if the target has already been upvoted by the author
-    if voter_member.id in await get_upvotes(target_member.id):
+    # Refuse the vote before touching the database if it is rate limited
+    reason = check_vote_limits(voter_member.id, target_member.id, context.guild_id)
+
+    if reason is not None:
+        await error_response(context, reason)
+        return
+
+    # Record the vote unless the author has already upvoted the target
+    if not await cast_vote(voter_member.id, target_member.id, context.guild_id, UPVOTE):
         await error_response(context, "You have already upvoted that member.")
         return
 
-    await upvote_member(voter_member.id, target_member.id)
     await info_response(
         context, "Member upvoted", f"You have upvoted {target_member.mention}"
     )
@@ -149,17 +514,72 @@ async def downvote(
         await error_response(context, "You cannot vote for yourself.")
         return
 
-    # Check if the target has already been downvoted by the author
-    if voter_member.id in await get_downvotes(target_member.id):
+    # Refuse the vote before touching the database if it is rate limited
+    reason = check_vote_limits(voter_member.id, target_member.id, context.guild_id)
+
+    if reason is not None:
+        await error_response(context, reason)
+        return
+
+    # Record the vote unless the author has already downvoted the target
+    if not await cast_vote(
+        voter_member.id, target_member.id, context.guild_id, DOWNVOTE
+    ):
         await error_response(context, "You have already downvoted that member.")
         return
 
-    await downvote_member(voter_member.id, target_member.id)
     await info_response(
         context, "Member downvoted", f"You have downvoted {target_member.mention}"
     )
 
 
+@plugin.command
+@lightbulb.option(
+    "page", "The page of the leaderboard to view", type=int, required=False, min_value=1
+)
+@lightbulb.command("leaderboard", "Displays the members with the best reputation")
+@lightbulb.implements(lightbulb.SlashCommand, lightbulb.PrefixCommand)
+async def leaderboard_command(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Displays a page of the reputation leaderboard and the rank of the author.
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    page = max(context.options.page or 1, 1)
+    pages = max(math.ceil(len(leaderboard) / LEADERBOARD_PAGE_SIZE), 1)
+
+    if page > pages:
+        await error_response(context, "That page of the leaderboard doesn't exist.")
+        return
+
+    entries = leaderboard.page(
+        (page - 1) * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE
+    )
+    lines = [
+        f"**#{rank}** <@{member_id}> `{score:+d}`" for rank, member_id, score in entries
+    ]
+
+    leaderboard_embed = create_info_embed(
+        "Global reputation leaderboard",
+        "\n".join(lines) or "Nobody has been voted for yet.",
+        context.app.get_me().avatar_url,
+    )
+
+    rank = leaderboard.rank(context.author.id)
+
+    if rank is None:
+        leaderboard_embed.set_footer(f"Page {page} of {pages} | You are not ranked yet")
+    else:
+        leaderboard_embed.set_footer(f"Page {page} of {pages} | Your rank is #{rank}")
+
+    await context.respond(embed=leaderboard_embed)
+
+
 def load(bot: lightbulb.BotApp) -> None:
     """Loads the 'Reputation' plugin. Called when extension is loaded.
 
@@ -169,4 +589,5 @@ def load(bot: lightbulb.BotApp) -> None:
     Returns:
         None.
     """
+    instrument_plugin(plugin)
     bot.add_plugin(plugin)
@@ -0,0 +1,328 @@
+import hikari
+import lightbulb
+import time
+import typing
+
+from bot import config
+from utils import lifecycle, schema, startup, writebehind
+from utils.metrics import instrument_plugin
+from utils.responses import create_info_embed, error_response
+from utils.rest import lookups
+from utils.rollups import RollupAggregator, get_period_start, to_datetime
+from utils.scheduler import scheduler
+from utils.sessions import SessionTracker, get_duration_string
+from utils.sharding import owns_guild
+
+
+plugin = lightbulb.Plugin("Stats")
+
+INTENTS = hikari.Intents.GUILD_MESSAGES | hikari.Intents.GUILD_VOICE_STATES
+CACHE_COMPONENTS = hikari.api.CacheComponents.VOICE_STATES
+
+# Member joins and leaves are only sent with the privileged members intent
+MEMBER_EVENTS = config.getboolean("STATS", "MEMBER_EVENTS", fallback=False)
+
+if MEMBER_EVENTS:
+    INTENTS |= hikari.Intents.GUILD_MEMBERS
+
+schema.register_index("guild_stats", ["guild_id", "period", "start"], unique=True)
+schema.register_index("guild_stats", ["expires_at"], expireAfterSeconds=0)
+schema.register_query("guild_stats", {"guild_id": 0, "period": ""})
+
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+# The rollup period read for each range and the number of periods in the range
+RANGES = {
+    "day": ("hour", 3600, 24),
+    "week": ("day", 86400, 7),
+    "month": ("day", 86400, 30),
+}
+
+# Activity of the guilds served by this process which hasn't been flushed yet
+aggregator = RollupAggregator()
+voice_sessions = SessionTracker()
+
+
+def collect_voice_time() -> None:
+    """Counts the time spent in ongoing voice sessions so far.
+
+    Returns:
+        None.
+    """
+    for (guild_id, _), seconds in voice_sessions.collect().items():
+        aggregator.add(guild_id, "voice_seconds", seconds)
+
+
+async def flush_stats() -> None:
+    """Queues the writes adding the counted activity to the rollups.
+
+    Returns:
+        None.
+    """
+    collect_voice_time()
+
+    for operation in aggregator.build_writes():
+        await writebehind.queue.submit("guild_stats", operation)
+
+
+lifecycle.manager.on_drain(flush_stats)
+
+
+@scheduler.handler("Stats", "stats.flush")
+async def run_stats_flush(payload: typing.Any) -> None:
+    """Flushes the activity counted by this worker. Run as a scheduled job.
+
+    Arguments:
+        payload: Unused.
+
+    Returns:
+        None.
+    """
+    await flush_stats()
+
+
+@plugin.listener(hikari.StartedEvent)
+async def schedule_flushing(event: hikari.StartedEvent) -> None:
+    """Schedules flushing the counted activity of this worker periodically.
+
+    The interval is set in the [STATS] section of the config file.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    interval = config.getfloat(
+        "STATS", "FLUSH_INTERVAL", fallback=DEFAULT_FLUSH_INTERVAL
+    )
+    worker = plugin.bot.d.worker or 0
+
+    await scheduler.schedule(
+        "stats.flush",
+        interval,
+        key=f"worker-{worker}",
+        interval=interval,
+        worker=worker,
+    )
+
+
+@plugin.listener(hikari.GuildAvailableEvent)
+async def recover_voice_sessions(event: hikari.GuildAvailableEvent) -> None:
+    """Starts sessions for members who are already in a voice channel of a guild.
+
+    Sessions of members who left while the bot was disconnected are dropped.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    voice_states = plugin.bot.cache.get_voice_states_view_for_guild(event.guild_id)
+
+    for key in [key for key in voice_sessions if key[0] == event.guild_id]:
+        if key[1] not in voice_states:
+            voice_sessions.end(key)
+
+    for user_id, voice_state in voice_states.items():
+        if voice_state.member is not None and voice_state.member.is_bot:
+            continue
+
+        voice_sessions.start((event.guild_id, user_id))
+
+
+@plugin.listener(hikari.GuildMessageCreateEvent)
+async def on_message(event: hikari.GuildMessageCreateEvent) -> None:
+    """Counts a message sent by a member.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    if event.is_human:
+        aggregator.add(event.guild_id, "messages")
+
+
+async def on_member_join(event: hikari.MemberCreateEvent) -> None:
+    """Counts a member joining.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    aggregator.add(event.guild_id, "joins")
+
+
+async def on_member_leave(event: hikari.MemberDeleteEvent) -> None:
+    """Counts a member leaving.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    aggregator.add(event.guild_id, "leaves")
+
+
+if MEMBER_EVENTS:
+    plugin.listener(hikari.MemberCreateEvent, on_member_join)
+    plugin.listener(hikari.MemberDeleteEvent, on_member_leave)
+
+
+@plugin.listener(hikari.VoiceStateUpdateEvent)
+async def on_voice_state_update(event: hikari.VoiceStateUpdateEvent) -> None:
+    """Starts or ends the voice session of a member.
+
+    Moving between channels keeps the session going.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    voice_state = event.state
+
+    if voice_state.member is not None and voice_state.member.is_bot:
+        return
+
+    key = (voice_state.guild_id, voice_state.user_id)
+
+    if voice_state.channel_id is None:
+        aggregator.add(voice_state.guild_id, "voice_seconds", voice_sessions.end(key))
+    else:
+        voice_sessions.start(key)
+
+
+@startup.jobs.register("Stats", startup.LOW)
+async def purge_guild_documents() -> None:
+    """Removes stats of any guild the bot is no longer a part of.
+
+    Only guilds served by this process are checked.
+
+    Returns:
+        None.
+    """
+    guild_stats = plugin.bot.d.db_conn.guild_stats
+
+    for guild_id in await guild_stats.distinct("guild_id"):
+        if not owns_guild(plugin.bot, guild_id):
+            continue
+
+        try:
+            await lookups.fetch_guild(guild_id, "stats.purge_guild_documents")
+        except hikari.NotFoundError:
+            await guild_stats.delete_many({"guild_id": guild_id})
+
+
+@plugin.listener(hikari.GuildLeaveEvent)
+async def delete_guild_documents(event: hikari.GuildLeaveEvent) -> None:
+    """Deletes the stats of a guild when the bot leaves it.
+
+    Arguments:
+        event: The event that was fired.
+
+    Returns:
+        None.
+    """
+    aggregator.discard(event.guild_id)
+    await plugin.bot.d.db_conn.guild_stats.delete_many({"guild_id": event.guild_id})
+
+
+async def get_guild_stats(
+    guild_id: hikari.Snowflake, period: str, length: int, count: int
+) -> typing.Counter[str]:
+    """Adds up the rollups of a guild over a number of periods.
+
+    The rollups of the current period and the ones before it are read, along with
+    activity which hasn't been written yet.
+
+    Arguments:
+        guild_id: The ID of the guild.
+        period: The name of the rollup period to read.
+        length: The length of the period in seconds.
+        count: The number of periods to add up.
+
+    Returns:
+        The total of each metric.
+    """
+    if writebehind.queue.has_pending("guild_stats"):
+        await writebehind.queue.flush("guild_stats")
+
+    since = get_period_start(length, time.time()) - length * (count - 1)
+    totals = aggregator.pending(guild_id)
+
+    async for document in plugin.bot.d.db_read_conn.guild_stats.find(
+        {"guild_id": guild_id, "period": period, "start": {"$gte": to_datetime(since)}},
+        {"_id": 0, "messages": 1, "joins": 1, "leaves": 1, "voice_seconds": 1},
+    ):
+        totals.update(document)
+
+    return totals
+
+
+@plugin.command
+@lightbulb.add_checks(lightbulb.guild_only)
+@lightbulb.option(
+    "range",
+    "How far back to look",
+    choices=list(RANGES),
+    required=False,
+    default="day",
+)
+@lightbulb.command("stats", "Displays the activity of the server")
+@lightbulb.implements(lightbulb.SlashCommand, lightbulb.PrefixCommand)
+async def stats(
+    context: typing.Union[lightbulb.SlashContext, lightbulb.PrefixContext]
+) -> None:
+    """Displays the activity of the guild over the last day, week or month.
+
+    Called when a user uses /stats [range]
+
+    Arguments:
+        context: The context for the command.
+
+    Returns:
+        None.
+    """
+    stats_range = context.options.range
+
+    if stats_range not in RANGES:
+        await error_response(context, "The range must be a day, week or month.")
+        return
+
+    totals = await get_guild_stats(context.guild_id, *RANGES[stats_range])
+
+    stats_embed = create_info_embed(
+        "Server stats",
+        f"Here is the activity of the server over the last {stats_range}",
+        context.app.get_me().avatar_url,
+    )
+
+    stats_embed.add_field("Messages", int(totals["messages"]), inline=True)
+    stats_embed.add_field("Members joined", int(totals["joins"]), inline=True)
+    stats_embed.add_field("Members left", int(totals["leaves"]), inline=True)
+    stats_embed.add_field(
+        "Voice time", get_duration_string(totals["voice_seconds"]), inline=True
+    )
+
+    await context.respond(embed=stats_embed)
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    """Loads the 'Stats' plugin. Called when extension is loaded.
+
+    Arguments:
+        bot: The bot application to add the plugin to.
+
+    Returns:
+        None.
+    """
+    instrument_plugin(plugin)
+    bot.add_plugin(plugin)
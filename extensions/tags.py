@@ -2,7 +2,14 @@ import hikari
 import lightbulb
 import typing
 
+from bot import config
+from utils import schema, startup, writebehind
+from utils.cache import DEFAULT_TTL, MISSING, GuildCache
+from utils.invalidation import bus, marker
+from utils.metrics import instrument_plugin
 from utils.responses import create_info_embed, info_response, error_response
+from utils.rest import lookups
+from utils.sharding import owns_guild
 from datetime import datetime, timezone
 from hikari.messages import ButtonStyle
 from lightbulb.utils.permissions import permissions_for
@@ -17,6 +24,17 @@ from lightbulb.utils.nav import (
 
 plugin = lightbulb.Plugin("Tags")
 
+schema.register_index("tags", ["guild_id"])
+schema.register_query("tags", {"guild_id": 0})
+schema.register_query("tags", {"guild_id": 0, "tags.name": ""})
+
+# Tag documents of the guilds served by this process, keyed by tag name
+tag_cache = GuildCache(
+    config.getfloat("CACHE", "TTL", fallback=DEFAULT_TTL),
+    lambda guild_id: owns_guild(plugin.bot, guild_id),
+)
+bus.subscribe("tags", tag_cache.apply_invalidation)
+
 
 async def guild_has_tags(
     tag_author: hikari.User,
@@ -36,7 +54,7 @@ async def guild_has_tags(
         True if the query retrieved at least one document, false if otherwise.
     """
     if tag_author is None:
-        cursor = plugin.bot.d.db_conn.tags.aggregate(
+        cursor = plugin.bot.d.db_read_conn.tags.aggregate(
             [
                 {"$match": {"guild_id": tag_guild.id}},
                 {"$unwind": "$tags"},
@@ -44,7 +62,7 @@ async def guild_has_tags(
             ]
         )
     else:
-        cursor = plugin.bot.d.db_conn.tags.aggregate(
+        cursor = plugin.bot.d.db_read_conn.tags.aggregate(
             [
                 {"$match": {"guild_id": tag_guild.id}},
                 {"$unwind": "$tags"},
@@ -101,7 +119,7 @@ async def paginate_all_tags(
             {"$match": {"tags.author_id": tag_author.id}},
         ]
 
-    async for document in plugin.bot.d.db_conn.tags.aggregate(pipeline):
+    async for document in plugin.bot.d.db_read_conn.tags.aggregate(pipeline):
         tag_name = document["tags"]["name"]
         paginator.add_line(f"• {tag_name}")
 
@@ -113,6 +131,7 @@ async def get_tag(tag_name: str, tag_guild: hikari.GatewayGuild) -> dict:
 
     Query the database for a tag in the specified guild with the specified tag name. If
     a document is found, return the document itself from the list of queried documents.
+    The result of the query is cached, including when the tag doesn't exist.
 
     Arguments:
         tag_name: The name of the tag to find.
@@ -121,6 +140,11 @@ async def get_tag(tag_name: str, tag_guild: hikari.GatewayGuild) -> dict:
     Returns:
         The document of the tag if it exists, otherwise None.
     """
+    document = tag_cache.get(tag_guild.id, tag_name)
+
+    if document is not MISSING:
+        return document
+
     cursor = plugin.bot.d.db_conn.tags.aggregate(
         [
             {"$match": {"guild_id": tag_guild.id}},
@@ -130,11 +154,10 @@ async def get_tag(tag_name: str, tag_guild: hikari.GatewayGuild) -> dict:
         ]
     )
     documents = await cursor.to_list(length=1)
+    document = documents[0] if documents != [] else None
+    tag_cache.set(tag_guild.id, tag_name, document)
 
-    if documents != []:
-        return documents[0]
-
-    return None
+    return document
 
 
 async def create_tag(
@@ -172,10 +195,12 @@ async def create_tag(
                     "modified_at": creation_time,
                     "uses": 0,
                 }
-            }
+            },
+            "$set": marker(tag_name),
         },
         upsert=True,
     )
+    bus.publish("tags", tag_guild.id, tag_name)
 
 
 async def delete_tag(tag_name: str, tag_guild: hikari.GatewayGuild) -> None:
@@ -191,8 +216,10 @@ async def delete_tag(tag_name: str, tag_guild: hikari.GatewayGuild) -> None:
         None.
     """
     await plugin.bot.d.db_conn.tags.update_one(
-        {"guild_id": tag_guild.id}, {"$pull": {"tags": {"name": tag_name}}}
+        {"guild_id": tag_guild.id},
+        {"$pull": {"tags": {"name": tag_name}}, "$set": marker(tag_name)},
     )
+    bus.publish("tags", tag_guild.id, tag_name)
 
 
 async def edit_tag(
@@ -216,15 +243,24 @@ async def edit_tag(
 
     await plugin.bot.d.db_conn.tags.update_one(
         {"guild_id": tag_guild.id, "tags.name": tag_name},
-        {"$set": {"tags.$.content": tag_content, "tags.$.modified_at": edit_time}},
+        {
+            "$set": {
+                "tags.$.content": tag_content,
+                "tags.$.modified_at": edit_time,
+                **marker(tag_name),
+            }
+        },
     )
+    bus.publish("tags", tag_guild.id, tag_name)
 
 
 async def increment_tag(tag_name: str, tag_guild: hikari.GatewayGuild) -> None:
     """Increments the number of uses of a tag in a guild by one.
 
     Updates a document with the specified tag name from the guild document tags list by
-    incrementing the uses of the tag has been used by 1.
+    incrementing the uses of the tag has been used by 1. The write is queued and made
+    in the background, and the cached tag is updated in place so showing a tag
+    doesn't invalidate it.
 
     Arguments:
         tag_name: The name of the tag to increment.
@@ -233,10 +269,21 @@ async def increment_tag(tag_name: str, tag_guild: hikari.GatewayGuild) -> None:
     Returns:
         None.
     """
-    await plugin.bot.d.db_conn.tags.update_one(
-        {"guild_id": tag_guild.id, "tags.name": tag_name}, {"$inc": {"tags.$.uses": 1}}
+    await writebehind.queue.submit(
+        "tags",
+        {
+            "update_one": {
+                "filter": {"guild_id": tag_guild.id, "tags.name": tag_name},
+                "update": {"$inc": {"tags.$.uses": 1}},
+            }
+        },
     )
 
+    document = tag_cache.get(tag_guild.id, tag_name, None)
+
+    if document is not None:
+        document["tags"]["uses"] += 1
+
 
 async def extract_tag_details(tag_document: dict) -> dict:
     """Pull all data about a tag from a document.
@@ -258,7 +305,7 @@ async def extract_tag_details(tag_document: dict) -> dict:
     modified_at_formatted = modified_at_str.strftime("%b %d, %Y")
 
     data = {
-        "author": await plugin.bot.rest.fetch_user(author_id),
+        "author": await lookups.fetch_user(author_id, "tags.extract_tag_details"),
         "uses": tag_document["tags"]["uses"],
         "created_at": created_at_formatted,
         "modified_at": modified_at_formatted,
@@ -267,25 +314,28 @@ async def extract_tag_details(tag_document: dict) -> dict:
     return data
 
 
-@plugin.listener(hikari.StartedEvent)
-async def purge_guild_documents(event: hikari.StartedEvent) -> None:
+@startup.jobs.register("Tags", startup.LOW)
+async def purge_guild_documents() -> None:
     """Removes data of any guild the bot is no longer a part of.
 
-    Arguments:
-        event: The event that was fired.
+    Only guilds served by this process are checked.
 
     Returns:
         None.
     """
     tags_cursor = plugin.bot.d.db_conn.tags
 
-    async for document in tags_cursor.find({}):
+    async for document in tags_cursor.find({}, {"guild_id": 1}):
         guild_id = document["guild_id"]
 
+        if not owns_guild(plugin.bot, guild_id):
+            continue
+
         try:
-            await plugin.bot.rest.fetch_guild(guild_id)
+            await lookups.fetch_guild(guild_id, "tags.purge_guild_documents")
         except:
             await tags_cursor.delete_one({"guild_id": guild_id})
+            bus.publish("tags", guild_id)
 
 
 @plugin.listener(hikari.GuildLeaveEvent)
@@ -299,6 +349,7 @@ async def delete_guild_document(event: hikari.GuildLeaveEvent) -> None:
         None.
     """
     await plugin.bot.d.db_conn.tags.delete_one({"guild_id": event.guild_id})
+    bus.publish("tags", event.guild_id)
 
 
 @plugin.command
@@ -564,4 +615,5 @@ def load(bot: lightbulb.BotApp) -> None:
     Returns:
         None.
     """
+    instrument_plugin(plugin)
     bot.add_plugin(plugin)
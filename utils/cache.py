@@ -0,0 +1,110 @@
+import time
+import typing
+
+DEFAULT_TTL = 300.0
+
+MISSING = object()
+
+
+class GuildCache:
+    """An in-memory cache of values partitioned by guild.
+
+    Entries expire after a fixed time to live. When a predicate is given, values for
+    guilds it rejects are never stored, so a process running a subset of the shards
+    only holds data for the guilds it serves.
+
+    Arguments:
+        ttl: The number of seconds an entry stays valid for.
+        owns_guild: Returns whether values for a guild ID should be cached.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        owns_guild: typing.Optional[typing.Callable[[int], bool]] = None,
+    ) -> None:
+        self.ttl = ttl
+        self._owns_guild = owns_guild
+        self._guilds: typing.Dict[int, typing.Dict[typing.Any, tuple]] = {}
+
+    def get(self, guild_id: int, key: typing.Any, default: typing.Any = MISSING):
+        """Gets a cached value.
+
+        Arguments:
+            guild_id: The ID of the guild the value belongs to.
+            key: The key of the value.
+            default: The value to return if there is no valid entry.
+
+        Returns:
+            The cached value, or the default if it is missing or expired.
+        """
+        entries = self._guilds.get(guild_id)
+
+        if entries is None or key not in entries:
+            return default
+
+        value, expires_at = entries[key]
+
+        if expires_at < time.monotonic():
+            del entries[key]
+            return default
+
+        return value
+
+    def set(self, guild_id: int, key: typing.Any, value: typing.Any) -> None:
+        """Caches a value.
+
+        Arguments:
+            guild_id: The ID of the guild the value belongs to.
+            key: The key of the value.
+            value: The value to cache.
+
+        Returns:
+            None.
+        """
+        if self._owns_guild is not None and not self._owns_guild(guild_id):
+            return
+
+        entries = self._guilds.setdefault(guild_id, {})
+        entries[key] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self, guild_id: int, key: typing.Any = MISSING) -> None:
+        """Removes a cached value, or every value of a guild if no key is given.
+
+        Arguments:
+            guild_id: The ID of the guild.
+            key: The key of the value to remove.
+
+        Returns:
+            None.
+        """
+        if key is MISSING:
+            self._guilds.pop(guild_id, None)
+        elif guild_id in self._guilds:
+            self._guilds[guild_id].pop(key, None)
+
+    def clear(self) -> None:
+        """Removes every cached value."""
+        self._guilds.clear()
+
+    def apply_invalidation(
+        self, guild_id: typing.Optional[int], key: typing.Optional[typing.Any]
+    ) -> None:
+        """Applies an invalidation received from the invalidation bus.
+
+        Arguments:
+            guild_id: The ID of the guild that changed, or None for every guild.
+            key: The key that changed, or None for every key of the guild.
+
+        Returns:
+            None.
+        """
+        if guild_id is None:
+            self.clear()
+        elif key is None:
+            self.invalidate(guild_id)
+        else:
+            self.invalidate(guild_id, key)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._guilds.values())
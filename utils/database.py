@@ -0,0 +1,183 @@
+import configparser
+import threading
+import time
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.read_preferences import SecondaryPreferred
+
+DATABASE_NAME = "campfire"
+
+DEFAULT_MIN_POOL_SIZE = 0
+DEFAULT_MAX_POOL_SIZE = 50
+DEFAULT_WAIT_QUEUE_TIMEOUT = 2.0
+DEFAULT_SERVER_SELECTION_TIMEOUT = 5.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_OPERATION_TIMEOUT = 10.0
+DEFAULT_COMPRESSORS = "zstd,snappy,zlib"
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Records how long operations wait to check a connection out of the pool.
+
+    Motor runs pymongo operations on executor threads, and a checkout is always
+    started and finished on the same thread, so the start time of the checkout in
+    progress is kept in thread local storage.
+
+    Attributes:
+        checkouts: The number of successful connection checkouts.
+        failures: The number of checkouts that failed or timed out.
+        total_wait: The total time spent waiting for checkouts in seconds.
+        max_wait: The longest time spent waiting for a single checkout in seconds.
+        open_connections: The number of connections currently open.
+    """
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.open_connections = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _elapsed(self) -> float:
+        """Returns the time since the current thread started its checkout."""
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event) -> None:
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event) -> None:
+        wait = self._elapsed()
+
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_check_out_failed(self, event) -> None:
+        wait = self._elapsed()
+
+        with self._lock:
+            self.failures += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event) -> None:
+        with self._lock:
+            self.open_connections -= 1
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_checked_in(self, event) -> None:
+        pass
+
+    def snapshot(self) -> dict:
+        """Returns the current pool checkout statistics.
+
+        Returns:
+            A dictionary of the checkout counts and wait times.
+        """
+        with self._lock:
+            attempts = self.checkouts + self.failures
+            return {
+                "checkouts": self.checkouts,
+                "failures": self.failures,
+                "open_connections": self.open_connections,
+                "total_wait": self.total_wait,
+                "average_wait": self.total_wait / attempts if attempts else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+def get_client_options(config: configparser.ConfigParser) -> dict:
+    """Builds the motor client keyword arguments from the config file.
+
+    Values are read from the optional [DATABASE] section. Timeouts are configured in
+    seconds and converted to the milliseconds expected by pymongo. Any compressor
+    that isn't installed is dropped by pymongo with a warning.
+
+    Arguments:
+        config: The parsed config file.
+
+    Returns:
+        The keyword arguments to create the client with.
+    """
+    section = "DATABASE"
+
+    def seconds(option: str, default: float) -> int:
+        return int(config.getfloat(section, option, fallback=default) * 1000)
+
+    return {
+        "minPoolSize": config.getint(
+            section, "MIN_POOL_SIZE", fallback=DEFAULT_MIN_POOL_SIZE
+        ),
+        "maxPoolSize": config.getint(
+            section, "MAX_POOL_SIZE", fallback=DEFAULT_MAX_POOL_SIZE
+        ),
+        "waitQueueTimeoutMS": seconds("WAIT_QUEUE_TIMEOUT", DEFAULT_WAIT_QUEUE_TIMEOUT),
+        "serverSelectionTimeoutMS": seconds(
+            "SERVER_SELECTION_TIMEOUT", DEFAULT_SERVER_SELECTION_TIMEOUT
+        ),
+        "connectTimeoutMS": seconds("CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+        "socketTimeoutMS": seconds("OPERATION_TIMEOUT", DEFAULT_OPERATION_TIMEOUT),
+        "compressors": config.get(section, "COMPRESSORS", fallback=DEFAULT_COMPRESSORS),
+    }
+
+
+def create_database_client(
+    config: configparser.ConfigParser,
+    event_listeners: typing.Sequence[monitoring._EventListener],
+) -> AsyncIOMotorClient:
+    """Creates a database client configured from the config file.
+
+    Arguments:
+        config: The parsed config file.
+        event_listeners: The listeners to report pool and command events to.
+
+    Returns:
+        The created database client.
+    """
+    return AsyncIOMotorClient(
+        config.get("BOT", "DATABASE_URI"),
+        event_listeners=list(event_listeners),
+        **get_client_options(config),
+    )
+
+
+def get_read_database(client: AsyncIOMotorClient):
+    """Gets a database handle that prefers secondaries for read only queries.
+
+    Reads made through this handle may be slightly stale, so it should only be used
+    for display paths such as listing tags or rendering profiles. Deployments without
+    secondaries fall back to reading from the primary.
+
+    Arguments:
+        client: The database client.
+
+    Returns:
+        The database handle.
+    """
+    return client.get_database(DATABASE_NAME, read_preference=SecondaryPreferred())
@@ -0,0 +1,78 @@
+import configparser
+import math
+import typing
+
+DEFAULT_HALF_LIFE_DAYS = 90.0
+
+
+def get_decay_rate(half_life: float) -> float:
+    """Gets the exponential decay rate for a half life.
+
+    Arguments:
+        half_life: The number of seconds it takes a value to halve.
+
+    Returns:
+        The decay rate per second.
+    """
+    return math.log(2) / half_life
+
+
+def get_reputation_decay_rate(config: configparser.ConfigParser) -> float:
+    """Gets the decay rate of reputation scores from the config file.
+
+    The half life is read in days from the optional [REPUTATION] section.
+
+    Arguments:
+        config: The parsed config file.
+
+    Returns:
+        The decay rate per second.
+    """
+    half_life_days = config.getfloat(
+        "REPUTATION", "HALF_LIFE_DAYS", fallback=DEFAULT_HALF_LIFE_DAYS
+    )
+
+    return get_decay_rate(half_life_days * 86400)
+
+
+def decay(value: float, updated_at: float, now: float, rate: float) -> float:
+    """Decays a stored value to the current time.
+
+    Arguments:
+        value: The value when it was last updated.
+        updated_at: The UNIX time the value was last updated.
+        now: The current UNIX time.
+        rate: The decay rate per second.
+
+    Returns:
+        The decayed value.
+    """
+    return value * math.exp(-rate * max(now - updated_at, 0))
+
+
+def build_decay_expression(
+    field: str, timestamp_field: str, now: float, rate: float, initial: typing.Any = 0
+) -> dict:
+    """Builds an aggregation expression decaying a stored value to the current time.
+
+    Arguments:
+        field: The field holding the value.
+        timestamp_field: The field holding the UNIX time the value was last updated.
+        now: The current UNIX time.
+        rate: The decay rate per second.
+        initial: The value to use if the field doesn't exist yet. Can be an
+            expression.
+
+    Returns:
+        The expression evaluating to the decayed value.
+    """
+    elapsed = {
+        "$max": [0, {"$subtract": [now, {"$ifNull": [f"${timestamp_field}", now]}]}]
+    }
+
+    return {
+        "$multiply": [
+            {"$ifNull": [f"${field}", initial]},
+            {"$exp": {"$multiply": [-rate, elapsed]}},
+        ]
+    }
@@ -0,0 +1,214 @@
+import configparser
+import hikari
+import itertools
+import logging
+import sys
+import types
+import typing
+
+from hikari.events import base_events
+from hikari.impl import config as config_impl
+
+logger = logging.getLogger(__name__)
+
+# Needed by the bot itself: guild events, prefix commands and permission checks
+BASE_INTENTS = (
+    hikari.Intents.GUILDS | hikari.Intents.GUILD_MESSAGES | hikari.Intents.DM_MESSAGES
+)
+BASE_CACHE_COMPONENTS = (
+    hikari.api.CacheComponents.GUILDS
+    | hikari.api.CacheComponents.GUILD_CHANNELS
+    | hikari.api.CacheComponents.ROLES
+    | hikari.api.CacheComponents.ME
+)
+
+PROFILES = ("full", "minimal")
+
+# Entries of each cache component sampled to estimate its memory use
+SAMPLE_SIZE = 50
+
+# Attributes referencing objects shared by every entity rather than owned by one
+SHARED_ATTRIBUTES = {"app"}
+
+
+def get_requirements(
+    modules: typing.Iterable[types.ModuleType],
+) -> typing.Tuple[hikari.Intents, hikari.api.CacheComponents]:
+    """Combines the gateway intents and cache components needed by extensions.
+
+    Extensions declare what they need with the module level INTENTS and
+    CACHE_COMPONENTS attributes. Extensions without them need nothing beyond what
+    the bot itself needs. The intents needed by the listeners of each extension's
+    plugin are added too, except privileged intents, which must be declared so they
+    are only requested when enabled. Listeners needing a privileged intent which
+    wasn't declared are logged, as they will never be called.
+
+    Arguments:
+        modules: The extension modules.
+
+    Returns:
+        The intents and cache components needed by the bot and every extension.
+    """
+    intents = BASE_INTENTS
+    components = BASE_CACHE_COMPONENTS
+
+    modules = list(modules)
+
+    for module in modules:
+        intents |= getattr(module, "INTENTS", hikari.Intents.NONE)
+        components |= getattr(
+            module, "CACHE_COMPONENTS", hikari.api.CacheComponents.NONE
+        )
+
+    for module in modules:
+        plugin = getattr(module, "plugin", None)
+
+        for event_type in getattr(plugin, "_listeners", {}):
+            groups = base_events.get_required_intents_for(event_type)
+
+            if not groups or any(intents & group == group for group in groups):
+                continue
+
+            unprivileged = [
+                group for group in groups if not group & hikari.Intents.ALL_PRIVILEGED
+            ]
+
+            if unprivileged:
+                intents |= unprivileged[0]
+            else:
+                logger.warning(
+                    "%s listens to %s, which needs the %s intent",
+                    module.__name__,
+                    event_type.__name__,
+                    " or ".join(str(group) for group in groups),
+                )
+
+    return intents, components
+
+
+def get_gateway_profile(
+    config: configparser.ConfigParser, modules: typing.Iterable[types.ModuleType]
+) -> typing.Tuple[hikari.Intents, config_impl.CacheSettings]:
+    """Gets the intents and cache settings to connect with.
+
+    The profile is set in the [CACHE] section of the config file. The full profile
+    receives every unprivileged event and caches everything. The minimal profile
+    receives and caches only what the loaded extensions need.
+
+    Arguments:
+        config: The bot configuration.
+        modules: The extension modules which will be loaded.
+
+    Returns:
+        The intents and the cache settings.
+
+    Raises:
+        ValueError: The configured profile doesn't exist.
+    """
+    profile = config.get("CACHE", "PROFILE", fallback="full").lower()
+
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown cache profile {profile!r}")
+
+    intents, components = get_requirements(modules)
+
+    if profile == "full":
+        return (
+            hikari.Intents.ALL_UNPRIVILEGED | intents,
+            config_impl.CacheSettings(),
+        )
+
+    return intents, config_impl.CacheSettings(components=components)
+
+
+def get_size(value: typing.Any, seen: typing.Optional[set] = None) -> int:
+    """Estimates the memory used by an object and the objects it references.
+
+    Arguments:
+        value: The object.
+        seen: The IDs of objects already counted, which aren't counted again.
+
+    Returns:
+        The estimated number of bytes.
+    """
+    seen = set() if seen is None else seen
+
+    if id(value) in seen or isinstance(value, (type, types.ModuleType)):
+        return 0
+
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += get_size(key, seen) + get_size(item, seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += get_size(item, seen)
+    else:
+        names = [
+            *getattr(value, "__dict__", {}),
+            *(
+                name
+                for cls in type(value).__mro__
+                for name in getattr(cls, "__slots__", ())
+                if not name.startswith("__")
+            ),
+        ]
+
+        for name in names:
+            if name not in SHARED_ATTRIBUTES and hasattr(value, name):
+                size += get_size(getattr(value, name), seen)
+
+    return size
+
+
+def measure_cache(
+    cache: hikari.api.Cache,
+) -> typing.List[typing.Tuple[str, int, int]]:
+    """Estimates the memory used by each cache component.
+
+    Memory is estimated from a sample of the entries of each component, so the
+    report stays cheap for large caches.
+
+    Arguments:
+        cache: The cache to measure.
+
+    Returns:
+        The name, number of entries and estimated bytes of each component.
+    """
+    views = {
+        "guilds": cache.get_guilds_view,
+        "guild_channels": cache.get_guild_channels_view,
+        "roles": cache.get_roles_view,
+        "emojis": cache.get_emojis_view,
+        "invites": cache.get_invites_view,
+        "messages": cache.get_messages_view,
+        "users": cache.get_users_view,
+    }
+    nested_views = {
+        "members": cache.get_members_view,
+        "presences": cache.get_presences_view,
+        "voice_states": cache.get_voice_states_view,
+    }
+    report = []
+
+    for name, get_view in [*views.items(), *nested_views.items()]:
+        view = get_view()
+
+        if name in nested_views:
+            count = sum(len(inner) for inner in view.values())
+            entries = itertools.chain.from_iterable(
+                inner.values() for inner in view.values()
+            )
+        else:
+            count = len(view)
+            entries = view.values()
+
+        sample = list(itertools.islice(entries, SAMPLE_SIZE))
+        seen = {id(cache)}
+        sample_size = sum(get_size(entry, seen) for entry in sample)
+        estimate = sample_size * count // len(sample) if sample else 0
+        report.append((name, count, estimate))
+
+    return report
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import typing
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Field set by writes which should evict the caches of other workers
+KEY_FIELD = "invalidation_marker"
+
+# Error code returned by servers that aren't replica sets when opening a stream
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+RETRY_DELAY = 5.0
+
+# Port of the first worker when exchanging invalidations over sockets
+DEFAULT_PORT = 47300
+
+InvalidationCallback = typing.Callable[
+    [typing.Optional[int], typing.Optional[typing.Any]], None
+]
+
+
+def marker(key: typing.Optional[str] = None) -> dict:
+    """Creates the fields a write sets to invalidate a key on every worker.
+
+    The marker is unique to each write so that repeated writes to the same key
+    always show up in the change stream.
+
+    Arguments:
+        key: The key that is changed by the write, or None for every key.
+
+    Returns:
+        The fields to add to the $set stage of the update.
+    """
+    value = str(ObjectId())
+
+    if key is not None:
+        value += f":{key}"
+
+    return {KEY_FIELD: value}
+
+
+class InvalidationBus:
+    """Delivers cache invalidations for guild data to every worker process.
+
+    Plugins subscribe a callback per collection and publish an invalidation after
+    writing to it. The callback is called with the guild ID and key that changed. A
+    key of None means every key of the guild changed, and a guild ID of None means
+    the whole cache must be cleared, which happens when invalidations may have been
+    missed.
+
+    Invalidations reach other workers through a transport. With the change stream
+    transport, every write to a watched collection is seen by all workers, so only
+    local subscribers are notified on publish. With the socket transport,
+    publishing also sends the invalidation to the other workers on this host.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: typing.Dict[str, typing.List[InvalidationCallback]] = {}
+        self._transport: typing.Optional[
+            typing.Union[ChangeStreamTransport, SocketTransport]
+        ] = None
+
+    @property
+    def collections(self) -> typing.List[str]:
+        """The names of the collections with subscribers."""
+        return list(self._subscribers)
+
+    def subscribe(self, collection: str, callback: InvalidationCallback) -> None:
+        """Registers a callback for invalidations of a collection.
+
+        Arguments:
+            collection: The name of the collection.
+            callback: The function called with the guild ID and key that changed.
+
+        Returns:
+            None.
+        """
+        self._subscribers.setdefault(collection, []).append(callback)
+
+    def dispatch(
+        self,
+        collection: str,
+        guild_id: typing.Optional[int],
+        key: typing.Optional[typing.Any] = None,
+    ) -> None:
+        """Notifies the local subscribers of a collection of an invalidation.
+
+        Arguments:
+            collection: The name of the collection.
+            guild_id: The ID of the guild that changed, or None for every guild.
+            key: The key that changed, or None for every key of the guild.
+
+        Returns:
+            None.
+        """
+        for callback in self._subscribers.get(collection, []):
+            callback(guild_id, key)
+
+    def dispatch_all(self) -> None:
+        """Notifies every subscriber that its whole cache must be cleared."""
+        for collection in self._subscribers:
+            self.dispatch(collection, None)
+
+    def publish(
+        self,
+        collection: str,
+        guild_id: int,
+        key: typing.Optional[typing.Any] = None,
+    ) -> None:
+        """Invalidates a key locally and on the other workers.
+
+        Arguments:
+            collection: The name of the collection that was written to.
+            guild_id: The ID of the guild that changed.
+            key: The key that changed, or None for every key of the guild.
+
+        Returns:
+            None.
+        """
+        self.dispatch(collection, guild_id, key)
+
+        if isinstance(self._transport, SocketTransport):
+            self._transport.send(collection, guild_id, key)
+
+    async def start(
+        self, transport: typing.Union["ChangeStreamTransport", "SocketTransport"]
+    ) -> None:
+        """Starts receiving invalidations from other workers.
+
+        Arguments:
+            transport: The transport to receive invalidations through.
+
+        Returns:
+            None.
+        """
+        self._transport = transport
+        await transport.start(self)
+
+    async def stop(self) -> None:
+        """Stops receiving invalidations from other workers."""
+        if self._transport is not None:
+            await self._transport.stop()
+            self._transport = None
+
+
+class ChangeStreamTransport:
+    """Receives invalidations from change streams on the watched collections.
+
+    Inserts, replacements and deletions always invalidate, as do updates which set
+    a marker. Updates without a marker, such as counters, are not propagated. When
+    the guild of a change is unknown, as for deletions, the whole cache of the
+    collection is cleared. Requires the database to be a replica set or sharded
+    cluster.
+
+    Arguments:
+        database: The database containing the collections.
+    """
+
+    def __init__(self, database) -> None:
+        self._database = database
+        self._tasks: typing.List[asyncio.Task] = []
+
+    async def check_supported(self) -> bool:
+        """Checks if the database supports change streams.
+
+        Returns:
+            True if a change stream can be opened, false if not.
+        """
+        try:
+            async with self._database.watch([{"$match": {"_id": None}}]):
+                return True
+        except OperationFailure as error:
+            if error.code == CHANGE_STREAMS_UNSUPPORTED:
+                return False
+            raise
+
+    async def start(self, bus: InvalidationBus) -> None:
+        for collection in bus.collections:
+            self._tasks.append(
+                asyncio.create_task(
+                    self._watch(bus, collection), name=f"watch {collection}"
+                )
+            )
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _watch(self, bus: InvalidationBus, collection: str) -> None:
+        """Dispatches the changes to a collection until cancelled.
+
+        If the stream fails, the caches of the collection are cleared since changes
+        may have been missed, and the stream is reopened.
+
+        Arguments:
+            bus: The bus to dispatch invalidations to.
+            collection: The name of the collection to watch.
+
+        Returns:
+            None.
+        """
+        pipeline = [
+            {
+                "$match": {
+                    "$or": [
+                        {"operationType": {"$in": ["insert", "replace", "delete"]}},
+                        {
+                            f"updateDescription.updatedFields.{KEY_FIELD}": {
+                                "$exists": True
+                            }
+                        },
+                    ]
+                }
+            },
+            {
+                "$project": {
+                    "guild_id": "$fullDocument.guild_id",
+                    "marker": {
+                        "$ifNull": [
+                            f"$updateDescription.updatedFields.{KEY_FIELD}",
+                            f"$fullDocument.{KEY_FIELD}",
+                        ]
+                    },
+                }
+            },
+        ]
+
+        while True:
+            try:
+                async with self._database[collection].watch(
+                    pipeline, full_document="updateLookup"
+                ) as stream:
+                    async for change in stream:
+                        _, _, key = (change.get("marker") or "").partition(":")
+                        bus.dispatch(collection, change.get("guild_id"), key or None)
+
+            except asyncio.CancelledError:
+                raise
+
+            except PyMongoError as error:
+                logger.warning("change stream on %s failed: %s", collection, error)
+                bus.dispatch(collection, None)
+                await asyncio.sleep(RETRY_DELAY)
+
+
+class SocketTransport(asyncio.DatagramProtocol):
+    """Exchanges invalidations between workers on this host over UDP.
+
+    Each worker listens on the base port plus its worker number and sends every
+    invalidation it publishes to the ports of the other workers.
+
+    Arguments:
+        worker: The number of this worker.
+        workers: The total number of workers.
+        port: The port of the first worker.
+        host: The interface to listen and send on.
+    """
+
+    def __init__(
+        self, worker: int, workers: int, port: int, host: str = "127.0.0.1"
+    ) -> None:
+        self._worker = worker
+        self._workers = workers
+        self._port = port
+        self._host = host
+        self._bus: typing.Optional[InvalidationBus] = None
+        self._endpoint: typing.Optional[asyncio.DatagramTransport] = None
+
+    async def start(self, bus: InvalidationBus) -> None:
+        self._bus = bus
+        loop = asyncio.get_running_loop()
+        self._endpoint, _ = await loop.create_datagram_endpoint(
+            lambda: self, local_addr=(self._host, self._port + self._worker)
+        )
+
+    async def stop(self) -> None:
+        if self._endpoint is not None:
+            self._endpoint.close()
+            self._endpoint = None
+
+    def send(
+        self, collection: str, guild_id: int, key: typing.Optional[typing.Any]
+    ) -> None:
+        """Sends an invalidation to every other worker.
+
+        Arguments:
+            collection: The name of the collection that was written to.
+            guild_id: The ID of the guild that changed.
+            key: The key that changed, or None for every key of the guild.
+
+        Returns:
+            None.
+        """
+        if self._endpoint is None:
+            return
+
+        message = json.dumps([collection, guild_id, key]).encode()
+
+        for worker in range(self._workers):
+            if worker != self._worker:
+                self._endpoint.sendto(message, (self._host, self._port + worker))
+
+    def datagram_received(self, data: bytes, address: tuple) -> None:
+        try:
+            collection, guild_id, key = json.loads(data)
+        except ValueError:
+            logger.warning("ignoring malformed invalidation from %s", address)
+            return
+
+        self._bus.dispatch(collection, guild_id, key)
+
+
+bus = InvalidationBus()
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import typing
+
+import lightbulb
+
+from bson import json_util
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DRAIN_TIMEOUT = 10.0
+DEFAULT_CHECKPOINT_FILE = "checkpoint-{worker}.json"
+
+# Priorities of drain hooks, lower values run first
+HIGH = 0
+NORMAL = 10
+LOW = 20
+
+# Write operations by the name of the collection method they correspond to
+OPERATIONS = {
+    "insert_one": InsertOne,
+    "update_one": UpdateOne,
+    "update_many": UpdateMany,
+    "delete_one": DeleteOne,
+    "delete_many": DeleteMany,
+}
+
+
+class ShuttingDown(lightbulb.CheckFailure):
+    """Raised when a command is used while the bot is shutting down."""
+
+
+def to_request(operation: dict):
+    """Converts a serializable write operation to a pymongo request.
+
+    Operations are dictionaries with a single key naming the collection method, such
+    as {"update_one": {"filter": {...}, "update": {...}, "upsert": True}}.
+
+    Arguments:
+        operation: The write operation.
+
+    Returns:
+        The request to pass to bulk_write.
+    """
+    ((method, arguments),) = operation.items()
+
+    return OPERATIONS[method](**arguments)
+
+
+class Lifecycle:
+    """Tracks outstanding work so the bot can shut down without losing writes.
+
+    Handlers and background tasks are tracked while they run. When the bot stops,
+    new commands are refused, drain hooks such as write buffers are flushed, and
+    outstanding work is awaited until a deadline. Writes which are still pending
+    are then collected from the checkpoint sources, saved to a file and replayed on
+    the next start.
+
+    Attributes:
+        accepting: Whether new commands are accepted.
+        database: The database checkpointed writes are replayed against.
+    """
+
+    def __init__(self) -> None:
+        self.accepting = True
+        self.database = None
+        self._tasks: typing.Set[asyncio.Task] = set()
+        self._drain_hooks: typing.List[
+            typing.Tuple[int, int, typing.Callable[[], typing.Awaitable[None]]]
+        ] = []
+        self._checkpoint_sources: typing.List[
+            typing.Callable[[], typing.List[typing.Tuple[str, typing.List[dict]]]]
+        ] = []
+
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """Tracks a task until it is done.
+
+        Arguments:
+            task: The task to track.
+
+        Returns:
+            The task.
+        """
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return task
+
+    def spawn(
+        self, coroutine: typing.Coroutine, name: typing.Optional[str] = None
+    ) -> asyncio.Task:
+        """Runs a coroutine in a tracked background task.
+
+        Exceptions raised by the coroutine are logged.
+
+        Arguments:
+            coroutine: The coroutine to run.
+            name: The name of the task.
+
+        Returns:
+            The task running the coroutine.
+        """
+        task = asyncio.create_task(coroutine, name=name)
+        task.add_done_callback(self._log_exception)
+
+        return self.track(task)
+
+    def on_drain(
+        self, hook: typing.Callable[[], typing.Awaitable[None]], priority: int = NORMAL
+    ) -> None:
+        """Registers a coroutine function to await when draining.
+
+        Hooks with the same priority run in the order they were registered. Hooks
+        which produce writes should run before the hooks which write them out.
+
+        Arguments:
+            hook: The coroutine function, such as one flushing a write buffer.
+            priority: The priority of the hook, lower values run first.
+
+        Returns:
+            None.
+        """
+        self._drain_hooks.append((priority, len(self._drain_hooks), hook))
+
+    def on_checkpoint(
+        self,
+        source: typing.Callable[[], typing.List[typing.Tuple[str, typing.List[dict]]]],
+    ) -> None:
+        """Registers a function returning writes to checkpoint after draining.
+
+        Arguments:
+            source: The function returning the pending writes as pairs of collection
+                name and write operations, in the format taken by to_request.
+
+        Returns:
+            None.
+        """
+        self._checkpoint_sources.append(source)
+
+    async def drain(self, timeout: float, checkpoint_path: str) -> None:
+        """Stops accepting commands and waits for outstanding work to finish.
+
+        Drain hooks are awaited first in order of priority, then every tracked task
+        other than the calling one. Tasks still running at the deadline are
+        cancelled, and writes which haven't been made are checkpointed.
+
+        Arguments:
+            timeout: The number of seconds to wait for outstanding work.
+            checkpoint_path: The file to checkpoint pending writes to.
+
+        Returns:
+            None.
+        """
+        self.accepting = False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        for _, _, hook in sorted(self._drain_hooks, key=lambda hook: hook[:2]):
+            try:
+                await asyncio.wait_for(hook(), max(deadline - loop.time(), 0))
+            except Exception:
+                logger.exception("drain hook %s failed", hook.__qualname__)
+
+        pending = self._tasks - {asyncio.current_task()}
+
+        if pending:
+            _, pending = await asyncio.wait(
+                pending, timeout=max(deadline - loop.time(), 0)
+            )
+
+        for task in pending:
+            task.cancel()
+
+        if pending:
+            logger.warning("cancelled %d tasks still running after drain", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        writes = [write for source in self._checkpoint_sources for write in source()]
+
+        if writes:
+            self.checkpoint(writes, checkpoint_path)
+
+    def checkpoint(
+        self, writes: typing.List[typing.Tuple[str, typing.List[dict]]], path: str
+    ) -> None:
+        """Saves pending writes to a file.
+
+        Arguments:
+            writes: The pairs of collection name and write operations to save.
+            path: The file to write to.
+
+        Returns:
+            None.
+        """
+        with open(path, "w") as file:
+            file.write(json_util.dumps(writes))
+
+        logger.warning("checkpointed writes to %d collections to %s", len(writes), path)
+
+    async def replay(self, path: str) -> None:
+        """Applies the writes checkpointed by the previous run, if any.
+
+        The file is removed before the writes are applied, so they are applied at
+        most once even if replaying fails or is interrupted. Writes to a collection
+        which fail are logged.
+
+        Arguments:
+            path: The file the writes were checkpointed to.
+
+        Returns:
+            None.
+        """
+        if not os.path.exists(path):
+            return
+
+        with open(path) as file:
+            writes = json_util.loads(file.read())
+
+        os.remove(path)
+
+        for collection, operations in writes:
+            try:
+                await self.database[collection].bulk_write(
+                    [to_request(operation) for operation in operations]
+                )
+            except PyMongoError:
+                logger.exception(
+                    "checkpointed writes to %s may not have been applied: %s",
+                    collection,
+                    json_util.dumps(operations),
+                )
+
+        logger.info("replayed checkpointed writes from %s", path)
+
+    def _log_exception(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "background task %s failed",
+                task.get_name(),
+                exc_info=task.exception(),
+            )
+
+
+manager = Lifecycle()
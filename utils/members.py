@@ -0,0 +1,171 @@
+import hikari
+import lightbulb
+import re
+import typing
+
+from lightbulb.utils import parser
+from utils.rest import lookups
+
+USER_MENTION_PATTERN = re.compile(r"<@!?(\d+)>")
+
+
+def get_member_names(member: hikari.Member, fold_case: bool = True) -> typing.Set[str]:
+    """Gets the names a member can be looked up by.
+
+    Arguments:
+        member: The member.
+        fold_case: Whether to lowercase the names.
+
+    Returns:
+        The username, the username with the discriminator and the nickname.
+    """
+    names = {member.username, f"{member.username}#{member.discriminator}"}
+
+    if member.nickname is not None:
+        names.add(member.nickname)
+
+    if fold_case:
+        names = {name.lower() for name in names}
+
+    return names
+
+
+class MemberIndex:
+    """Maps lowercase member names to member IDs in each guild.
+
+    The index is kept up to date from member events, so members can be found by
+    name with a dictionary lookup instead of scanning every member of the guild.
+    """
+
+    def __init__(self) -> None:
+        self._ids: typing.Dict[int, typing.Dict[str, typing.Set[int]]] = {}
+        self._names: typing.Dict[typing.Tuple[int, int], typing.Set[str]] = {}
+
+    def add(self, member: hikari.Member) -> None:
+        """Adds a member, replacing the names it was indexed by before.
+
+        Arguments:
+            member: The member.
+
+        Returns:
+            None.
+        """
+        self.remove(member.guild_id, member.id)
+
+        names = get_member_names(member)
+        guild_ids = self._ids.setdefault(member.guild_id, {})
+
+        for name in names:
+            guild_ids.setdefault(name, set()).add(member.id)
+
+        self._names[(member.guild_id, member.id)] = names
+
+    def remove(
+        self, guild_id: hikari.Snowflakeish, user_id: hikari.Snowflakeish
+    ) -> None:
+        """Removes a member if it is indexed.
+
+        Arguments:
+            guild_id: The ID of the guild.
+            user_id: The ID of the member.
+
+        Returns:
+            None.
+        """
+        names = self._names.pop((guild_id, user_id), ())
+        guild_ids = self._ids.get(guild_id, {})
+
+        for name in names:
+            member_ids = guild_ids[name]
+            member_ids.discard(user_id)
+
+            if not member_ids:
+                del guild_ids[name]
+
+    def remove_guild(self, guild_id: hikari.Snowflakeish) -> None:
+        """Removes every member of a guild.
+
+        Arguments:
+            guild_id: The ID of the guild.
+
+        Returns:
+            None.
+        """
+        for member_ids in self._ids.pop(guild_id, {}).values():
+            for member_id in member_ids:
+                self._names.pop((guild_id, member_id), None)
+
+    def find(self, guild_id: hikari.Snowflakeish, name: str) -> typing.Set[int]:
+        """Finds the members of a guild with a name, ignoring case.
+
+        Arguments:
+            guild_id: The ID of the guild.
+            name: The username, username with discriminator or nickname.
+
+        Returns:
+            The IDs of the members with the name.
+        """
+        return set(self._ids.get(guild_id, {}).get(name.lower(), ()))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+index = MemberIndex()
+
+
+class MemberConverter(lightbulb.converters.BaseConverter[hikari.Member]):
+    """Converts prefix command arguments to members using the member index.
+
+    Mentions and IDs are looked up through the cache first facade. Names are found
+    in the index, preferring a member whose name matches the case of the argument.
+    """
+
+    __slots__ = ()
+
+    async def convert(self, arg: str) -> hikari.Member:
+        guild_id = self.context.guild_id
+
+        if guild_id is None:
+            raise TypeError("Members can only be resolved in a guild")
+
+        match = USER_MENTION_PATTERN.fullmatch(arg)
+
+        if match is not None or arg.isdigit():
+            return await lookups.fetch_member(
+                guild_id, int(match.group(1) if match else arg), "members.convert"
+            )
+
+        members = []
+
+        for member_id in sorted(index.find(guild_id, arg)):
+            try:
+                member = await lookups.fetch_member(
+                    guild_id, member_id, "members.convert"
+                )
+            except hikari.NotFoundError:
+                index.remove(guild_id, member_id)
+                continue
+
+            # The index may be behind a rename the bot didn't receive an event for
+            if arg.lower() in get_member_names(member):
+                members.append(member)
+
+        if not members:
+            raise TypeError("No member could be resolved from the argument")
+
+        exact = [member for member in members if arg in get_member_names(member, False)]
+
+        return (exact or members)[0]
+
+
+def install_member_converter() -> None:
+    """Makes prefix command options of the member type use the member index.
+
+    Lightbulb picks converters for option types from a module level mapping, so the
+    mapping for members is replaced.
+
+    Returns:
+        None.
+    """
+    parser.CONVERTER_TYPE_MAPPING[hikari.Member] = MemberConverter
@@ -0,0 +1,520 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+import typing
+
+from hikari.impl import buckets, rate_limits, rest
+from pymongo import monitoring
+from utils import lifecycle, tracing
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNATTRIBUTED = ("none", "none")
+
+# The (plugin, handler) pair of the command or listener currently running
+current_handler: contextvars.ContextVar[
+    typing.Tuple[str, str]
+] = contextvars.ContextVar("current_handler", default=UNATTRIBUTED)
+
+
+def escape_label(value: str) -> str:
+    """Escapes a label value for the prometheus text format.
+
+    Arguments:
+        value: The label value to escape.
+
+    Returns:
+        The escaped label value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: typing.Sequence[str], values: typing.Sequence[str]) -> str:
+    """Formats label names and values into a prometheus label set.
+
+    Arguments:
+        names: The names of the labels.
+        values: The values of the labels.
+
+    Returns:
+        The formatted label set, or an empty string if there are no labels.
+    """
+    if not names:
+        return ""
+
+    pairs = ",".join(
+        f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """A monotonically increasing value for each combination of labels.
+
+    Attributes:
+        name: The name of the metric.
+        description: The help text of the metric.
+        label_names: The names of the labels the metric is broken down by.
+    """
+
+    def __init__(
+        self, name: str, description: str, label_names: typing.Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values: typing.Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Increments the counter for a combination of labels.
+
+        Arguments:
+            amount: The amount to increment by.
+            **labels: The value of each label.
+
+        Returns:
+            None.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> typing.Dict[tuple, float]:
+        """Returns a copy of the value for each combination of labels."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> typing.List[str]:
+        """Renders the counter in the prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+        ]
+
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, key)} {value}")
+
+        return lines
+
+
+class Histogram:
+    """A distribution of observed values for each combination of labels.
+
+    Attributes:
+        name: The name of the metric.
+        description: The help text of the metric.
+        label_names: The names of the labels the metric is broken down by.
+        buckets: The upper bounds of the histogram buckets.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values: typing.Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """Records an observed value for a combination of labels.
+
+        Arguments:
+            value: The observed value.
+            **labels: The value of each label.
+
+        Returns:
+            None.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+
+        with self._lock:
+            # Bucket counts followed by the sum and count of observations
+            state = self._values.get(key)
+
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self) -> typing.Dict[tuple, dict]:
+        """Returns the buckets, sum and count for each combination of labels."""
+        with self._lock:
+            return {
+                key: {
+                    "buckets": list(zip(self.buckets, state[:-2])),
+                    "sum": state[-2],
+                    "count": state[-1],
+                }
+                for key, state in self._values.items()
+            }
+
+    def render(self) -> typing.List[str]:
+        """Renders the histogram in the prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        bucket_labels = self.label_names + ("le",)
+
+        for key, data in sorted(self.collect().items()):
+            for bound, count in data["buckets"]:
+                labels = format_labels(bucket_labels, key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+
+            labels = format_labels(bucket_labels, key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {data['count']}")
+
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {data['sum']}")
+            lines.append(f"{self.name}_count{labels} {data['count']}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric recorded by the bot.
+
+    Besides counters and histograms, collectors can be registered to produce
+    gauge values from objects that keep their own statistics.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: typing.Dict[str, typing.Union[Counter, Histogram]] = {}
+        self._collectors: typing.Dict[
+            str, typing.Callable[[], typing.Dict[str, float]]
+        ] = {}
+
+    def counter(
+        self, name: str, description: str, label_names: typing.Sequence[str] = ()
+    ) -> Counter:
+        """Gets or creates a counter.
+
+        Arguments:
+            name: The name of the metric.
+            description: The help text of the metric.
+            label_names: The names of the labels the metric is broken down by.
+
+        Returns:
+            The counter.
+        """
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, description, label_names)
+
+        return self._metrics[name]
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        label_names: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Gets or creates a histogram.
+
+        Arguments:
+            name: The name of the metric.
+            description: The help text of the metric.
+            label_names: The names of the labels the metric is broken down by.
+            buckets: The upper bounds of the histogram buckets.
+
+        Returns:
+            The histogram.
+        """
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, description, label_names, buckets)
+
+        return self._metrics[name]
+
+    def register_collector(
+        self, prefix: str, collector: typing.Callable[[], typing.Dict[str, float]]
+    ) -> None:
+        """Registers a function returning gauge values to include when rendering.
+
+        Arguments:
+            prefix: The prefix of the gauge names.
+            collector: The function returning a mapping of gauge name to value.
+
+        Returns:
+            None.
+        """
+        self._collectors[prefix] = collector
+
+    def render(self) -> str:
+        """Renders every metric in the prometheus text format.
+
+        Returns:
+            The rendered metrics.
+        """
+        lines = []
+
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+
+        for prefix, collector in self._collectors.items():
+            for name, value in sorted(collector().items()):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+handler_seconds = registry.histogram(
+    "campfire_handler_seconds",
+    "Wall time of command and listener invocations.",
+    ("plugin", "handler", "kind"),
+)
+handler_errors = registry.counter(
+    "campfire_handler_errors_total",
+    "Command and listener invocations that raised an exception.",
+    ("plugin", "handler", "kind"),
+)
+mongo_seconds = registry.histogram(
+    "campfire_mongo_seconds",
+    "Duration of database commands.",
+    ("plugin", "handler", "command"),
+)
+mongo_failures = registry.counter(
+    "campfire_mongo_failures_total",
+    "Database commands that failed.",
+    ("plugin", "handler", "command"),
+)
+rest_seconds = registry.histogram(
+    "campfire_rest_seconds",
+    "Duration of REST requests including rate limit waits and retries.",
+    ("plugin", "handler", "route"),
+)
+rate_limit_seconds = registry.histogram(
+    "campfire_rate_limit_seconds",
+    "Time REST requests spent waiting on rate limit buckets.",
+    ("plugin", "handler"),
+)
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Records the duration of every database command.
+
+    Motor copies the calling context into the executor thread that runs the
+    command, so commands are attributed to the handler that issued them.
+    """
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        plugin_name, handler_name = current_handler.get()
+        duration = event.duration_micros / 1_000_000
+        mongo_seconds.observe(
+            duration,
+            plugin=plugin_name,
+            handler=handler_name,
+            command=event.command_name,
+        )
+        tracing.record_span(f"mongo {event.command_name}", duration)
+
+    def failed(self, event) -> None:
+        plugin_name, handler_name = current_handler.get()
+        duration = event.duration_micros / 1_000_000
+        mongo_seconds.observe(
+            duration,
+            plugin=plugin_name,
+            handler=handler_name,
+            command=event.command_name,
+        )
+        tracing.record_span(
+            f"mongo {event.command_name}", duration, failure=str(event.failure)
+        )
+        mongo_failures.inc(
+            plugin=plugin_name, handler=handler_name, command=event.command_name
+        )
+
+
+def instrument_handler(
+    callback: typing.Callable[..., typing.Awaitable[typing.Any]],
+    plugin_name: str,
+    handler_name: str,
+    kind: str,
+) -> typing.Callable[..., typing.Awaitable[typing.Any]]:
+    """Wraps a command callback or listener to record its wall time.
+
+    A trace is also opened for the invocation, which database and REST calls made
+    by the handler are recorded under. The task running the handler is tracked so
+    that shutdown waits for it to finish.
+
+    Arguments:
+        callback: The coroutine function to wrap.
+        plugin_name: The name of the plugin the handler belongs to.
+        handler_name: The name of the command or listener.
+        kind: Either "command", "listener" or "job".
+
+    Returns:
+        The wrapped coroutine function.
+    """
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        lifecycle.manager.track(asyncio.current_task())
+        token = current_handler.set((plugin_name, handler_name))
+        start = time.perf_counter()
+
+        try:
+            with tracing.trace(f"{kind} {plugin_name}/{handler_name}"):
+                return await callback(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(plugin=plugin_name, handler=handler_name, kind=kind)
+            raise
+        finally:
+            handler_seconds.observe(
+                time.perf_counter() - start,
+                plugin=plugin_name,
+                handler=handler_name,
+                kind=kind,
+            )
+            current_handler.reset(token)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_command(command_like, plugin_name: str, prefix: str = "") -> None:
+    """Wraps a command and all of its subcommands.
+
+    Arguments:
+        command_like: The command to wrap.
+        plugin_name: The name of the plugin the command belongs to.
+        prefix: The qualified name of the parent command.
+
+    Returns:
+        None.
+    """
+    name = f"{prefix} {command_like.name}".strip()
+
+    if not getattr(command_like.callback, "__instrumented__", False):
+        command_like.callback = instrument_handler(
+            command_like.callback, plugin_name, name, "command"
+        )
+
+    for subcommand in command_like.subcommands:
+        instrument_command(subcommand, plugin_name, name)
+
+
+def instrument_plugin(plugin) -> None:
+    """Wraps every command and listener of a plugin to record metrics.
+
+    Must be called before the plugin is added to the bot, as that is when its
+    commands are created and its listeners subscribed.
+
+    Arguments:
+        plugin: The plugin to instrument.
+
+    Returns:
+        None.
+    """
+    for command_like in plugin.raw_commands:
+        instrument_command(command_like, plugin.name)
+
+    # Lightbulb has no public accessor for the listeners of a plugin
+    for listeners in plugin._listeners.values():
+        for index, listener in enumerate(listeners):
+            if not getattr(listener, "__instrumented__", False):
+                listeners[index] = instrument_handler(
+                    listener, plugin.name, listener.__name__, "listener"
+                )
+
+
+def install_rest_hooks() -> None:
+    """Wraps hikari's REST request and rate limit internals to record metrics.
+
+    Hikari has no hooks for observing REST requests, so the private methods of the
+    pinned version are wrapped. Installing the hooks more than once has no effect.
+
+    Returns:
+        None.
+    """
+    if getattr(rest.RESTClientImpl._request, "__instrumented__", False):
+        return
+
+    def timed_request(request):
+        @functools.wraps(request)
+        async def wrapper(self, compiled_route, **kwargs):
+            plugin_name, handler_name = current_handler.get()
+            route = compiled_route.route
+            start = time.perf_counter()
+
+            try:
+                with tracing.span(f"rest {route.method} {route.path_template}"):
+                    return await request(self, compiled_route, **kwargs)
+            finally:
+                rest_seconds.observe(
+                    time.perf_counter() - start,
+                    plugin=plugin_name,
+                    handler=handler_name,
+                    route=f"{route.method} {route.path_template}",
+                )
+
+        wrapper.__instrumented__ = True
+        return wrapper
+
+    def timed_acquire(acquire):
+        @functools.wraps(acquire)
+        async def wrapper(self):
+            plugin_name, handler_name = current_handler.get()
+            start = time.perf_counter()
+
+            try:
+                with tracing.span("rate limit wait"):
+                    return await acquire(self)
+            finally:
+                rate_limit_seconds.observe(
+                    time.perf_counter() - start,
+                    plugin=plugin_name,
+                    handler=handler_name,
+                )
+
+        return wrapper
+
+    rest.RESTClientImpl._request = timed_request(rest.RESTClientImpl._request)
+    buckets.RESTBucket.acquire = timed_acquire(buckets.RESTBucket.acquire)
+    rate_limits.ManualRateLimiter.acquire = timed_acquire(
+        rate_limits.ManualRateLimiter.acquire
+    )
+
+
+def summarize_handlers() -> typing.List[typing.Tuple[str, str, int, float]]:
+    """Summarizes the recorded handler invocations.
+
+    Returns:
+        The plugin, handler, invocation count and average wall time of each
+        handler, slowest first.
+    """
+    totals = {}
+
+    for (plugin_name, handler_name, _), data in handler_seconds.collect().items():
+        count, total = totals.get((plugin_name, handler_name), (0, 0.0))
+        totals[(plugin_name, handler_name)] = (
+            count + data["count"],
+            total + data["sum"],
+        )
+
+    summary = [
+        (plugin_name, handler_name, count, total / count)
+        for (plugin_name, handler_name), (count, total) in totals.items()
+        if count
+    ]
+
+    return sorted(summary, key=lambda row: row[3], reverse=True)
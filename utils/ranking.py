@@ -0,0 +1,259 @@
+import random
+import typing
+
+# Enough levels for logarithmic operations on up to 2**32 entries
+MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: typing.Any, levels: int) -> None:
+        self.key = key
+        self.next: typing.List[typing.Optional[_Node]] = [None] * levels
+        self.width = [1] * levels
+
+
+class SkipList:
+    """A sorted collection with logarithmic inserts, removals and position lookups.
+
+    Each entry links forward on a random number of levels, and each link records
+    how many positions it skips. Searches follow the highest links first, so they
+    take a logarithmic number of steps on average, and the position of an entry is
+    the sum of the widths of the links followed to reach it.
+    """
+
+    def __init__(self) -> None:
+        self._head = _Node(None, MAX_LEVELS)
+        self._levels = 1
+        self._size = 0
+
+    def _search(
+        self, key: typing.Any, levels: int
+    ) -> typing.Tuple[typing.List[_Node], typing.List[int]]:
+        """Finds the last entry before a key on each level.
+
+        Arguments:
+            key: The key to search for.
+            levels: The number of levels to search.
+
+        Returns:
+            The last node before the key on each level and its zero-indexed
+            position, where the head is at position -1.
+        """
+        path = [self._head] * levels
+        positions = [-1] * levels
+        node = self._head
+        position = -1
+
+        for level in reversed(range(levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+
+            path[level] = node
+            positions[level] = position
+
+        return path, positions
+
+    def add(self, key: typing.Any) -> None:
+        """Inserts a key.
+
+        Arguments:
+            key: The key to insert.
+
+        Returns:
+            None.
+        """
+        levels = 1
+
+        while levels < MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+
+        self._levels = max(self._levels, levels)
+        path, positions = self._search(key, self._levels)
+        node = _Node(key, levels)
+        position = positions[0] + 1
+
+        for level in range(levels):
+            previous = path[level]
+            skipped = position - positions[level]
+            node.next[level] = previous.next[level]
+            node.width[level] = previous.width[level] - skipped + 1
+            previous.next[level] = node
+            previous.width[level] = skipped
+
+        # Links passing over the new entry now skip one more position
+        for level in range(levels, self._levels):
+            path[level].width[level] += 1
+
+        self._size += 1
+
+    def remove(self, key: typing.Any) -> None:
+        """Removes a key.
+
+        Arguments:
+            key: The key to remove.
+
+        Returns:
+            None.
+
+        Raises:
+            KeyError: The key isn't in the collection.
+        """
+        path, _ = self._search(key, self._levels)
+        node = path[0].next[0]
+
+        if node is None or node.key != key:
+            raise KeyError(key)
+
+        for level in range(self._levels):
+            previous = path[level]
+
+            if previous.next[level] is node:
+                previous.width[level] += node.width[level] - 1
+                previous.next[level] = node.next[level]
+            else:
+                previous.width[level] -= 1
+
+        self._size -= 1
+
+    def bisect_left(self, key: typing.Any) -> int:
+        """Counts the keys lower than a key.
+
+        Arguments:
+            key: The key to compare with.
+
+        Returns:
+            The position the key would be inserted at.
+        """
+        _, positions = self._search(key, self._levels)
+
+        return positions[0] + 1
+
+    def slice(self, start: int, count: int) -> typing.List[typing.Any]:
+        """Gets consecutive keys in order.
+
+        Arguments:
+            start: The zero-indexed position of the first key.
+            count: The maximum number of keys to return.
+
+        Returns:
+            The keys.
+        """
+        node = self._head
+        position = -1
+
+        for level in reversed(range(self._levels)):
+            while (
+                node.next[level] is not None and position + node.width[level] <= start
+            ):
+                position += node.width[level]
+                node = node.next[level]
+
+        keys = []
+        node = node if position == start else node.next[0]
+
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+
+        return keys
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class Ranking:
+    """Members ordered by score, highest first.
+
+    Entries are kept in a skip list, so updating the score of a member, finding
+    their rank and finding the start of a page all take a logarithmic number of
+    steps. Members with equal scores share a rank and are ordered by ID.
+    """
+
+    def __init__(self) -> None:
+        self._scores: typing.Dict[int, int] = {}
+        self._order = SkipList()
+
+    def load(self, scores: typing.Iterable[typing.Tuple[int, int]]) -> None:
+        """Replaces the ranking with the given scores.
+
+        Arguments:
+            scores: Pairs of member ID and score.
+
+        Returns:
+            None.
+        """
+        self._scores = dict(scores)
+        self._order = SkipList()
+
+        for member_id, score in self._scores.items():
+            self._order.add((-score, member_id))
+
+    def update(self, member_id: int, score: int) -> None:
+        """Sets the score of a member.
+
+        Arguments:
+            member_id: The ID of the member.
+            score: The new score of the member.
+
+        Returns:
+            None.
+        """
+        previous = self._scores.get(member_id)
+
+        if previous == score:
+            return
+
+        if previous is not None:
+            self._order.remove((-previous, member_id))
+
+        self._scores[member_id] = score
+        self._order.add((-score, member_id))
+
+    def score(self, member_id: int) -> typing.Optional[int]:
+        """Gets the score of a member.
+
+        Arguments:
+            member_id: The ID of the member.
+
+        Returns:
+            The score of the member, or None if they aren't ranked.
+        """
+        return self._scores.get(member_id)
+
+    def rank(self, member_id: int) -> typing.Optional[int]:
+        """Gets the position of a member in the ranking.
+
+        Arguments:
+            member_id: The ID of the member.
+
+        Returns:
+            The one-indexed rank of the member, or None if they aren't ranked.
+        """
+        score = self._scores.get(member_id)
+
+        if score is None:
+            return None
+
+        # Members are ranked after everyone with a strictly higher score
+        return self._order.bisect_left((-score,)) + 1
+
+    def page(self, start: int, count: int) -> typing.List[typing.Tuple[int, int, int]]:
+        """Gets a slice of the ranking.
+
+        Arguments:
+            start: The zero-indexed position of the first entry.
+            count: The maximum number of entries to return.
+
+        Returns:
+            Tuples of rank, member ID and score.
+        """
+        return [
+            (self._order.bisect_left((negated,)) + 1, member_id, -negated)
+            for negated, member_id in self._order.slice(start, count)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._order)
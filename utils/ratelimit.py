@@ -0,0 +1,151 @@
+import collections
+import time
+import typing
+
+# Number of hits between sweeps of keys whose windows have emptied
+PRUNE_INTERVAL = 1000
+
+
+class SlidingWindowLimiter:
+    """Limits how many times each key can be hit within a sliding window.
+
+    The time of every hit within the window is kept per key, so a key is allowed
+    again exactly when its oldest hit leaves the window.
+
+    Arguments:
+        limit: The maximum number of hits per key within the window.
+        window: The length of the window in seconds.
+    """
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self._hits: typing.Dict[typing.Hashable, typing.Deque[float]] = {}
+        self._since_prune = 0
+
+    def _expire(self, key: typing.Hashable, now: float) -> typing.Deque[float]:
+        hits = self._hits.get(key)
+
+        if hits is None:
+            return collections.deque()
+
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+        return hits
+
+    def retry_after(
+        self, key: typing.Hashable, now: typing.Optional[float] = None
+    ) -> float:
+        """Gets how long a key must wait before it can be hit again.
+
+        Arguments:
+            key: The key to check.
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            The number of seconds to wait, or 0 if the key can be hit now.
+        """
+        now = time.monotonic() if now is None else now
+        hits = self._expire(key, now)
+
+        if len(hits) < self.limit:
+            return 0.0
+
+        return hits[0] + self.window - now
+
+    def hit(self, key: typing.Hashable, now: typing.Optional[float] = None) -> None:
+        """Records a hit for a key.
+
+        Arguments:
+            key: The key that was hit.
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            None.
+        """
+        now = time.monotonic() if now is None else now
+        self._hits.setdefault(key, collections.deque()).append(now)
+        self._since_prune += 1
+
+        if self._since_prune >= PRUNE_INTERVAL:
+            self.prune(now)
+
+    def prune(self, now: typing.Optional[float] = None) -> None:
+        """Forgets keys without any hits left in the window.
+
+        Arguments:
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            None.
+        """
+        now = time.monotonic() if now is None else now
+        self._since_prune = 0
+
+        for key in [key for key in self._hits if not self._expire(key, now)]:
+            del self._hits[key]
+
+    def __len__(self) -> int:
+        return len(self._hits)
+
+
+class BurstDetector:
+    """Flags keys which are hit unusually often within a short window.
+
+    Once a key reaches the threshold, it is flagged for a cooldown period during
+    which further hits should be refused.
+
+    Arguments:
+        threshold: The number of hits within the window that counts as a burst.
+        window: The length of the window in seconds.
+        cooldown: The number of seconds a key stays flagged after a burst.
+    """
+
+    def __init__(self, threshold: int, window: float, cooldown: float) -> None:
+        self.cooldown = cooldown
+        self._limiter = SlidingWindowLimiter(threshold, window)
+        self._flagged: typing.Dict[typing.Hashable, float] = {}
+
+    def flagged_for(
+        self, key: typing.Hashable, now: typing.Optional[float] = None
+    ) -> float:
+        """Gets how long a key stays flagged.
+
+        Arguments:
+            key: The key to check.
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            The number of seconds left in the cooldown, or 0 if not flagged.
+        """
+        now = time.monotonic() if now is None else now
+        until = self._flagged.get(key)
+
+        if until is None:
+            return 0.0
+
+        if until <= now:
+            del self._flagged[key]
+            return 0.0
+
+        return until - now
+
+    def hit(self, key: typing.Hashable, now: typing.Optional[float] = None) -> bool:
+        """Records a hit for a key and flags it if it is part of a burst.
+
+        Arguments:
+            key: The key that was hit.
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            True if this hit started a burst, false if not.
+        """
+        now = time.monotonic() if now is None else now
+        self._limiter.hit(key, now)
+
+        if self._limiter.retry_after(key, now) == 0 or self.flagged_for(key, now):
+            return False
+
+        self._flagged[key] = now + self.cooldown
+        return True
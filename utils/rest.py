@@ -0,0 +1,424 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hikari
+import logging
+import time
+import typing
+
+from hikari.impl import buckets
+from hikari.impl import rest as rest_impl
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NEGATIVE_TTL = 30.0
+
+# Requests made for users, and requests made by maintenance work
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Requests left in a bucket which background requests don't use
+DEFAULT_BACKGROUND_RESERVE = 1
+
+# Seconds a background request is held back at most before it is sent anyway
+DEFAULT_BACKGROUND_MAX_DELAY = 30.0
+
+# Seconds between checks of whether the global rate limit is still in effect, as
+# hikari doesn't expose when it ends
+GLOBAL_THROTTLE_POLL_INTERVAL = 0.5
+
+# Number of negative cache entries at which expired entries are swept
+PRUNE_THRESHOLD = 1000
+
+lookups_total = metrics.registry.counter(
+    "campfire_rest_lookups_total",
+    "Entity lookups by call site and how they were answered. Every outcome other "
+    "than fetched saved a REST request.",
+    ("site", "outcome"),
+)
+lane_wait_seconds = metrics.registry.histogram(
+    "campfire_rest_lane_wait_seconds",
+    "Time requests were held back by their lane before being sent.",
+    ("lane",),
+)
+lane_delays_total = metrics.registry.counter(
+    "campfire_rest_lane_delays_total",
+    "Background requests held back, by what they were waiting for.",
+    ("reason",),
+)
+
+current_lane = contextvars.ContextVar("current_lane", default=INTERACTIVE)
+
+
+class RestLookups:
+    """Looks up guilds, channels, users and members with as few requests as possible.
+
+    Lookups are answered from the gateway cache when the entity is cached. Otherwise
+    a request is made, and identical lookups made while it is in flight wait for
+    the same request instead of making their own. Entities which weren't found are
+    remembered for a short time so repeated lookups fail without a request.
+
+    Every lookup is counted by the call site it was made from and how it was
+    answered: from the cache, by joining an in flight request, from the negative
+    cache, or by a request of its own.
+
+    Attributes:
+        app: The bot application to look entities up with.
+        negative_ttl: The number of seconds an entity which wasn't found is
+            remembered for.
+    """
+
+    def __init__(self) -> None:
+        self.app = None
+        self.negative_ttl = DEFAULT_NEGATIVE_TTL
+        self._in_flight: typing.Dict[tuple, typing.Tuple[asyncio.Task, str]] = {}
+        self._missing: typing.Dict[
+            tuple, typing.Tuple[float, hikari.NotFoundError]
+        ] = {}
+
+    async def fetch_guild(
+        self, guild_id: hikari.Snowflakeish, site: str
+    ) -> hikari.Guild:
+        """Looks up a guild.
+
+        Arguments:
+            guild_id: The ID of the guild.
+            site: The name of the call site, used to label the lookup.
+
+        Returns:
+            The guild.
+
+        Raises:
+            hikari.NotFoundError: The guild doesn't exist or the bot isn't in it.
+        """
+        return await self._lookup(
+            ("guild", guild_id),
+            site,
+            self.app.cache.get_guild(guild_id),
+            lambda: self.app.rest.fetch_guild(guild_id),
+        )
+
+    async def fetch_channel(
+        self, channel_id: hikari.Snowflakeish, site: str
+    ) -> hikari.PartialChannel:
+        """Looks up a channel.
+
+        Arguments:
+            channel_id: The ID of the channel.
+            site: The name of the call site, used to label the lookup.
+
+        Returns:
+            The channel.
+
+        Raises:
+            hikari.NotFoundError: The channel doesn't exist.
+        """
+        return await self._lookup(
+            ("channel", channel_id),
+            site,
+            self.app.cache.get_guild_channel(channel_id),
+            lambda: self.app.rest.fetch_channel(channel_id),
+        )
+
+    async def fetch_user(self, user_id: hikari.Snowflakeish, site: str) -> hikari.User:
+        """Looks up a user.
+
+        Arguments:
+            user_id: The ID of the user.
+            site: The name of the call site, used to label the lookup.
+
+        Returns:
+            The user.
+
+        Raises:
+            hikari.NotFoundError: The user doesn't exist.
+        """
+        return await self._lookup(
+            ("user", user_id),
+            site,
+            self.app.cache.get_user(user_id),
+            lambda: self.app.rest.fetch_user(user_id),
+        )
+
+    async def fetch_member(
+        self, guild_id: hikari.Snowflakeish, user_id: hikari.Snowflakeish, site: str
+    ) -> hikari.Member:
+        """Looks up a member of a guild.
+
+        Arguments:
+            guild_id: The ID of the guild.
+            user_id: The ID of the user.
+            site: The name of the call site, used to label the lookup.
+
+        Returns:
+            The member.
+
+        Raises:
+            hikari.NotFoundError: The user isn't in the guild.
+        """
+        return await self._lookup(
+            ("member", guild_id, user_id),
+            site,
+            self.app.cache.get_member(guild_id, user_id),
+            lambda: self.app.rest.fetch_member(guild_id, user_id),
+        )
+
+    async def _lookup(
+        self,
+        key: tuple,
+        site: str,
+        cached: typing.Any,
+        fetch: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Any:
+        if cached is not None:
+            lookups_total.inc(site=site, outcome="cache")
+            return cached
+
+        now = time.monotonic()
+        missing = self._missing.get(key)
+
+        if missing is not None:
+            if missing[0] > now:
+                lookups_total.inc(site=site, outcome="negative")
+                raise missing[1]
+
+            del self._missing[key]
+
+        task, lane = self._in_flight.get(key, (None, None))
+
+        # The request is made in the lane of the lookup which started it, so lookups
+        # for users don't wait on a request held back in the background lane
+        if task is not None and (lane == INTERACTIVE or current_lane.get() == lane):
+            lookups_total.inc(site=site, outcome="coalesced")
+        else:
+            lookups_total.inc(site=site, outcome="fetched")
+            task = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda task: self._finish(key, task))
+            self._in_flight[key] = (task, current_lane.get())
+
+        # Shielded so a cancelled caller doesn't cancel the lookup for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key: tuple, task: asyncio.Task) -> None:
+        if self._in_flight.get(key, (None,))[0] is task:
+            del self._in_flight[key]
+
+        if task.cancelled() or not isinstance(task.exception(), hikari.NotFoundError):
+            return
+
+        now = time.monotonic()
+
+        if len(self._missing) >= PRUNE_THRESHOLD:
+            for expired in [
+                k for k, (until, _) in self._missing.items() if until <= now
+            ]:
+                del self._missing[expired]
+
+        self._missing[key] = (now + self.negative_ttl, task.exception())
+
+
+lookups = RestLookups()
+
+
+class RestLanes:
+    """Gives requests made for users priority over background requests.
+
+    Every request belongs to the lane of the context it is made from, which is the
+    interactive lane unless the code making it runs in the background lane. Startup
+    and scheduled jobs run in the background lane.
+
+    Interactive requests are sent straight away. Background requests are held back
+    while interactive requests are in flight, and while the rate limit bucket of
+    their route is down to its last few requests or the global rate limit is in
+    effect, so maintenance work doesn't use up the requests users are waiting on.
+    A background request is never held back for longer than a set time, so
+    background work slows down under load but isn't starved.
+
+    Attributes:
+        background_reserve: The number of requests left in a bucket which
+            background requests wait rather than use.
+        background_max_delay: The maximum number of seconds a background request
+            is held back for.
+    """
+
+    def __init__(self) -> None:
+        self.background_reserve = DEFAULT_BACKGROUND_RESERVE
+        self.background_max_delay = DEFAULT_BACKGROUND_MAX_DELAY
+        self._interactive = 0
+        self._waiting = 0
+        self._idle: typing.Optional[asyncio.Event] = None
+
+    @contextlib.contextmanager
+    def background(self) -> typing.Iterator[None]:
+        """Runs the code in the block, and tasks it creates, in the background lane.
+
+        Returns:
+            A context manager setting the lane for the duration of the block.
+        """
+        token = current_lane.set(BACKGROUND)
+
+        try:
+            yield
+        finally:
+            current_lane.reset(token)
+
+    def snapshot(self) -> dict:
+        """Returns the current lane statistics.
+
+        Returns:
+            A dictionary of the interactive requests in flight and the background
+            requests being held back.
+        """
+        return {
+            "interactive_in_flight": self._interactive,
+            "background_waiting": self._waiting,
+        }
+
+    def _get_idle(self) -> asyncio.Event:
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._idle.set()
+
+        return self._idle
+
+    def _get_bucket_delay(
+        self, client: rest_impl.RESTClientImpl, compiled_route: typing.Any
+    ) -> float:
+        live_attributes = client._get_live_attributes()
+        now = time.monotonic()
+
+        if live_attributes.global_rate_limit.throttle_task is not None:
+            return GLOBAL_THROTTLE_POLL_INTERVAL
+
+        # Looks the bucket up the same way acquiring it does, without creating it
+        manager = live_attributes.buckets
+
+        try:
+            bucket_hash = manager.routes_to_hashes[compiled_route.route]
+            real_bucket_hash = compiled_route.create_real_bucket_hash(bucket_hash)
+        except KeyError:
+            real_bucket_hash = buckets._create_unknown_hash(compiled_route)
+
+        bucket = manager.real_hashes_to_buckets.get(real_bucket_hash)
+
+        if (
+            bucket is None
+            or bucket.is_unknown
+            or bucket.remaining > self.background_reserve
+        ):
+            return 0.0
+
+        return bucket.reset_at - now
+
+    async def _hold_back(
+        self,
+        client: rest_impl.RESTClientImpl,
+        compiled_route: typing.Any,
+        deadline: float,
+    ) -> None:
+        idle = self._get_idle()
+
+        while True:
+            now = time.monotonic()
+            bucket_delay = self._get_bucket_delay(client, compiled_route)
+
+            if now >= deadline or (bucket_delay <= 0 and idle.is_set()):
+                return
+
+            if bucket_delay > 0:
+                lane_delays_total.inc(reason="bucket")
+                await asyncio.sleep(min(bucket_delay, deadline - now))
+                continue
+
+            lane_delays_total.inc(reason="interactive")
+
+            try:
+                await asyncio.wait_for(idle.wait(), deadline - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def enter(
+        self, client: rest_impl.RESTClientImpl, compiled_route: typing.Any
+    ) -> str:
+        """Waits until a request may be sent in the current lane.
+
+        Arguments:
+            client: The REST client sending the request.
+            compiled_route: The route of the request.
+
+        Returns:
+            The lane of the request, to pass to exit once it is finished.
+        """
+        lane = current_lane.get()
+        idle = self._get_idle()
+
+        if lane == INTERACTIVE:
+            self._interactive += 1
+            idle.clear()
+            lane_wait_seconds.observe(0.0, lane=lane)
+            return lane
+
+        start = time.monotonic()
+        deadline = start + self.background_max_delay
+        self._waiting += 1
+
+        try:
+            await self._hold_back(client, compiled_route, deadline)
+        except Exception:
+            # Holding a request back must never fail the request itself
+            logger.exception("failed to check rate limits of a background request")
+        finally:
+            self._waiting -= 1
+            lane_wait_seconds.observe(time.monotonic() - start, lane=lane)
+
+        return lane
+
+    def exit(self, lane: str) -> None:
+        """Marks a request entered with enter as finished.
+
+        Arguments:
+            lane: The lane returned by enter.
+
+        Returns:
+            None.
+        """
+        if lane != INTERACTIVE:
+            return
+
+        self._interactive -= 1
+
+        if self._interactive == 0:
+            self._get_idle().set()
+
+
+lanes = RestLanes()
+
+
+def install_lanes() -> None:
+    """Wraps hikari's REST request internals to send requests through the lanes.
+
+    Hikari has no hooks for scheduling REST requests, so the private methods of the
+    pinned version are wrapped, as with the metrics hooks. Installing the lanes more
+    than once has no effect.
+
+    Returns:
+        None.
+    """
+    if getattr(rest_impl.RESTClientImpl._request, "__laned__", False):
+        return
+
+    request = rest_impl.RESTClientImpl._request
+
+    @functools.wraps(request)
+    async def wrapper(self, compiled_route, **kwargs):
+        lane = await lanes.enter(self, compiled_route)
+
+        try:
+            return await request(self, compiled_route, **kwargs)
+        finally:
+            lanes.exit(lane)
+
+    wrapper.__laned__ = True
+    rest_impl.RESTClientImpl._request = wrapper
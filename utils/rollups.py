@@ -0,0 +1,154 @@
+import collections
+import time
+import typing
+
+from datetime import datetime, timezone
+
+# Period name, length in seconds and how long rollups of the period are kept
+PERIODS = (
+    ("minute", 60, 86400),
+    ("hour", 3600, 31 * 86400),
+    ("day", 86400, None),
+)
+
+
+def get_period_start(period: int, now: float) -> int:
+    """Gets the start of the period a time falls in.
+
+    Arguments:
+        period: The length of the period in seconds.
+        now: The UNIX time.
+
+    Returns:
+        The UNIX time the period starts at.
+    """
+    return int(now // period) * period
+
+
+def to_datetime(timestamp: float) -> datetime:
+    """Converts a UNIX time to an aware UTC datetime.
+
+    Arguments:
+        timestamp: The UNIX time.
+
+    Returns:
+        The datetime.
+    """
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+class RollupAggregator:
+    """Counts events per guild in memory and turns them into rollup writes.
+
+    Events are counted in minute buckets. When the buckets are flushed, the counts
+    are added to minute, hour and day rollup documents, so reading the activity of
+    a day only reads a single document. Buckets falling in the same hour or day are
+    merged first, so a flush makes at most one write per guild and rollup.
+
+    Minute and hour rollups are given an expiry time so they can be removed by a
+    TTL index.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: typing.Dict[
+            typing.Tuple[int, int], typing.Counter[str]
+        ] = collections.defaultdict(collections.Counter)
+
+    def add(
+        self,
+        guild_id: int,
+        metric: str,
+        amount: float = 1,
+        now: typing.Optional[float] = None,
+    ) -> None:
+        """Counts an event.
+
+        Arguments:
+            guild_id: The ID of the guild the event happened in.
+            metric: The name of the metric to count the event towards.
+            amount: The amount to add to the metric.
+            now: The UNIX time of the event. Defaults to the time of the call.
+
+        Returns:
+            None.
+        """
+        if not amount:
+            return
+
+        now = time.time() if now is None else now
+        self._buckets[(guild_id, get_period_start(60, now))][metric] += amount
+
+    def pending(self, guild_id: int) -> typing.Counter[str]:
+        """Gets the counts of a guild which haven't been flushed yet.
+
+        Arguments:
+            guild_id: The ID of the guild.
+
+        Returns:
+            The unflushed total of each metric.
+        """
+        totals = collections.Counter()
+
+        for (bucket_guild_id, _), counts in self._buckets.items():
+            if bucket_guild_id == guild_id:
+                totals.update(counts)
+
+        return totals
+
+    def discard(self, guild_id: int) -> None:
+        """Forgets the unflushed counts of a guild.
+
+        Arguments:
+            guild_id: The ID of the guild.
+
+        Returns:
+            None.
+        """
+        for key in [key for key in self._buckets if key[0] == guild_id]:
+            del self._buckets[key]
+
+    def build_writes(self) -> typing.List[dict]:
+        """Takes the unflushed counts and builds the writes adding them to rollups.
+
+        Returns:
+            The update operations in the serializable format accepted by the write
+            behind queue.
+        """
+        rollups = collections.defaultdict(collections.Counter)
+
+        for (guild_id, minute), counts in self._buckets.items():
+            for period, length, _ in PERIODS:
+                rollups[(guild_id, period, get_period_start(length, minute))].update(
+                    counts
+                )
+
+        self._buckets.clear()
+        retention = {period: kept for period, _, kept in PERIODS}
+        writes = []
+
+        for (guild_id, period, start), counts in rollups.items():
+            update = {"$inc": dict(counts)}
+
+            if retention[period] is not None:
+                update["$setOnInsert"] = {
+                    "expires_at": to_datetime(start + retention[period])
+                }
+
+            writes.append(
+                {
+                    "update_one": {
+                        "filter": {
+                            "guild_id": guild_id,
+                            "period": period,
+                            "start": to_datetime(start),
+                        },
+                        "update": update,
+                        "upsert": True,
+                    }
+                }
+            )
+
+        return writes
+
+    def __len__(self) -> int:
+        return len(self._buckets)
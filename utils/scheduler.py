@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import random
+import time
+import typing
+
+from pymongo import ReturnDocument
+from utils import lifecycle, metrics, rest, schema
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "scheduled_jobs"
+
+DEFAULT_LEASE_DURATION = 300.0
+DEFAULT_POLL_INTERVAL = 30.0
+
+RETRY_DELAY = 5.0
+MAX_RETRY_DELAY = 3600.0
+MAX_ATTEMPTS = 10
+
+schema.register_index(COLLECTION, ["due"])
+schema.register_index(
+    COLLECTION,
+    ["type", "key"],
+    unique=True,
+    partialFilterExpression={"key": {"$exists": True}},
+)
+schema.register_query(COLLECTION, {"due": 0})
+
+JobHandler = typing.Callable[[typing.Any], typing.Awaitable[None]]
+
+job_failures = metrics.registry.counter(
+    "campfire_scheduler_failures_total",
+    "Scheduled jobs which raised an exception.",
+    ("type",),
+)
+
+
+class Scheduler:
+    """Runs deferred and recurring jobs stored in the database.
+
+    Jobs are documents in the scheduled_jobs collection with the time they are due.
+    Each worker claims due jobs of the types it has handlers for by taking a lease
+    on them, so a job is run by one worker at a time. A job whose worker stops
+    before finishing it is run again once its lease expires, so every job runs at
+    least once and handlers should tolerate being repeated.
+
+    Failed jobs are retried with exponential backoff. Recurring jobs are scheduled
+    again after each run, and each handler type runs at most a set number of jobs
+    at once on each worker. Requests made by jobs are made in the background REST
+    lane.
+
+    Attributes:
+        database: The database the jobs are stored in.
+        worker: The number of this worker process.
+        lease_duration: The number of seconds a claimed job is leased for.
+        poll_interval: The maximum number of seconds between checks for due jobs.
+    """
+
+    def __init__(self) -> None:
+        self.database = None
+        self.worker = 0
+        self.lease_duration = DEFAULT_LEASE_DURATION
+        self.poll_interval = DEFAULT_POLL_INTERVAL
+        self._handlers: typing.Dict[str, typing.Tuple[JobHandler, int]] = {}
+        self._running: typing.Dict[str, int] = {}
+        self._wakeup: typing.Optional[asyncio.Event] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def handler(
+        self, plugin_name: str, job_type: str, concurrency: int = 1
+    ) -> typing.Callable[[JobHandler], JobHandler]:
+        """Registers a coroutine function to run jobs of a type.
+
+        Arguments:
+            plugin_name: The name of the plugin the handler belongs to.
+            job_type: The type of jobs the handler runs.
+            concurrency: The maximum number of jobs of the type run at once by
+                each worker.
+
+        Returns:
+            A decorator registering the function and returning it unchanged.
+        """
+
+        def decorator(callback):
+            instrumented = metrics.instrument_handler(
+                callback, plugin_name, callback.__name__, "job"
+            )
+            self._handlers[job_type] = (instrumented, concurrency)
+            self._running[job_type] = 0
+            return callback
+
+        return decorator
+
+    async def schedule(
+        self,
+        job_type: str,
+        delay: float = 0,
+        payload: typing.Any = None,
+        key: typing.Optional[str] = None,
+        interval: typing.Optional[float] = None,
+        jitter: float = 0,
+        worker: typing.Optional[int] = None,
+    ) -> None:
+        """Schedules a job.
+
+        Scheduling a job with the same type and key as an existing job updates its
+        payload and interval but keeps when it is due, so recurring jobs can be
+        scheduled on every start.
+
+        Arguments:
+            job_type: The type of the job.
+            delay: The number of seconds until the job is due.
+            payload: The value passed to the handler. Must be storable in BSON.
+            key: A key identifying the job among jobs of its type.
+            interval: The number of seconds between runs of a recurring job, or
+                None to run it once.
+            jitter: The maximum number of random seconds added to each due time,
+                to spread out jobs scheduled at the same time.
+            worker: The worker which must run the job, or None for any worker.
+
+        Returns:
+            None.
+        """
+        settings = {
+            "payload": payload,
+            "interval": interval,
+            "jitter": jitter,
+            "worker": worker,
+        }
+        state = {
+            "due": time.time() + delay + random.uniform(0, jitter),
+            "lease_until": 0,
+            "attempts": 0,
+        }
+        jobs = self.database[COLLECTION]
+
+        if key is None:
+            await jobs.insert_one({"type": job_type, **settings, **state})
+        else:
+            await jobs.update_one(
+                {"type": job_type, "key": key},
+                {"$set": settings, "$setOnInsert": state},
+                upsert=True,
+            )
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def cancel(self, job_type: str, key: str) -> None:
+        """Cancels a job.
+
+        Arguments:
+            job_type: The type of the job.
+            key: The key the job was scheduled with.
+
+        Returns:
+            None.
+        """
+        await self.database[COLLECTION].delete_one({"type": job_type, "key": key})
+
+    def start(self) -> None:
+        """Starts running due jobs in the background."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="job scheduler")
+
+    async def drain(self) -> None:
+        """Stops claiming jobs.
+
+        Jobs which are already running are tracked and awaited by the lifecycle
+        manager.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _get_claim_filter(self, now: float) -> dict:
+        return {
+            "type": {
+                "$in": [
+                    job_type
+                    for job_type, (_, concurrency) in self._handlers.items()
+                    if self._running[job_type] < concurrency
+                ]
+            },
+            "due": {"$lte": now},
+            "lease_until": {"$lte": now},
+            "worker": {"$in": [None, self.worker]},
+        }
+
+    async def _claim(self) -> typing.Optional[dict]:
+        now = time.time()
+
+        return await self.database[COLLECTION].find_one_and_update(
+            self._get_claim_filter(now),
+            {
+                "$set": {"lease_until": now + self.lease_duration},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("due", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _get_next_due(self) -> typing.Optional[float]:
+        claim_filter = self._get_claim_filter(time.time())
+        del claim_filter["due"]
+
+        cursor = self.database[COLLECTION].find(claim_filter, {"due": 1})
+        documents = await cursor.sort("due", 1).limit(1).to_list(length=1)
+
+        return documents[0]["due"] if documents else None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+
+            try:
+                job = await self._claim()
+
+                while job is not None:
+                    self._running[job["type"]] += 1
+                    lifecycle.manager.spawn(self._execute(job), name=job["type"])
+                    job = await self._claim()
+
+                next_due = await self._get_next_due()
+            except Exception:
+                logger.exception("failed to claim scheduled jobs")
+                next_due = None
+
+            wait = self.poll_interval
+
+            if next_due is not None:
+                wait = min(max(next_due - time.time(), 0), wait)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: dict) -> None:
+        callback, _ = self._handlers[job["type"]]
+        jobs = self.database[COLLECTION]
+        owned = {"_id": job["_id"], "lease_until": job["lease_until"]}
+
+        try:
+            with rest.lanes.background():
+                await callback(job["payload"])
+        except Exception:
+            logger.exception("scheduled job %s failed", job["type"])
+            job_failures.inc(type=job["type"])
+
+            if job["interval"] is None and job["attempts"] >= MAX_ATTEMPTS:
+                logger.error("dropping scheduled job %s after retries", job["type"])
+                await jobs.delete_one(owned)
+            else:
+                delay = min(RETRY_DELAY * 2 ** (job["attempts"] - 1), MAX_RETRY_DELAY)
+                await jobs.update_one(
+                    owned, {"$set": {"due": time.time() + delay, "lease_until": 0}}
+                )
+        else:
+            if job["interval"] is None:
+                await jobs.delete_one(owned)
+            else:
+                due = time.time() + job["interval"] + random.uniform(0, job["jitter"])
+                await jobs.update_one(
+                    owned, {"$set": {"due": due, "lease_until": 0, "attempts": 0}}
+                )
+        finally:
+            self._running[job["type"]] -= 1
+            self._wakeup.set()
+
+
+scheduler = Scheduler()
+lifecycle.manager.on_drain(scheduler.drain, lifecycle.HIGH)
@@ -0,0 +1,134 @@
+import logging
+import typing
+
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+IndexKeys = typing.List[typing.Tuple[str, int]]
+
+_indexes: typing.List[typing.Tuple[str, IndexKeys, dict]] = []
+_queries: typing.List[typing.Tuple[str, dict]] = []
+
+
+def register_index(collection: str, keys: typing.Sequence[str], **options) -> None:
+    """Declares an index that a plugin needs on a collection.
+
+    Plugins call this when they are imported so the indexes can be created before
+    the bot starts handling events.
+
+    Arguments:
+        collection: The name of the collection.
+        keys: The field names to index in ascending order, or (field, direction)
+            pairs.
+        **options: Extra options passed to create_index such as unique or
+            expireAfterSeconds.
+
+    Returns:
+        None.
+    """
+    index_keys = [key if isinstance(key, tuple) else (key, ASCENDING) for key in keys]
+    _indexes.append((collection, index_keys, options))
+
+
+def register_query(collection: str, query: dict) -> None:
+    """Declares a query that a plugin runs on a hot path.
+
+    The values in the query only need to be of the right type. The query plan is
+    checked at startup to make sure an index is used to answer it.
+
+    Arguments:
+        collection: The name of the collection.
+        query: The filter of the query.
+
+    Returns:
+        None.
+    """
+    _queries.append((collection, query))
+
+
+def get_index_name(keys: IndexKeys) -> str:
+    """Returns the default name mongo gives to an index with the keys.
+
+    Arguments:
+        keys: The (field, direction) pairs of the index.
+
+    Returns:
+        The name of the index.
+    """
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def get_plan_stages(plan: dict) -> typing.List[str]:
+    """Collects the name of every stage in a query plan.
+
+    Arguments:
+        plan: The query plan or stage to walk.
+
+    Returns:
+        The names of the stages in the plan.
+    """
+    stages = []
+
+    if "stage" in plan:
+        stages.append(plan["stage"])
+
+    for value in plan.values():
+        if isinstance(value, dict):
+            stages.extend(get_plan_stages(value))
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    stages.extend(get_plan_stages(item))
+
+    return stages
+
+
+async def ensure_indexes(database) -> typing.List[str]:
+    """Creates any declared indexes that are missing from the database.
+
+    Arguments:
+        database: The database to create the indexes in.
+
+    Returns:
+        The names of the indexes that were created.
+    """
+    created = []
+    existing = {}
+
+    for collection, keys, options in _indexes:
+        if collection not in existing:
+            existing[collection] = await database[collection].index_information()
+
+        options = dict(options)
+        name = options.pop("name", get_index_name(keys))
+
+        if name in existing[collection]:
+            continue
+
+        await database[collection].create_index(keys, name=name, **options)
+        existing[collection][name] = {"key": keys}
+        created.append(f"{collection}.{name}")
+
+    return created
+
+
+async def verify_query_plans(database) -> typing.List[typing.Tuple[str, dict]]:
+    """Explains every declared query and finds the ones answered by a scan.
+
+    Arguments:
+        database: The database to explain the queries against.
+
+    Returns:
+        The collection and filter of every query whose plan is a collection scan.
+    """
+    scans = []
+
+    for collection, query in _queries:
+        explanation = await database[collection].find(query).explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+
+        if "COLLSCAN" in get_plan_stages(winning_plan):
+            scans.append((collection, query))
+
+    return scans
@@ -0,0 +1,90 @@
+import time
+import typing
+
+
+def get_duration_string(seconds: float) -> str:
+    """Formats a number of seconds as hours and minutes.
+
+    Arguments:
+        seconds: The number of seconds.
+
+    Returns:
+        The formatted string.
+    """
+    hours, minutes = divmod(int(seconds // 60), 60)
+
+    return f"{hours}h {minutes}m"
+
+
+class SessionTracker:
+    """Tracks how long keys have been in an ongoing session.
+
+    Time spent in a session is handed out as it is credited, either when the session
+    ends or when every ongoing session is collected, so long sessions can be counted
+    before they end without counting any time twice.
+    """
+
+    def __init__(self) -> None:
+        self._credited: typing.Dict[typing.Hashable, float] = {}
+
+    def start(self, key: typing.Hashable, now: typing.Optional[float] = None) -> None:
+        """Starts a session for a key if it isn't in one already.
+
+        Arguments:
+            key: The key starting a session.
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            None.
+        """
+        now = time.monotonic() if now is None else now
+        self._credited.setdefault(key, now)
+
+    def end(self, key: typing.Hashable, now: typing.Optional[float] = None) -> float:
+        """Ends the session of a key.
+
+        Arguments:
+            key: The key ending its session.
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            The number of seconds since the session was last credited, or 0 if the
+            key wasn't in a session.
+        """
+        now = time.monotonic() if now is None else now
+        credited = self._credited.pop(key, None)
+
+        if credited is None:
+            return 0.0
+
+        return max(now - credited, 0.0)
+
+    def collect(
+        self, now: typing.Optional[float] = None
+    ) -> typing.Dict[typing.Hashable, float]:
+        """Credits the time spent in every ongoing session so far.
+
+        Arguments:
+            now: The current monotonic time. Defaults to the time of the call.
+
+        Returns:
+            The number of seconds since each session was last credited, by key.
+        """
+        now = time.monotonic() if now is None else now
+        collected = {
+            key: max(now - credited, 0.0) for key, credited in self._credited.items()
+        }
+
+        for key in collected:
+            self._credited[key] = now
+
+        return collected
+
+    def __iter__(self) -> typing.Iterator[typing.Hashable]:
+        return iter(self._credited)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._credited
+
+    def __len__(self) -> int:
+        return len(self._credited)
@@ -0,0 +1,39 @@
+import hikari
+import typing
+
+
+def get_worker_shards(worker: int, workers: int, shard_count: int) -> typing.Set[int]:
+    """Gets the contiguous range of shards a worker process is responsible for.
+
+    Shards are split as evenly as possible, with the first workers taking one extra
+    shard each if the shards don't divide evenly.
+
+    Arguments:
+        worker: The zero-indexed number of the worker.
+        workers: The total number of workers.
+        shard_count: The total number of shards.
+
+    Returns:
+        The IDs of the shards the worker should run.
+    """
+    size, remainder = divmod(shard_count, workers)
+    start = worker * size + min(worker, remainder)
+    end = start + size + (1 if worker < remainder else 0)
+
+    return set(range(start, end))
+
+
+def owns_guild(bot: hikari.GatewayBot, guild_id: hikari.Snowflakeish) -> bool:
+    """Checks if a guild is handled by one of the shards in this process.
+
+    Arguments:
+        bot: The bot application.
+        guild_id: The ID of the guild.
+
+    Returns:
+        True if the guild belongs to a shard run by this process, false if not.
+    """
+    if not bot.shards:
+        return True
+
+    return hikari.snowflakes.calculate_shard_id(bot, guild_id) in bot.shards
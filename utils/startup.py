@@ -0,0 +1,162 @@
+import asyncio
+import importlib
+import logging
+import pathlib
+import time
+import types
+import typing
+
+import lightbulb
+
+from utils import metrics, rest
+
+logger = logging.getLogger(__name__)
+
+# Priorities of startup jobs, lower values run first
+HIGH = 0
+NORMAL = 10
+LOW = 20
+
+# Seconds to wait after connecting before running startup jobs
+DEFAULT_DELAY = 10.0
+
+extension_import_seconds = metrics.registry.histogram(
+    "campfire_extension_import_seconds",
+    "Time taken to import each extension.",
+    ("extension",),
+)
+extension_load_seconds = metrics.registry.histogram(
+    "campfire_extension_load_seconds",
+    "Time taken to load each extension into the bot.",
+    ("extension",),
+)
+
+
+def import_extensions(path: str) -> typing.Dict[str, types.ModuleType]:
+    """Imports every extension in a directory and times each one.
+
+    Extensions are imported before the bot is created so the gateway intents and
+    cache components they need can be read from them.
+
+    Arguments:
+        path: The directory of the extensions, relative to the working directory.
+
+    Returns:
+        The extension modules, by name.
+    """
+    modules = {}
+
+    for extension_path in sorted(pathlib.Path(path).glob("[!_]*.py")):
+        name = ".".join(extension_path.with_suffix("").parts)
+
+        started_at = time.perf_counter()
+        modules[name] = importlib.import_module(name)
+        elapsed = time.perf_counter() - started_at
+
+        extension_import_seconds.observe(elapsed, extension=name)
+        logger.info("imported %s in %.3fs", name, elapsed)
+
+    return modules
+
+
+def load_extensions(
+    bot: lightbulb.BotApp, modules: typing.Dict[str, types.ModuleType]
+) -> typing.Dict[str, float]:
+    """Loads imported extensions into the bot and times each one.
+
+    Behaves like lightbulb's load_extensions_from, but takes modules imported by
+    import_extensions so the import and the load function are timed separately.
+
+    Arguments:
+        bot: The bot application to load the extensions into.
+        modules: The extension modules, by name.
+
+    Returns:
+        The load time in seconds of each extension, by name.
+    """
+    timings = {}
+
+    for name in modules:
+        started_at = time.perf_counter()
+        bot.load_extensions(name)
+        timings[name] = time.perf_counter() - started_at
+
+        extension_load_seconds.observe(timings[name], extension=name)
+        logger.info("loaded %s in %.3fs", name, timings[name])
+
+    return timings
+
+
+class StartupJobs:
+    """Background jobs run once after the bot connects.
+
+    Jobs such as reconciling the database with discord are run one at a time in
+    order of priority once the bot has connected, instead of all at once, so they
+    don't compete with commands for REST and database capacity. Their requests are
+    made in the background REST lane.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: typing.List[
+            typing.Tuple[int, int, str, typing.Callable[[], typing.Awaitable[None]]]
+        ] = []
+
+    def register(
+        self, plugin_name: str, priority: int = NORMAL
+    ) -> typing.Callable[
+        [typing.Callable[[], typing.Awaitable[None]]],
+        typing.Callable[[], typing.Awaitable[None]],
+    ]:
+        """Registers a coroutine function to run as a startup job.
+
+        Jobs with the same priority run in the order they were registered.
+
+        Arguments:
+            plugin_name: The name of the plugin the job belongs to.
+            priority: The priority of the job, lower values run first.
+
+        Returns:
+            A decorator registering the function and returning it unchanged.
+        """
+
+        def decorator(callback):
+            name = f"{plugin_name}/{callback.__name__}"
+            instrumented = metrics.instrument_handler(
+                callback, plugin_name, callback.__name__, "job"
+            )
+            self._jobs.append((priority, len(self._jobs), name, instrumented))
+            return callback
+
+        return decorator
+
+    async def run(self, delay: float = 0) -> None:
+        """Runs every registered job once, in order of priority.
+
+        A failing job is logged and doesn't stop the jobs after it.
+
+        Arguments:
+            delay: The number of seconds to wait before running the first job.
+
+        Returns:
+            None.
+        """
+        await asyncio.sleep(delay)
+
+        for _, _, name, callback in sorted(self._jobs, key=lambda job: job[:2]):
+            started_at = time.perf_counter()
+
+            try:
+                with rest.lanes.background():
+                    await callback()
+            except Exception:
+                logger.exception("startup job %s failed", name)
+                continue
+
+            logger.info(
+                "startup job %s finished in %.3fs",
+                name,
+                time.perf_counter() - started_at,
+            )
+
+
+jobs = StartupJobs()
@@ -0,0 +1,86 @@
+import heapq
+import itertools
+import typing
+
+
+class TimerHeap:
+    """Timers ordered by when they are due.
+
+    Timers are kept in a heap, so scheduling a timer and taking the due ones costs
+    O(log n) each regardless of how many timers are waiting. Each timer has a key,
+    and scheduling a key again replaces its timer. Cancelled and replaced timers are
+    left in the heap and skipped when they come up.
+    """
+
+    def __init__(self) -> None:
+        self._heap: typing.List[tuple] = []
+        self._timers: typing.Dict[typing.Hashable, int] = {}
+        self._counter = itertools.count()
+
+    def schedule(self, when: float, key: typing.Hashable, payload: typing.Any) -> None:
+        """Schedules a timer, replacing any timer with the same key.
+
+        Arguments:
+            when: The UNIX time the timer is due.
+            key: The key of the timer.
+            payload: The value returned when the timer is due.
+
+        Returns:
+            None.
+        """
+        sequence = next(self._counter)
+        self._timers[key] = sequence
+        heapq.heappush(self._heap, (when, sequence, key, payload))
+
+    def cancel(self, key: typing.Hashable) -> None:
+        """Cancels the timer with a key if there is one.
+
+        Arguments:
+            key: The key of the timer.
+
+        Returns:
+            None.
+        """
+        self._timers.pop(key, None)
+
+    def _discard_stale(self) -> None:
+        while self._heap and self._timers.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> typing.Optional[float]:
+        """Gets when the next timer is due.
+
+        Returns:
+            The UNIX time the next timer is due, or None if there are no timers.
+        """
+        self._discard_stale()
+
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(
+        self, now: float
+    ) -> typing.List[typing.Tuple[typing.Hashable, typing.Any]]:
+        """Removes and returns every timer which is due.
+
+        Arguments:
+            now: The current UNIX time.
+
+        Returns:
+            Pairs of key and payload of the due timers, in the order they were due.
+        """
+        due = []
+        self._discard_stale()
+
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key, payload = heapq.heappop(self._heap)
+            del self._timers[key]
+            due.append((key, payload))
+            self._discard_stale()
+
+        return due
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._timers
+
+    def __len__(self) -> int:
+        return len(self._timers)
@@ -0,0 +1,196 @@
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+import typing
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_SLOW_THRESHOLD = 0.5
+
+_settings = {
+    "sample_rate": DEFAULT_SAMPLE_RATE,
+    "slow_threshold": DEFAULT_SLOW_THRESHOLD,
+}
+
+
+class Span:
+    """A timed operation within a trace.
+
+    Attributes:
+        name: The name of the operation.
+        attributes: Extra details about the operation.
+        start: The perf counter value when the operation started.
+        end: The perf counter value when the operation ended, or None if running.
+        children: The spans of operations started during this operation.
+    """
+
+    __slots__ = ("name", "attributes", "start", "end", "children")
+
+    def __init__(self, name: str, attributes: dict, start: float) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.start = start
+        self.end: typing.Optional[float] = None
+        self.children: typing.List[Span] = []
+
+    @property
+    def duration(self) -> float:
+        """The duration of the span in seconds, up to now if it is still running."""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float) -> dict:
+        """Converts the span and its children to a serializable dictionary.
+
+        Arguments:
+            origin: The start of the root span, which offsets are relative to.
+
+        Returns:
+            The span as a dictionary.
+        """
+        data = {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+
+        if self.attributes:
+            data["attributes"] = self.attributes
+
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+
+        return data
+
+
+current_span: contextvars.ContextVar[typing.Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def configure(sample_rate: float, slow_threshold: float) -> None:
+    """Sets how often traces are recorded and how slow a trace must be to be dumped.
+
+    Arguments:
+        sample_rate: The fraction of invocations to trace, between 0 and 1.
+        slow_threshold: The duration in seconds above which a trace is dumped.
+
+    Returns:
+        None.
+    """
+    _settings["sample_rate"] = sample_rate
+    _settings["slow_threshold"] = slow_threshold
+
+
+@contextlib.contextmanager
+def trace(name: str, **attributes) -> typing.Iterator[typing.Optional[Span]]:
+    """Opens the root span of a trace for a command or listener invocation.
+
+    Every invocation is timed, but only a sample of invocations record the spans of
+    the operations they start. Unsampled invocations get no span, so the child spans
+    opened during them cost a single context variable lookup. Any invocation slower
+    than the threshold is logged as JSON, without child spans if it wasn't sampled.
+
+    Arguments:
+        name: The name of the invocation.
+        **attributes: Extra details about the invocation.
+
+    Returns:
+        The root span, or None if the invocation is not sampled.
+    """
+    start = time.perf_counter()
+
+    if random.random() >= _settings["sample_rate"]:
+        try:
+            yield None
+        finally:
+            end = time.perf_counter()
+
+            if end - start >= _settings["slow_threshold"]:
+                root = Span(name, {**attributes, "sampled": False}, start)
+                root.end = end
+                dump_trace(root)
+
+        return
+
+    root = Span(name, attributes, start)
+    token = current_span.set(root)
+
+    try:
+        yield root
+    finally:
+        root.end = time.perf_counter()
+        current_span.reset(token)
+
+        if root.duration >= _settings["slow_threshold"]:
+            dump_trace(root)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> typing.Iterator[typing.Optional[Span]]:
+    """Opens a child span of the current span.
+
+    Arguments:
+        name: The name of the operation.
+        **attributes: Extra details about the operation.
+
+    Returns:
+        The child span, or None if the current invocation is not traced.
+    """
+    parent = current_span.get()
+
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, attributes, time.perf_counter())
+    parent.children.append(child)
+    token = current_span.set(child)
+
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        current_span.reset(token)
+
+
+def record_span(name: str, duration: float, **attributes) -> None:
+    """Adds an operation which just finished as a child of the current span.
+
+    Used for operations timed elsewhere, such as database commands reported by the
+    driver once they complete.
+
+    Arguments:
+        name: The name of the operation.
+        duration: The duration of the operation in seconds.
+        **attributes: Extra details about the operation.
+
+    Returns:
+        None.
+    """
+    parent = current_span.get()
+
+    if parent is None:
+        return
+
+    end = time.perf_counter()
+    child = Span(name, attributes, end - duration)
+    child.end = end
+    parent.children.append(child)
+
+
+def dump_trace(root: Span) -> None:
+    """Logs a trace as structured JSON.
+
+    Arguments:
+        root: The root span of the trace.
+
+    Returns:
+        None.
+    """
+    data = {"trace_id": uuid.uuid4().hex, **root.to_dict(root.start)}
+    logger.warning("slow trace %s", json.dumps(data, default=str))
@@ -0,0 +1,312 @@
+import asyncio
+import collections
+import itertools
+import logging
+import time
+import typing
+
+from pymongo.errors import (
+    BulkWriteError,
+    ConnectionFailure,
+    PyMongoError,
+    ServerSelectionTimeoutError,
+)
+from utils import lifecycle, metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_DEPTH = 10000
+
+INITIAL_BACKOFF = 0.1
+MAX_BACKOFF = 30.0
+
+flush_seconds = metrics.registry.histogram(
+    "campfire_writebehind_flush_seconds",
+    "Duration of write-behind batch writes, including retries.",
+    ("collection",),
+)
+flush_failures = metrics.registry.counter(
+    "campfire_writebehind_failures_total",
+    "Write-behind batch writes that failed.",
+    ("collection", "reason"),
+)
+
+
+def is_unsent(error: PyMongoError) -> bool:
+    """Checks if a failed write certainly wasn't applied and is worth retrying.
+
+    No server could be selected, or the server refused the write without applying
+    it, such as after stepping down. Other connection errors may happen after the
+    server applied the write, so retrying them could apply it twice.
+
+    Arguments:
+        error: The error raised by the write.
+
+    Returns:
+        True if the write wasn't applied and may succeed when retried, false if not.
+    """
+    if isinstance(error, ServerSelectionTimeoutError):
+        return True
+
+    return not isinstance(error, ConnectionFailure) and error.has_error_label(
+        "RetryableWriteError"
+    )
+
+
+class WriteBehindQueue:
+    """Buffers writes which callers don't need to wait for.
+
+    Submitted operations are queued per collection and written in ordered
+    bulk_write batches by a background task. Batches which certainly weren't
+    applied are retried with exponential backoff, while operations rejected by the
+    server are logged and dropped. Once the queue holds the maximum number of
+    operations, submitting flushes it first, which slows down callers until the
+    database catches up.
+
+    Operations are applied at most once, so they don't need to be idempotent. A
+    batch which may have reached the server before failing, such as one cut off by
+    a network error or cancelled while being written, is logged and dropped rather
+    than retried or checkpointed.
+
+    Attributes:
+        database: The database the operations are written to.
+        flush_interval: The number of seconds between flushes.
+        batch_size: The maximum number of operations per bulk write.
+        max_depth: The number of queued operations at which submitting blocks.
+    """
+
+    def __init__(self) -> None:
+        self.database = None
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.max_depth = DEFAULT_MAX_DEPTH
+        self._pending: typing.Dict[str, typing.Deque[typing.Tuple[float, dict]]] = {}
+        self._depth = 0
+        self._lock: typing.Optional[asyncio.Lock] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """The number of queued operations."""
+        return self._depth
+
+    def has_pending(self, collection: str) -> bool:
+        """Checks if a collection has queued operations.
+
+        Arguments:
+            collection: The name of the collection.
+
+        Returns:
+            True if there are operations waiting to be written.
+        """
+        return bool(self._pending.get(collection))
+
+    async def submit(self, collection: str, operation: dict) -> None:
+        """Queues a write operation.
+
+        Arguments:
+            collection: The name of the collection to write to.
+            operation: The write operation, in the format taken by to_request.
+
+        Returns:
+            None.
+        """
+        if self._depth >= self.max_depth:
+            await self.flush()
+
+        self._pending.setdefault(collection, collections.deque()).append(
+            (time.monotonic(), operation)
+        )
+        self._depth += 1
+
+    async def flush(self, collection: typing.Optional[str] = None) -> None:
+        """Writes the queued operations of a collection, or of every collection.
+
+        Only one flush runs at a time. Batches which weren't applied are retried
+        until the operations are written or the flush is cancelled.
+
+        Arguments:
+            collection: The name of the collection to flush. Flushes every
+                collection if None.
+
+        Returns:
+            None.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            names = [collection] if collection is not None else list(self._pending)
+
+            for name in names:
+                pending = self._pending.get(name)
+
+                while pending:
+                    batch = [
+                        operation
+                        for _, operation in itertools.islice(pending, self.batch_size)
+                    ]
+                    written = await self._write_batch(name, batch)
+                    self._discard(name, written)
+
+    async def _write_batch(self, collection: str, batch: typing.List[dict]) -> int:
+        """Writes a batch of operations, retrying errors which left it unapplied.
+
+        The batch is removed from the queue if the write is cancelled, as the
+        server may apply it anyway.
+
+        Arguments:
+            collection: The name of the collection to write to.
+            batch: The write operations.
+
+        Returns:
+            The number of operations from the start of the batch which were written
+            or dropped, and can be removed from the queue.
+        """
+        backoff = INITIAL_BACKOFF
+        start = time.perf_counter()
+
+        while True:
+            try:
+                await self.database[collection].bulk_write(
+                    [lifecycle.to_request(operation) for operation in batch]
+                )
+                flush_seconds.observe(
+                    time.perf_counter() - start, collection=collection
+                )
+                return len(batch)
+
+            except asyncio.CancelledError:
+                self._discard(collection, len(batch))
+                flush_failures.inc(collection=collection, reason="unknown")
+                logger.error(
+                    "dropping %d writes to %s cancelled while being written",
+                    len(batch),
+                    collection,
+                )
+                raise
+
+            except BulkWriteError as error:
+                write_errors = error.details.get("writeErrors", [])
+
+                if not write_errors:
+                    # Every write was applied, but not acknowledged by enough members
+                    flush_failures.inc(collection=collection, reason="write_concern")
+                    logger.warning(
+                        "writes to %s were not replicated in time: %s",
+                        collection,
+                        error.details.get("writeConcernErrors"),
+                    )
+                    return len(batch)
+
+                # Writes are ordered, so everything before the first error succeeded
+                index = write_errors[0]["index"]
+                flush_failures.inc(collection=collection, reason="rejected")
+                logger.error(
+                    "dropping write to %s rejected by the server: %s",
+                    collection,
+                    batch[index],
+                )
+                return index + 1
+
+            except PyMongoError as error:
+                if isinstance(error, ConnectionFailure) and not is_unsent(error):
+                    # The server may have applied the writes before the connection
+                    # failed, so retrying could apply them twice
+                    flush_failures.inc(collection=collection, reason="unknown")
+                    logger.error(
+                        "dropping %d writes to %s which may not have been applied: %s",
+                        len(batch),
+                        collection,
+                        error,
+                    )
+                    return len(batch)
+
+                if not is_unsent(error):
+                    flush_failures.inc(collection=collection, reason="error")
+                    raise
+
+                flush_failures.inc(collection=collection, reason="transient")
+                logger.warning(
+                    "retrying writes to %s in %.1fs: %s", collection, backoff, error
+                )
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _discard(self, collection: str, count: int) -> None:
+        """Removes operations from the front of a collection's queue.
+
+        Arguments:
+            collection: The name of the collection.
+            count: The number of operations to remove.
+
+        Returns:
+            None.
+        """
+        pending = self._pending[collection]
+
+        for _ in range(count):
+            pending.popleft()
+
+        self._depth -= count
+
+    def snapshot(self) -> dict:
+        """Returns the current queue statistics.
+
+        Returns:
+            A dictionary of the queue depth and the age of the oldest operation.
+        """
+        now = time.monotonic()
+        oldest = min(
+            (pending[0][0] for pending in self._pending.values() if pending),
+            default=now,
+        )
+
+        return {"depth": self._depth, "oldest_age": now - oldest}
+
+    def pending(
+        self, collection: typing.Optional[str] = None
+    ) -> typing.List[typing.Tuple[str, typing.List[dict]]]:
+        """Returns the queued operations of each collection.
+
+        Arguments:
+            collection: The name of the collection to return the operations of.
+                Returns the operations of every collection if None.
+
+        Returns:
+            Pairs of collection name and queued write operations.
+        """
+        return [
+            (name, [operation for _, operation in pending])
+            for name, pending in self._pending.items()
+            if pending and collection in (None, name)
+        ]
+
+    def start(self) -> None:
+        """Starts flushing the queue periodically in the background."""
+        self._task = asyncio.create_task(self._run(), name="write-behind flusher")
+
+    async def drain(self) -> None:
+        """Stops the periodic flushes and writes every queued operation."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("write-behind flush failed")
+
+
+queue = WriteBehindQueue()
+# Runs after the hooks which queue their final writes
+lifecycle.manager.on_drain(queue.drain, lifecycle.LOW)
+lifecycle.manager.on_checkpoint(queue.pending)